@@ -26,6 +26,61 @@ const SENDER_BOT = 'bot';
 const BOT_NAME = 'Liepāja Helper Bot';
 const generateId = () => Date.now().toString() + Math.random().toString();
 
+// --- Streaming backend call ---
+// The backend answers /send-message-stream/ with Server-Sent Events ('thread', 'tool_call', 'delta', 'done').
+// React Native's fetch can't read a body incrementally, so XMLHttpRequest progress events are used instead.
+interface StreamEvent {
+  type: 'thread' | 'tool_call' | 'delta' | 'done';
+  thread_id?: string | null;
+  text?: string;
+  name?: string;
+  answer?: string;
+}
+
+const streamChatReply = (url: string, body: object, idempotencyKey: string, onEvent: (event: StreamEvent) => void): Promise<StreamEvent> =>
+  new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+    let parsedUpTo = 0;
+    let finalEvent: StreamEvent | null = null;
+
+    const parseNewFrames = () => {
+      const frames = xhr.responseText.slice(parsedUpTo).split('\n\n');
+      frames.pop(); // Last piece may be an incomplete frame, wait for more data
+      for (const frame of frames) {
+        parsedUpTo += frame.length + 2;
+        const dataLine = frame.split('\n').find((line) => line.startsWith('data: '));
+        if (!dataLine) continue;
+        try {
+          const event: StreamEvent = JSON.parse(dataLine.slice(6));
+          if (event.type === 'done') finalEvent = event;
+          onEvent(event);
+        } catch (e) { /* Ignore malformed frame */ }
+      }
+    };
+
+    xhr.open('POST', url);
+    xhr.setRequestHeader('Content-Type', 'application/json');
+    xhr.setRequestHeader('Accept', 'text/event-stream');
+    xhr.setRequestHeader('Idempotency-Key', idempotencyKey); // Lets the backend drop duplicate submissions
+    xhr.onprogress = parseNewFrames;
+    xhr.onload = () => {
+      if (xhr.status < 200 || xhr.status >= 300) {
+        let errorMsg = xhr.statusText;
+        try {
+          const errorData = JSON.parse(xhr.responseText);
+          errorMsg = errorData.detail || errorData.reply || errorMsg; // Try to get detail from backend
+        } catch (e) { /* Ignore if not JSON */ }
+        reject(new Error(`API Error: ${errorMsg} (${xhr.status})`));
+        return;
+      }
+      parseNewFrames();
+      if (finalEvent) resolve(finalEvent);
+      else reject(new Error('Connection closed before the reply was complete.'));
+    };
+    xhr.onerror = () => reject(new Error('Could not connect to server.'));
+    xhr.send(JSON.stringify(body));
+  });
+
 // --- React Component ---
 export default function ChatBotScreen() {
   const [messages, setMessages] = useState<Message[]>([]);
@@ -117,7 +172,7 @@ export default function ChatBotScreen() {
       // Use http://10.0.2.2:8000 for Android Emulator (if backend is on same machine)
       // Use http://localhost:8000 for iOS Simulator (if backend is on same machine)
       // Use http://YOUR_COMPUTER_LOCAL_IP:8000 for physical device on same WiFi 192.168.0.102
-      const backendUrl = 'http://10.0.2.2:8000/send-message/'; 
+      const backendUrl = 'http://10.0.2.2:8000/send-message-stream/'; 
       // ---------------------------------------------------------
 
       const requestBody: { message: string; thread_id: string | null; latitude?: number; longitude?: number } = {
@@ -133,42 +188,38 @@ export default function ChatBotScreen() {
 
       console.log(`Sending to backend: ${userMessageText}, threadId: ${threadId}`);
 
-      const response = await fetch(backendUrl, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        // ---> CORRECTED: Send the prepared requestBody <---
-        body: JSON.stringify(requestBody),
-        // -------------------------------------------------
+      // Placeholder bot message that fills up as tokens stream in
+      const botMessageId = generateId();
+      let botMessageAdded = false;
+      const showBotText = (text: string) => {
+        if (!botMessageAdded) {
+          botMessageAdded = true;
+          setIsLoading(false);
+          setMessages((prevMessages) => [...prevMessages, { id: botMessageId, text, sender: SENDER_BOT, createdAt: new Date() }]);
+        } else {
+          setMessages((prevMessages) => prevMessages.map((m) => (m.id === botMessageId ? { ...m, text } : m)));
+        }
+      };
+
+      let streamedText = '';
+      const data = await streamChatReply(backendUrl, requestBody, userMessage.id, (event) => {
+        if (event.type === 'thread' && event.thread_id) {
+          if (!threadId) console.log("Received initial threadId:", event.thread_id);
+          setThreadId(event.thread_id);
+        } else if (event.type === 'delta' && event.text) {
+          streamedText += event.text;
+          showBotText(streamedText);
+        }
       });
 
       setIsLoading(false);
-
-      if (!response.ok) {
-        let errorMsg = response.statusText;
-        try {
-          const errorData = await response.json();
-          errorMsg = errorData.detail || errorData.reply || errorMsg; // Try to get detail from backend
-        } catch(e) { /* Ignore if not JSON */ }
-        throw new Error(`API Error: ${errorMsg} (${response.status})`);
-      }
-
-      const data = await response.json();
-      const replyText = data.reply || "Sorry, I received an empty response.";
+      const replyText = data.answer || streamedText || "Sorry, I received an empty response.";
 
       // Store/update the threadId returned from the backend
-      if (data.thread_id) {
-        if(!threadId) console.log("Received initial threadId:", data.thread_id);
-        setThreadId(data.thread_id);
-      }
+      if (data.thread_id) setThreadId(data.thread_id);
 
-      // Create and display bot message
-      const botMessage: Message = {
-        id: generateId(),
-        text: replyText,
-        sender: SENDER_BOT,
-        createdAt: new Date(),
-      };
-      setMessages((prevMessages) => [...prevMessages, botMessage]);
+      // Final text replaces whatever was streamed so far
+      showBotText(replyText);
 
     } catch (error) {
       console.error('Backend query failed:', error);
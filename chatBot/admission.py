@@ -0,0 +1,210 @@
+# admission.py
+
+# Admission control in front of the chat endpoints, so a burst degrades into quick
+# refusals instead of every request timing out together:
+#  - At most max_active requests are worked on at once; the rest wait in a bounded
+#    queue, follow-up turns of existing threads ahead of new conversations.
+#  - Nobody waits longer than max_wait: the request is shed with 503 and Retry-After.
+#  - When the queue is full, a follow-up turn displaces the newest waiting new thread;
+#    otherwise the request is shed at once.
+#  - Token buckets stop single clients from flooding the service (429 with Retry-After).
+#    They are keyed on the peer address, which the client can't choose: the socket peer,
+#    or the X-Forwarded-For address a trusted proxy reports. A generous bucket per address
+#    caps everything behind one NAT; within it, a client's own X-Client-Id only gets a
+#    smaller bucket of its own, so a fresh id never buys more than the address's budget.
+#    Threads have buckets too.
+
+import asyncio
+import heapq
+import ipaddress
+import itertools
+import math
+import time
+
+from telemetry import record_span
+
+FOLLOW_UP, NEW_THREAD = 0, 1 # queue priorities, lower goes first
+MAX_BUCKETS = 50000 # idle buckets are dropped beyond this many
+
+
+def trusted_networks(spec: str) -> list:
+    """'10.0.0.1, 172.16.0.0/12' -> networks whose X-Forwarded-For headers are believed."""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+def peer_address(peer: str | None, forwarded_for: str | None, trusted: list) -> str:
+    """
+    The address to rate limit: the socket peer, unless that is a trusted proxy; then the
+    nearest X-Forwarded-For hop that isn't one (earlier hops are the client's to forge).
+    """
+    def is_trusted(address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in trusted)
+
+    address = peer or "unknown"
+    if forwarded_for and is_trusted(address):
+        for hop in reversed([hop.strip() for hop in forwarded_for.split(",") if hop.strip()]):
+            address = hop
+            if not is_trusted(hop):
+                break
+    return address
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class TokenBuckets:
+    """One token bucket per key: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {} # key -> (tokens, updated_at)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """Seconds until key has a token (0 = it has one now)."""
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        self.buckets[key] = (tokens, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key: str):
+        tokens, updated = self.buckets[key]
+        self.buckets[key] = (tokens - 1, updated)
+        if len(self.buckets) > MAX_BUCKETS:
+            self.prune(time.monotonic())
+
+    def prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, updated) in self.buckets.items() if now - updated > full_after]:
+            del self.buckets[key]
+
+
+class Ticket:
+    """A granted slot. release() is idempotent, so every exit path may call it."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.granted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.granted_at)
+
+
+class AdmissionController:
+    def __init__(self, max_active: int = 128, max_queue: int = 256, max_wait: float = 10.0,
+                 client_rate: float = 0.5, client_burst: float = 10, thread_rate: float = 0.2, thread_burst: float = 5,
+                 peer_rate: float = 5.0, peer_burst: float = 100):
+        """Rates are requests per second; a rate of 0 disables that limit."""
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.peer_limits = TokenBuckets(peer_rate, peer_burst) if peer_rate > 0 else None
+        self.client_limits = TokenBuckets(client_rate, client_burst) if client_rate > 0 else None
+        self.thread_limits = TokenBuckets(thread_rate, thread_burst) if thread_rate > 0 else None
+        self.active = 0
+        self.queue = [] # heap of [priority, seq, future]
+        self.waiting = 0
+        self.seq = itertools.count()
+        self.hold_time = 5.0 # moving average of how long a slot is held, for Retry-After
+        self.stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "shed_queue_full": 0, "shed_timeout": 0,
+                      "displaced": 0}
+
+    async def acquire(self, peer: str, client_id: str | None = None, thread_id: str | None = None) -> Ticket:
+        """
+        Waits for a slot; raises Rejected when rate limited or the service is saturated.
+        peer is the server-side address of the caller, client_id the caller's own (unverified) id.
+        """
+        self._check_rate(peer, client_id, thread_id)
+        if self.active < self.max_active and not self.waiting:
+            return self._grant()
+
+        priority = FOLLOW_UP if thread_id else NEW_THREAD
+        if self.waiting >= self.max_queue and not (priority == FOLLOW_UP and self._displace_new_thread()):
+            self.stats["shed_queue_full"] += 1
+            raise Rejected(503, self._estimated_wait(), "The service is busy, please try again shortly.")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, [priority, next(self.seq), future])
+        self.waiting += 1
+        self.stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.waiting -= 1
+                self.stats["shed_timeout"] += 1
+                raise Rejected(503, self._estimated_wait(), "The service is busy, please try again shortly.")
+            ticket = future.result() # granted (or displaced) at the last moment
+        except asyncio.CancelledError:
+            # The client went away while waiting: give back a slot granted in the meantime
+            if not future.done():
+                future.cancel()
+                self.waiting -= 1
+            elif not future.exception():
+                future.result().release()
+            raise
+        record_span("admission_wait", time.monotonic() - started)
+        return ticket
+
+    def _check_rate(self, peer: str, client_id: str | None, thread_id: str | None):
+        now = time.monotonic()
+        # The client id only narrows the peer's bucket; the peer's own bucket still applies
+        limits = [(self.peer_limits, peer), (self.client_limits, f"{peer} {client_id}" if client_id else peer)]
+        if thread_id:
+            limits.append((self.thread_limits, thread_id))
+        limits = [(buckets, key) for buckets, key in limits if buckets and key]
+        wait = max((buckets.wait_time(key, now) for buckets, key in limits), default=0.0)
+        if wait > 0:
+            self.stats["rate_limited"] += 1
+            raise Rejected(429, wait, "Too many messages, please slow down.")
+        for buckets, key in limits:
+            buckets.take(key)
+
+    def _grant(self) -> Ticket:
+        self.active += 1
+        self.stats["admitted"] += 1
+        return Ticket(self)
+
+    def _release(self, held: float):
+        self.hold_time = 0.9 * self.hold_time + 0.1 * held
+        self.active -= 1
+        # Hand the slot straight to the best waiter still waiting
+        while self.queue and self.active < self.max_active:
+            _, _, future = heapq.heappop(self.queue)
+            if future.done(): # timed out, displaced or cancelled; already uncounted
+                continue
+            self.waiting -= 1
+            future.set_result(self._grant())
+
+    def _displace_new_thread(self) -> bool:
+        """Sheds the most recently queued new-thread request to make room for a follow-up."""
+        candidates = [entry for entry in self.queue if entry[0] == NEW_THREAD and not entry[2].done()]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda entry: entry[1])
+        victim[2].set_exception(Rejected(503, self._estimated_wait(), "The service is busy, please try again shortly."))
+        self.waiting -= 1
+        self.stats["displaced"] += 1
+        return True
+
+    def _estimated_wait(self) -> float:
+        return self.hold_time * (self.waiting + 1) / self.max_active
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "active": self.active, "queue_depth": self.waiting, "max_active": self.max_active,
+                "max_queue": self.max_queue}
@@ -0,0 +1,248 @@
+# answer_cache.py
+
+# Cache of whole answers to first-turn questions ("what events are on this weekend"),
+# so a repeated question skips the run: no model steps, no tool calls.
+#  - Keyed on the normalized question text. Optionally, a question that is merely
+#    worded a little differently matches too: cosine similarity of char trigram TF-IDF
+#    vectors, computed in-process over the cached questions.
+#  - How long an answer stays depends on the tools that produced it: anything built
+#    from the events calendar expires at midnight, place answers last much longer.
+#  - Entries are kept in memory and in the 'answer_cache' table, like the tool cache;
+#    exact lookups fall back to the table, so worker processes share their answers.
+# SpareThreads keeps a few empty OpenAI threads ready, so a cache hit can still hand
+# out a real thread (seeded with the question and answer) without waiting on OpenAI.
+
+import asyncio
+import logging
+import math
+import re
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+
+from events_index import CITY_TIMEZONE, fold
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 6 * 3600 # answers that needed no tool
+PLACE_TTL = 24 * 3600
+ROUTE_TTL = 6 * 3600 # travel times drift with roadworks and timetables
+OPENING_HOURS_TTL = 15 * 60 # "open now" is only true for a while
+# Tool -> TTL in seconds; None means "until midnight" (the answer is about today's calendar)
+TOOL_TTLS = {
+    "get_liepaja_events": None,
+    "find_places_in_liepaja": PLACE_TTL,
+    "get_place_details": OPENING_HOURS_TTL, # includes whether it is open now
+    "check_opening_hours": OPENING_HOURS_TTL,
+    "get_directions": ROUTE_TTL,
+    "get_distance_time": ROUTE_TTL,
+    "get_distance_matrix": ROUTE_TTL,
+}
+NGRAM = 3
+# Words that change which events or times a question is about; near-duplicates must agree on them
+TIME_WORDS = {"today", "tonight", "tomorrow", "yesterday", "this", "next", "weekend", "week", "month", "morning",
+              "evening", "night", "now", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+              "sodien", "rit", "parit", "nakamaja", "nedela", "nedelas", "nogale", "vakar", "vakara"}
+
+
+def normalize_question(text: str) -> str:
+    """'What events are on this weekend?!' -> 'what events are on this weekend'"""
+    return " ".join(re.findall(r"[a-z0-9]+", fold(text).replace("'", "")))
+
+
+def seconds_until_midnight(now: float | None = None) -> float:
+    """Seconds until the next midnight in Liepāja, when the events calendar's "today" changes."""
+    current = datetime.fromtimestamp(now or time.time(), CITY_TIMEZONE)
+    midnight = datetime.combine(current.date() + timedelta(days=1), datetime.min.time(), tzinfo=CITY_TIMEZONE)
+    return midnight.timestamp() - current.timestamp()
+
+
+def ttl_for_tools(tools: set) -> float:
+    """The shortest lifetime among the tools that produced an answer."""
+    ttls = [TOOL_TTLS.get(tool, DEFAULT_TTL) for tool in tools] or [DEFAULT_TTL]
+    return min(seconds_until_midnight() if ttl is None else ttl for ttl in ttls)
+
+
+def question_anchors(key: str) -> set:
+    """Numbers and time words of a normalized question."""
+    return {word for word in key.split() if word.isdigit() or word in TIME_WORDS}
+
+
+def char_ngrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1))
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 1000, similarity: float = 0.0, db_path: str | None = None):
+        """similarity: cosine threshold for near-duplicate questions (0 = exact matches only)."""
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.entries = OrderedDict() # normalized question -> (expires_at, answer)
+        self.grams = {} # normalized question -> Counter of its char n-grams
+        self.doc_freq = Counter() # n-gram -> number of cached questions containing it
+        self.postings = {} # n-gram -> set of cached questions containing it
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "persistent_hits": 0, "stores": 0, "expired": 0,
+                      "evictions": 0}
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    question TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )""")
+            self.db.execute("DELETE FROM answer_cache WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+            rows = self.db.execute("SELECT question, answer, expires_at FROM answer_cache ORDER BY expires_at")
+            for question, answer, expires_at in rows.fetchall()[-max_entries:]:
+                self._remember(question, answer, expires_at)
+
+    # --- Lookup / store ---
+    def get(self, question: str) -> str | None:
+        key = normalize_question(question)
+        if not key:
+            return None
+        now = time.time()
+        answer = self._fresh(key, now)
+        if answer is None and self.db:
+            # Possibly stored by another worker process
+            row = self.db.execute("SELECT answer, expires_at FROM answer_cache WHERE question = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.stats["persistent_hits"] += 1
+                answer = row[0]
+        if answer is not None:
+            self.stats["hits"] += 1
+            return answer
+        if self.similarity > 0:
+            similar = self._most_similar(key)
+            answer = self._fresh(similar, now) if similar else None
+            if answer is not None:
+                self.stats["similar_hits"] += 1
+                return answer
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, question: str, answer: str, tools: set):
+        key = normalize_question(question)
+        if not key:
+            return
+        expires_at = time.time() + ttl_for_tools(tools)
+        self._remember(key, answer, expires_at)
+        self.stats["stores"] += 1
+        if self.db:
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO answer_cache (question, answer, expires_at) VALUES (?, ?, ?)",
+                                (key, answer, expires_at))
+
+    def _fresh(self, key: str, now: float) -> str | None:
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        if entry[0] <= now:
+            self._forget(key)
+            self.stats["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _remember(self, key: str, answer: str, expires_at: float):
+        if key not in self.entries:
+            grams = self.grams[key] = char_ngrams(key)
+            for gram in grams:
+                self.doc_freq[gram] += 1
+                self.postings.setdefault(gram, set()).add(key)
+        self.entries[key] = (expires_at, answer)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self._forget(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def _forget(self, key: str):
+        del self.entries[key]
+        for gram in self.grams.pop(key):
+            self.doc_freq[gram] -= 1
+            self.postings[gram].discard(key)
+            if not self.doc_freq[gram]:
+                del self.doc_freq[gram], self.postings[gram]
+
+    # --- Similarity ---
+    def _vector(self, grams: Counter) -> dict:
+        # Unseen n-grams get the highest idf: they make a question *less* like the cached ones
+        total = len(self.entries) + 1
+        vector = {gram: count * math.log(total / (1 + self.doc_freq.get(gram, 0))) + count for gram, count in grams.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {gram: w / norm for gram, w in vector.items()}
+
+    def _most_similar(self, key: str) -> str | None:
+        """The cached question most similar to key above the threshold, if any."""
+        grams = char_ngrams(key)
+        candidates = set()
+        for gram in grams:
+            candidates |= self.postings.get(gram, set())
+        query = self._vector(grams)
+        anchors = question_anchors(key)
+        best, best_score = None, self.similarity
+        for candidate in candidates:
+            # "events this weekend" and "events next weekend" are almost the same text, never the same question
+            if question_anchors(candidate) != anchors:
+                continue
+            vector = self._vector(self.grams[candidate])
+            score = sum(weight * vector.get(gram, 0.0) for gram, weight in query.items())
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["similar_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "hit_rate": round((self.stats["hits"] + self.stats["similar_hits"]) / lookups, 3) if lookups else 0.0,
+        }
+
+
+class SpareThreads:
+    """A few pre-created empty threads, so answering from the cache needn't wait for threads.create."""
+
+    def __init__(self, openai_client, size: int = 4):
+        self.openai_client = openai_client
+        self.size = size
+        self.spare = []
+        self.refilling = None
+        self.stats = {"taken": 0, "created_inline": 0, "seeded": 0, "seed_failures": 0}
+
+    async def take(self) -> str:
+        if self.spare:
+            self.stats["taken"] += 1
+            thread_id = self.spare.pop()
+        else:
+            self.stats["created_inline"] += 1
+            thread_id = (await self.openai_client.beta.threads.create()).id
+        self.refill()
+        return thread_id
+
+    def refill(self):
+        if self.size and not (self.refilling and not self.refilling.done()):
+            self.refilling = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while len(self.spare) < self.size:
+            try:
+                self.spare.append((await self.openai_client.beta.threads.create()).id)
+            except Exception as e:
+                log.warning("Could not create a spare thread: %s", e)
+                return
+
+    async def seed(self, thread_id: str, question: str, answer: str):
+        """Adds the cached exchange to the thread, so follow-up questions have their context."""
+        try:
+            await self.openai_client.beta.threads.messages.create(thread_id, role="user", content=question)
+            await self.openai_client.beta.threads.messages.create(thread_id, role="assistant", content=answer)
+            self.stats["seeded"] += 1
+        except Exception as e:
+            self.stats["seed_failures"] += 1
+            log.warning("Could not seed thread %s with a cached answer: %s", thread_id, e)
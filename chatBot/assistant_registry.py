@@ -0,0 +1,85 @@
+# assistant_registry.py
+
+# Keeps one long-lived OpenAI Assistant per stable key instead of creating a new one on
+# every start. The assistant ID and a hash of its configuration are stored in SQLite;
+# the assistant is only updated upstream when the instructions/tools/model change.
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from openai import AsyncOpenAI, NotFoundError
+
+log = logging.getLogger(__name__)
+
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class AssistantRegistry:
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS assistants (
+                assistant_key TEXT PRIMARY KEY,
+                assistant_id TEXT NOT NULL,
+                config_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self.db.commit()
+
+    def lookup(self, key: str):
+        """Returns (assistant_id, config_hash) stored for key, or None."""
+        return self.db.execute(
+            "SELECT assistant_id, config_hash FROM assistants WHERE assistant_key = ?", (key,)).fetchone()
+
+    def store(self, key: str, assistant_id: str, digest: str):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO assistants (assistant_key, assistant_id, config_hash, updated_at) VALUES (?, ?, ?, ?)",
+                (key, assistant_id, digest, time.time()))
+
+    async def find_remote(self, client: AsyncOpenAI, key: str):
+        """Looks for an assistant tagged with our key in the account (used when the local DB is new)."""
+        async for remote in client.beta.assistants.list(limit=100):
+            if (remote.metadata or {}).get("assistant_key") == key:
+                return remote
+        return None
+
+    async def ensure(self, client: AsyncOpenAI, key: str, config: dict) -> str:
+        """
+        Returns the ID of the assistant for key, creating or updating it only when needed.
+        config holds the assistants.create arguments (name, instructions, model, tools).
+        """
+        digest = config_hash(config)
+        stored = self.lookup(key)
+        if stored and stored[1] == digest:
+            # Unchanged configuration: no network round trip at all
+            return stored[0]
+
+        metadata = {"assistant_key": key, "config_hash": digest[:16]}
+        assistant_id = stored[0] if stored else None
+        if not assistant_id:
+            remote = await self.find_remote(client, key)
+            if remote:
+                assistant_id = remote.id
+                if (remote.metadata or {}).get("config_hash") == digest[:16]:
+                    self.store(key, assistant_id, digest)
+                    return assistant_id
+
+        if assistant_id:
+            try:
+                await client.beta.assistants.update(assistant_id, metadata=metadata, **config)
+                log.info("OpenAI Assistant %s updated (configuration changed).", assistant_id)
+                self.store(key, assistant_id, digest)
+                return assistant_id
+            except NotFoundError:
+                log.warning("OpenAI Assistant %s no longer exists, creating a new one.", assistant_id)
+
+        assistant = await client.beta.assistants.create(metadata=metadata, **config)
+        log.info("OpenAI Assistant created with ID: %s", assistant.id)
+        self.store(key, assistant.id, digest)
+        return assistant.id
@@ -0,0 +1,313 @@
+# bench/load_test.py
+
+# Load benchmark for /send-message/ against the local stub servers.
+# Usage (from the chatBot directory):
+#   python -m bench.load_test --concurrency 1,32,128,256 --requests 256
+#   python -m bench.load_test --output today.json --baseline yesterday.json
+#   python -m bench.load_test --concurrency 1 --conversation-turns 60 --env CONTEXT_SUMMARY_TOKENS=2000
+#   python -m bench.load_test --concurrency 1,32,128 --engines assistants,chat
+#
+# The stubs run in this process; the backend runs as a separate uvicorn process
+# pointed at the stubs through environment variables, exactly as it would be deployed.
+# Besides end-to-end latency, every level reports p50/p95/p99 of each stage of the
+# turn (from the backend's /metrics histograms), and a saved run can be used as the
+# baseline of the next one. --conversation-turns adds one long conversation on a single
+# thread and shows how turn latency and prompt size develop as the thread grows.
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from bench.stage_stats import scrape, stage_report
+from bench.stub_servers import StubDelays, create_stub_app
+
+CHATBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+DEFAULT_MESSAGES = ["cafes near Karosta"]
+
+
+def start_stub_server(port: int, delays: StubDelays, calendar_dir: str = None) -> uvicorn.Server:
+    config = uvicorn.Config(create_stub_app(delays, calendar_dir), host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_backend(port: int, stub_url: str, extra_env: dict = None) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-stub", "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "MAPS_API_KEY": "stub", "MAPS_BASE_URL": stub_url,
+        "EVENTS_BASE_URL": f"{stub_url}/lv/",
+        # Fresh database per run, so cached answers from earlier runs don't skew the numbers
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="chatbot-bench-"), "bench.db"),
+        # Only warnings and slow/failed turn traces on the console
+        "LOG_LEVEL": "WARNING",
+        # No background POI refresh: its Maps calls would land in random levels' upstream stats
+        "POI_REFRESH_INTERVAL": "0",
+        # The long conversation sends turn after turn as one client on one thread
+        "PEER_RATE_PER_MINUTE": "0", "CLIENT_RATE_PER_MINUTE": "0", "THREAD_RATE_PER_MINUTE": "0",
+    })
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        cwd=CHATBOT_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Backend did not start")
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def drive(url: str, concurrency: int, total: int, messages: list = DEFAULT_MESSAGES,
+                path: str = "/send-message/") -> dict:
+    """Sends `total` requests with at most `concurrency` in flight; returns latency stats."""
+    latencies, errors, shed = [], 0, 0
+    queue = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def worker():
+            nonlocal errors, shed
+            for i in queue:
+                started = time.perf_counter()
+                try:
+                    # Unique text (no answer cache hits) and one simulated user per request, so
+                    # the per-client rate limit doesn't throttle the bench
+                    response = await client.post(path, json={"message": f"{messages[i % len(messages)]} #{concurrency}-{i}"},
+                                                 headers={"X-Client-Id": f"bench-{i}"})
+                    if response.status_code in (429, 503):
+                        shed += 1 # refused by admission control
+                        continue
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency, "requests": total, "errors": errors, "shed": shed, "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0,
+        "p50": percentile(latencies, 50) if latencies else 0,
+        "p95": percentile(latencies, 95) if latencies else 0,
+        "p99": percentile(latencies, 99) if latencies else 0,
+        "mean": statistics.mean(latencies) if latencies else 0,
+    }
+
+
+def run_level(url: str, concurrency: int, total: int, messages: list) -> dict:
+    """One concurrency level, with the per-stage latencies its requests caused on the backend."""
+    before = scrape(url)
+    row = asyncio.run(drive(url, concurrency, total, messages))
+    row["stages"] = [
+        {"histogram": histogram, "name": name, "count": count, "p50": p50, "p95": p95, "p99": p99}
+        for histogram, name, count, p50, p95, p99 in stage_report(before, scrape(url))
+    ]
+    return row
+
+
+async def drive_conversation(url: str, turns: int, messages: list) -> list:
+    """One user talking on one thread, turn after turn; returns each turn's latency."""
+    latencies, thread_id = [], None
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        for i in range(turns):
+            body = {"message": f"{messages[i % len(messages)]} (turn {i + 1})", "thread_id": thread_id}
+            started = time.perf_counter()
+            response = await client.post("/send-message/", json=body, headers={"X-Client-Id": "bench-conversation"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            thread_id = response.json()["thread_id"]
+    return latencies
+
+
+def run_conversation(url: str, stub: uvicorn.Server, turns: int, messages: list, block: int = 10) -> list:
+    """Turn latency and the stub model's prompt size, averaged over blocks of `block` turns."""
+    prompts = stub.config.app.state.prompt_tokens
+    first_run = len(prompts)
+    latencies = asyncio.run(drive_conversation(url, turns, messages))
+    prompt_sizes = prompts[first_run:]
+    blocks = []
+    for start in range(0, turns, block):
+        sizes = prompt_sizes[start:start + block]
+        blocks.append({"turns": f"{start + 1}-{min(start + block, turns)}",
+                       "mean": statistics.mean(latencies[start:start + block]),
+                       "prompt_tokens": round(statistics.mean(sizes)) if sizes else 0})
+    return blocks
+
+
+def print_conversation(blocks: list, baseline: dict = None):
+    previous = {b["turns"]: b for b in (baseline or {}).get("conversation") or []}
+    print("\nOne conversation, turn after turn on the same thread:")
+    print(f"  {'turns':<10} {'mean s':>14} {'prompt tokens':>22}")
+    for b in blocks:
+        old = previous.get(b["turns"], {})
+        print(f"  {b['turns']:<10} {b['mean']:>7.2f}{_delta(b['mean'], old.get('mean')):>7} "
+              f"{b['prompt_tokens']:>14}{_delta(b['prompt_tokens'], old.get('prompt_tokens')):>8}")
+
+
+def print_engines(results: dict):
+    """Engines side by side: latency, throughput and time to first token per level."""
+    names = list(results)
+    print("\nEngines side by side (p50 / p95 s, req/s, first token p50 ms):")
+    print(f"  {'conc':>6} " + " ".join(f"{name:>31}" for name in names))
+    levels = {}
+    for name in names:
+        for row in results[name]["levels"]:
+            levels.setdefault(row["concurrency"], {})[name] = row
+    for concurrency, rows in levels.items():
+        cells = []
+        for name in names:
+            row = rows.get(name)
+            if not row:
+                cells.append(f"{'-':>31}")
+                continue
+            first_token = next((s["p50"] for s in row["stages"] if s["name"] == "time_to_first_token"), 0)
+            cells.append(f"{row['p50']:>6.2f} / {row['p95']:>5.2f} {row['throughput']:>7.1f} {first_token * 1000:>8.0f}")
+        print(f"  {concurrency:>6} " + " ".join(cells))
+
+
+def _delta(value: float, baseline: float | None) -> str:
+    if not baseline:
+        return ""
+    return f" ({(value - baseline) / baseline * 100:+.0f}%)"
+
+
+def print_report(rows: list, baseline: dict = None):
+    """Prints the levels and their stages; with a baseline run, changes against it in brackets."""
+    previous = {r["concurrency"]: r for r in (baseline or {}).get("levels", [])}
+    print(f"{'conc':>6} {'reqs':>6} {'err':>5} {'shed':>5} {'req/s':>16} {'p50 s':>14} {'p95 s':>14} {'p99 s':>14}")
+    for r in rows:
+        base = previous.get(r["concurrency"], {})
+        print(f"{r['concurrency']:>6} {r['requests']:>6} {r['errors']:>5} {r.get('shed', 0):>5} "
+              f"{r['throughput']:>8.1f}{_delta(r['throughput'], base.get('throughput')):>8} "
+              + " ".join(f"{r[p]:>7.2f}{_delta(r[p], base.get(p)):>7}" for p in ("p50", "p95", "p99")))
+
+    for r in rows:
+        base = {(s["histogram"], s["name"]): s for s in previous.get(r["concurrency"], {}).get("stages", [])}
+        print(f"\nStages at concurrency {r['concurrency']} (ms, interpolated from /metrics buckets):")
+        print(f"  {'stage':<34} {'count':>6} {'p50':>14} {'p95':>14} {'p99':>14}")
+        for s in r["stages"]:
+            label = s["name"] if s["histogram"] == "chatbot_stage_seconds" else f"upstream {s['name']}"
+            old = base.get((s["histogram"], s["name"]), {})
+            print(f"  {label:<34} {s['count']:>6} "
+                  + " ".join(f"{s[p] * 1000:>7.0f}{_delta(s[p], old.get(p)):>7}" for p in ("p50", "p95", "p99")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /send-message/ against local stub servers.")
+    parser.add_argument("--concurrency", default="1,32,128,256", help="Comma separated in-flight request levels")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: 2x concurrency)")
+    parser.add_argument("--message", action="append", dest="messages",
+                        help="Message to send (repeat for a mix; default: a nearby-cafes question)")
+    parser.add_argument("--run-queue-delay", type=float, default=StubDelays.run_queue, help="Seconds a run stays queued")
+    parser.add_argument("--model-delay", type=float, default=StubDelays.model_step, help="Seconds per model step")
+    parser.add_argument("--token-delay", type=float, default=StubDelays.token, help="Seconds between reply chunks")
+    parser.add_argument("--maps-delay", type=float, default=StubDelays.maps, help="Seconds per Maps call")
+    parser.add_argument("--events-delay", type=float, default=StubDelays.events_page, help="Seconds per calendar page")
+    parser.add_argument("--calendar-dir", help="Replay pages recorded with bench.record_calendar")
+    parser.add_argument("--prompt-token-delay", type=float, default=StubDelays.prompt_token,
+                        help="Model seconds per prompt token (long threads are slower)")
+    parser.add_argument("--conversation-turns", type=int, default=0,
+                        help="Also hold one conversation of this many turns on a single thread")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the backend (repeatable), e.g. CONTEXT_SUMMARY_TOKENS=0")
+    parser.add_argument("--engines", help="Comma separated CHAT_ENGINE values to compare, e.g. assistants,chat")
+    parser.add_argument("--output", help="Save the results as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    delays = StubDelays(run_queue=args.run_queue_delay, model_step=args.model_delay, token=args.token_delay,
+                        maps=args.maps_delay, events_page=args.events_delay, prompt_token=args.prompt_token_delay)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    stub_port = free_port()
+    stub = start_stub_server(stub_port, delays, args.calendar_dir)
+    results = {}
+    try:
+        # One fresh backend per engine, against the same stubs
+        for engine in args.engines.split(",") if args.engines else [None]:
+            results[engine or "default"] = run_engine(args, stub, f"http://127.0.0.1:{stub_port}", engine)
+    finally:
+        stub.should_exit = True
+
+    for name, result in results.items():
+        engine_baseline = baseline
+        if len(results) > 1:
+            print(f"\n=== {name} engine ===")
+            engine_baseline = (baseline or {}).get("engines", {}).get(name, baseline)
+        print_report(result["levels"], engine_baseline)
+        if result["conversation"]:
+            print_conversation(result["conversation"], engine_baseline)
+    if len(results) > 1:
+        print_engines(results)
+    if args.output:
+        first = next(iter(results.values()))
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"delays": dataclasses.asdict(delays), "calendar_dir": args.calendar_dir,
+                       "messages": args.messages or DEFAULT_MESSAGES, "env": args.env, "levels": first["levels"],
+                       "conversation": first["conversation"], "engines": results}, f, indent=2)
+
+
+def run_engine(args, stub: uvicorn.Server, stub_url: str, engine: str | None) -> dict:
+    """All levels (and the conversation) against one backend; engine sets CHAT_ENGINE."""
+    env = dict(item.split("=", 1) for item in args.env)
+    if engine:
+        env["CHAT_ENGINE"] = engine
+    backend_port = free_port()
+    backend = start_backend(backend_port, stub_url, env)
+    url = f"http://127.0.0.1:{backend_port}"
+    try:
+        rows = []
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            rows.append(run_level(url, level, args.requests or level * 2, args.messages or DEFAULT_MESSAGES))
+        conversation = None
+        if args.conversation_turns:
+            conversation = run_conversation(url, stub, args.conversation_turns, args.messages or DEFAULT_MESSAGES)
+        return {"levels": rows, "conversation": conversation}
+    finally:
+        backend.terminate()
+        backend.wait()
+
+if __name__ == "__main__":
+    main()
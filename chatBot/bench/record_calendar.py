@@ -0,0 +1,50 @@
+# bench/record_calendar.py
+
+# Records real kalendars.liepaja.lv day pages for the benchmark stubs to replay.
+# Usage (from the chatBot directory):
+#   python -m bench.record_calendar --days 7 --out bench/calendar
+#   python -m bench.load_test --calendar-dir bench/calendar
+#
+# Pages are saved unmodified as <YYYY-MM-DD>_page<N>.html; a day's crawl stops at the
+# first page without events, like the backend's own crawler.
+
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import httpx
+
+from events_index import MAX_PAGES_PER_DAY, USER_AGENT, parse_events_page
+
+DEFAULT_BASE_URL = "https://kalendars.liepaja.lv/lv/"
+
+
+def record(base_url: str, days: int, out_dir: str, pause: float = 1.0):
+    os.makedirs(out_dir, exist_ok=True)
+    with httpx.Client(headers={"User-Agent": USER_AGENT}, timeout=20, follow_redirects=True) as client:
+        for offset in range(days):
+            day = (date.today() + timedelta(days=offset)).isoformat()
+            for page in range(1, MAX_PAGES_PER_DAY + 1):
+                response = client.get(f"{base_url}page:{page},date_from:{day},date_until:{day},a:f")
+                response.raise_for_status()
+                found, _ = parse_events_page(response.content)
+                if not found:
+                    break
+                with open(os.path.join(out_dir, f"{day}_page{page}.html"), "wb") as f:
+                    f.write(response.content)
+                print(f"{day} page {page}: {found} events, {len(response.content)} bytes")
+                time.sleep(pause) # be polite to the real site
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record kalendars.liepaja.lv pages for the benchmark stubs.")
+    parser.add_argument("--days", type=int, default=7, help="Days to record, starting today")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "calendar"))
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    args = parser.parse_args()
+    record(args.base_url, args.days, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# bench/stage_stats.py
+
+# Per-stage latency percentiles for a load test level, computed from the backend's own
+# /metrics histograms: the histograms are scraped before and after the level, the
+# difference is what that level's requests did, and p50/p95/p99 are interpolated inside
+# the buckets the same way Prometheus' histogram_quantile() does.
+
+import re
+
+import httpx
+
+# chatbot_stage_seconds_bucket{stage="run_queue",le="0.5"} 12
+BUCKET_LINE = re.compile(r'^(\w+)_bucket\{(.*)\} ([0-9.eE+-]+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+HISTOGRAMS = {"chatbot_stage_seconds": "stage", "chatbot_upstream_seconds": "endpoint"}
+
+
+def scrape(url: str) -> dict:
+    """Returns {(histogram, series name): {upper bound: cumulative count}} from a /metrics page."""
+    text = httpx.get(f"{url}/metrics", timeout=10).text
+    series = {}
+    for line in text.splitlines():
+        match = BUCKET_LINE.match(line)
+        if not match or match.group(1) not in HISTOGRAMS:
+            continue
+        labels = dict(LABEL.findall(match.group(2)))
+        name = labels.get(HISTOGRAMS[match.group(1)], "")
+        if match.group(1) == "chatbot_upstream_seconds":
+            name = f"{labels.get('upstream', '')}:{name}"
+        bound = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+        series.setdefault((match.group(1), name), {})[bound] = float(match.group(3))
+    return series
+
+
+def diff(before: dict, after: dict) -> dict:
+    """Bucket counts observed between the two scrapes, for the series that moved."""
+    moved = {}
+    for key, buckets in after.items():
+        old = before.get(key, {})
+        delta = {bound: count - old.get(bound, 0) for bound, count in buckets.items()}
+        if delta.get(float("inf"), 0) > 0:
+            moved[key] = delta
+    return moved
+
+
+def quantile(buckets: dict, q: float) -> float:
+    """Linear interpolation inside the bucket holding the q-th observation (histogram_quantile)."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return lower # beyond the last finite bucket: its bound is all we know
+            return lower + (bound - lower) * ((rank - below) / (count - below) if count > below else 0)
+        lower, below = bound, count
+    return lower
+
+
+def stage_report(before: dict, after: dict) -> list:
+    """[(histogram, series name, count, p50, p95, p99)] for every stage that ran in between."""
+    rows = []
+    for (histogram, name), buckets in sorted(diff(before, after).items()):
+        rows.append((histogram, name, int(buckets[float("inf")]),
+                     quantile(buckets, 0.50), quantile(buckets, 0.95), quantile(buckets, 0.99)))
+    return rows
@@ -0,0 +1,355 @@
+# bench/stub_servers.py
+
+# Local stand-ins for the upstream services, so the backend can be load tested
+# without spending real API money:
+#   - OpenAI Assistants API (threads, streamed runs with one tool step) and streamed
+#     Chat Completions with the same tool step
+#   - Google Maps web services (text search, details, directions, distance matrix, geocoding)
+#   - kalendars.liepaja.lv event pages: synthetic ones, or pages recorded from the real
+#     site with bench.record_calendar (replayed byte for byte, so parse costs are real).
+#     Pages carry an ETag and answer If-None-Match with 304, like a caching web server.
+# Every endpoint sleeps for a configurable delay to simulate upstream latency.
+# The stub model keeps each thread's messages: a run's prompt is the part of the thread
+# it may see (truncation_strategy honoured), and its model steps get slower with it.
+
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import date
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+
+
+@dataclass
+class StubDelays:
+    run_queue: float = 0.3    # run created -> in_progress
+    model_step: float = 0.5   # time the "model" thinks before each step
+    token: float = 0.01       # delay between streamed reply chunks
+    maps: float = 0.3         # every Maps web service call
+    events_page: float = 0.4  # every calendar page
+    prompt_token: float = 0.0001  # model time per prompt token, so long threads are slower
+
+
+STUB_BASE_PROMPT_TOKENS = 800 # instructions and tool definitions
+
+
+# Tool calls the stub model asks for on the first step of every run
+STUB_TOOL_CALLS = [
+    ("find_places_in_liepaja", {"place_type": "cafe", "area": "city center"}),
+    ("get_directions", {"origin": "Peter's Market", "destination": "Karosta", "mode": "walking"}),
+    ("get_liepaja_events", {"date_range": "this_weekend"}),
+]
+
+STUB_REPLY = "Here is what I found in Liepāja: a few cafes in the center, walking directions to Karosta and this weekend's events."
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _run(run_id: str, thread_id: str, status: str, **extra) -> dict:
+    run = {
+        "id": run_id, "object": "thread.run", "created_at": int(time.time()), "assistant_id": "asst_stub",
+        "thread_id": thread_id, "status": status, "instructions": "", "model": "gpt-4o-mini", "tools": [],
+        "parallel_tool_calls": True,
+    }
+    run.update(extra)
+    return run
+
+
+def _run_step(step_id: str, run_id: str, thread_id: str, step_type: str, prompt: int, completion: int) -> dict:
+    return {
+        "id": step_id, "object": "thread.run.step", "created_at": int(time.time()), "assistant_id": "asst_stub",
+        "thread_id": thread_id, "run_id": run_id, "type": step_type, "status": "completed", "step_details": {
+            "type": step_type, **({"tool_calls": []} if step_type == "tool_calls" else {"message_creation": {}})},
+        "usage": {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion},
+    }
+
+
+def _tokens(text: str) -> int:
+    return len(text or "") // 4 + 4
+
+
+def _message(message_id: str, thread_id: str, status: str, text: str = None) -> dict:
+    content = [{"type": "text", "text": {"value": text, "annotations": []}}] if text is not None else []
+    return {
+        "id": message_id, "object": "thread.message", "created_at": int(time.time()), "thread_id": thread_id,
+        "role": "assistant", "content": content, "status": status, "attachments": [], "metadata": {},
+    }
+
+
+STUB_EVENT_CATEGORIES = ["Koncerti", "Izstādes", "Sports", "Teātris", "Bērniem"]
+
+
+def events_page_html(day: str, page: int, pages: int = 2, per_page: int = 10) -> str:
+    """One calendar page; pages after `pages` have an empty list, like the real site."""
+    items = "".join(
+        f"""<li><a class="title" href="#">Stub event {day} {page}-{i}</a>
+            <div class="event-date">{day} {18 + i % 4}:00</div>
+            <div class="event-place">Lielais dzintars</div><div class="event-fee">{5 + i} EUR</div>
+            <div class="event-category">{STUB_EVENT_CATEGORIES[i % len(STUB_EVENT_CATEGORIES)]}</div></li>"""
+        for i in range(per_page if page <= pages else 0)
+    )
+    return f"<html><body><header>{'<nav>menu</nav>' * 50}</header><ul class='events list'>{items}</ul></body></html>"
+
+
+class RecordedCalendar:
+    """
+    Pages saved by bench.record_calendar as <YYYY-MM-DD>_page<N>.html. Any requested day
+    is mapped onto one of the recorded days, so a short recording serves a long window.
+    """
+
+    def __init__(self, directory: str):
+        self.pages = {} # (day, page) -> bytes
+        for filename in os.listdir(directory):
+            match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})_page(\d+)\.html", filename)
+            if match:
+                with open(os.path.join(directory, filename), "rb") as f:
+                    self.pages[(match.group(1), int(match.group(2)))] = f.read()
+        self.days = sorted({day for day, _ in self.pages})
+        if not self.days:
+            raise ValueError(f"No recorded calendar pages in {directory}")
+
+    def page(self, day: str, page: int) -> bytes:
+        try:
+            ordinal = date.fromisoformat(day).toordinal()
+        except ValueError:
+            ordinal = 0
+        recorded_day = self.days[ordinal % len(self.days)]
+        # Past the recorded pages the real site answers with an empty list
+        return self.pages.get((recorded_day, page)) or events_page_html(day, page, pages=0).encode()
+
+
+def create_stub_app(delays: StubDelays = None, calendar_dir: str = None) -> FastAPI:
+    delays = delays or StubDelays()
+    calendar = RecordedCalendar(calendar_dir) if calendar_dir else None
+    app = FastAPI()
+    ids = itertools.count(1)
+    app.state.delays = delays
+    app.state.thread_messages = {} # thread_id -> message texts, oldest first
+    app.state.prompt_tokens = [] # prompt size of every run's first step, in order
+    runs = {} # run_id -> prompt tokens
+    app.state.counters = {"assistants": 0, "threads": 0, "messages": 0, "runs": 0, "tool_submissions": 0, "maps": 0, "events_pages": 0,
+                          "events_not_modified": 0, "completions": 0}
+
+    # --- OpenAI Assistants ---
+    @app.get("/v1/assistants")
+    async def list_assistants():
+        return {"object": "list", "data": [], "first_id": None, "last_id": None, "has_more": False}
+
+    @app.post("/v1/assistants")
+    @app.post("/v1/assistants/{assistant_id}")
+    async def assistants(request: Request, assistant_id: str = "asst_stub"):
+        app.state.counters["assistants"] += 1
+        body = await request.json()
+        return {"id": assistant_id, "object": "assistant", "created_at": int(time.time()), "name": body.get("name"),
+                "model": body.get("model", "gpt-4o-mini"), "instructions": body.get("instructions"),
+                "tools": body.get("tools", []), "metadata": body.get("metadata") or {}}
+
+    @app.post("/v1/threads")
+    async def create_thread():
+        app.state.counters["threads"] += 1
+        return {"id": f"thread_{next(ids)}", "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    @app.get("/v1/threads/{thread_id}")
+    async def get_thread(thread_id: str):
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    @app.post("/v1/threads/{thread_id}/messages")
+    async def create_message(thread_id: str, request: Request):
+        app.state.counters["messages"] += 1
+        body = await request.json()
+        message = _message(f"msg_{next(ids)}", thread_id, "completed", body.get("content", ""))
+        message["role"] = body.get("role", "user")
+        app.state.thread_messages.setdefault(thread_id, []).append(body.get("content", ""))
+        return message
+
+    @app.post("/v1/threads/{thread_id}/runs")
+    async def create_run(thread_id: str, request: Request):
+        app.state.counters["runs"] += 1
+        run_id = f"run_{next(ids)}"
+        body = await request.json()
+        history = app.state.thread_messages.setdefault(thread_id, [])
+        history.extend(message["content"] for message in body.get("additional_messages") or [])
+        visible = history
+        truncation = body.get("truncation_strategy") or {}
+        if truncation.get("type") == "last_messages":
+            visible = history[-truncation["last_messages"]:]
+        prompt = STUB_BASE_PROMPT_TOKENS + sum(map(_tokens, visible)) + _tokens(body.get("additional_instructions"))
+        runs[run_id] = prompt
+        app.state.prompt_tokens.append(prompt)
+
+        async def events():
+            yield _sse("thread.run.created", _run(run_id, thread_id, "queued"))
+            await asyncio.sleep(delays.run_queue)
+            yield _sse("thread.run.in_progress", _run(run_id, thread_id, "in_progress"))
+            await asyncio.sleep(delays.model_step + prompt * delays.prompt_token)
+            tool_calls = [
+                {"id": f"call_{run_id}_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+                for i, (name, args) in enumerate(STUB_TOOL_CALLS)
+            ]
+            yield _sse("thread.run.requires_action", _run(run_id, thread_id, "requires_action", required_action={
+                "type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}}))
+            yield "event: done\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs")
+    async def submit_tool_outputs(thread_id: str, run_id: str, request: Request):
+        app.state.counters["tool_submissions"] += 1
+        message_id = f"msg_{next(ids)}"
+        body = await request.json()
+        # The second step also reads the tool calls and their outputs
+        first_prompt = runs.pop(run_id, STUB_BASE_PROMPT_TOKENS)
+        prompt = first_prompt + 30 + sum(
+            _tokens(output.get("output")) for output in body.get("tool_outputs") or [])
+
+        async def events():
+            # The tool call step completes once its outputs are in
+            yield _sse("thread.run.step.completed", _run_step(
+                f"step_{next(ids)}", run_id, thread_id, "tool_calls", first_prompt, 0))
+            yield _sse("thread.run.in_progress", _run(run_id, thread_id, "in_progress"))
+            await asyncio.sleep(delays.model_step + prompt * delays.prompt_token)
+            yield _sse("thread.message.created", _message(message_id, thread_id, "in_progress"))
+            for word in STUB_REPLY.split(" "):
+                yield _sse("thread.message.delta", {"id": message_id, "object": "thread.message.delta", "delta": {
+                    "content": [{"index": 0, "type": "text", "text": {"value": word + " "}}]}})
+                await asyncio.sleep(delays.token)
+            yield _sse("thread.message.completed", _message(message_id, thread_id, "completed", STUB_REPLY))
+            app.state.thread_messages.setdefault(thread_id, []).append(STUB_REPLY)
+            yield _sse("thread.run.step.completed", _run_step(
+                f"step_{next(ids)}", run_id, thread_id, "message_creation", prompt, 70))
+            # Usage adds up both model steps, like the real API
+            yield _sse("thread.run.completed", _run(run_id, thread_id, "completed", usage={
+                "prompt_tokens": first_prompt + prompt, "completion_tokens": 70, "total_tokens": first_prompt + prompt + 70}))
+            yield "event: done\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/threads/{thread_id}/runs/{run_id}/cancel")
+    async def cancel_run(thread_id: str, run_id: str):
+        return _run(run_id, thread_id, "cancelling")
+
+    # --- OpenAI Chat Completions (the chat engine, conversation summaries) ---
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.counters["completions"] += 1
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt = STUB_BASE_PROMPT_TOKENS if body.get("tools") else 0
+        prompt += sum(_tokens(message.get("content")) for message in messages)
+        if body.get("stream"):
+            if messages and messages[-1]["role"] == "user":
+                app.state.prompt_tokens.append(prompt)
+            return StreamingResponse(chat_stream(body, prompt), media_type="text/event-stream")
+        await asyncio.sleep(delays.model_step + prompt * delays.prompt_token)
+        text = "The user asked about cafes, routes and events in Liepāja and got suggestions for each."
+        return {"id": f"chatcmpl_{next(ids)}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": prompt, "completion_tokens": 20, "total_tokens": prompt + 20}}
+
+    async def chat_stream(body: dict, prompt: int):
+        """Like a run: the first step asks for STUB_TOOL_CALLS, the step after the tool outputs answers."""
+        completion_id = f"chatcmpl_{next(ids)}"
+
+        def chunk(delta: dict = None, finish_reason: str = None, **extra) -> str:
+            choices = [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model", "gpt-4o-mini"), "choices": choices, **extra}
+            return f"data: {json.dumps(data)}\n\n"
+
+        await asyncio.sleep(delays.model_step + prompt * delays.prompt_token)
+        if body.get("tools") and body["messages"][-1]["role"] != "tool":
+            for i, (name, args) in enumerate(STUB_TOOL_CALLS):
+                call = {"index": i, "id": f"call_{completion_id}_{i}", "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(args)}}
+                yield chunk({"role": "assistant", "tool_calls": [call]})
+            yield chunk({}, "tool_calls")
+            completion = 30
+        else:
+            for word in STUB_REPLY.split(" "):
+                yield chunk({"content": word + " "})
+                await asyncio.sleep(delays.token)
+            yield chunk({}, "stop")
+            completion = 40
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(usage={"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion})
+        yield "data: [DONE]\n\n"
+
+    # --- Google Maps web services ---
+    async def maps_call():
+        app.state.counters["maps"] += 1
+        await asyncio.sleep(delays.maps)
+
+    @app.get("/maps/api/place/textsearch/json")
+    async def text_search(query: str = ""):
+        await maps_call()
+        results = [
+            {"place_id": f"place_{i}", "name": f"Stub Place {i}", "formatted_address": f"Graudu iela {i}, Liepāja",
+             "rating": 4.5, "geometry": {"location": {"lat": 56.5107 + i / 1000, "lng": 21.0106 + i / 1000}},
+             "types": ["cafe"]}
+            for i in range(1, 6)
+        ]
+        return {"status": "OK", "results": results}
+
+    @app.get("/maps/api/geocode/json")
+    async def geocode(address: str = ""):
+        await maps_call()
+        return {"status": "OK", "results": [{"formatted_address": address, "types": ["establishment"],
+                                             "geometry": {"location": {"lat": 56.5150, "lng": 21.0150}}}]}
+
+    @app.get("/maps/api/place/details/json")
+    async def place_details(place_id: str = ""):
+        await maps_call()
+        return {"status": "OK", "result": {
+            "place_id": place_id, "name": "Stub Place", "formatted_address": "Graudu iela 1, Liepāja",
+            "international_phone_number": "+371 600 00000", "website": "https://example.com", "rating": 4.5,
+            "user_ratings_total": 120, "opening_hours": {
+                "open_now": True,
+                "periods": [{"open": {"day": d, "time": "0900"}, "close": {"day": d, "time": "2100"}} for d in range(7)],
+                "weekday_text": [f"{day}: 9:00 AM – 9:00 PM" for day in
+                                 ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]],
+            }}}
+
+    @app.get("/maps/api/directions/json")
+    async def directions(origin: str = "", destination: str = ""):
+        await maps_call()
+        steps = [{"html_instructions": f"Walk <b>north</b> on street {i}", "distance": {"text": "200 m", "value": 200}}
+                 for i in range(5)]
+        return {"status": "OK", "routes": [{"legs": [{
+            "duration": {"text": "15 mins", "value": 900}, "distance": {"text": "1.2 km", "value": 1200},
+            "steps": steps}]}]}
+
+    @app.get("/maps/api/distancematrix/json")
+    async def distance_matrix(origins: str = "", destinations: str = ""):
+        await maps_call()
+        element = {"status": "OK", "duration": {"text": "10 mins", "value": 600}, "distance": {"text": "3 km", "value": 3000}}
+        return {"status": "OK", "rows": [{"elements": [element] * len(destinations.split("|"))}
+                                         for _ in origins.split("|")]}
+
+    # --- kalendars.liepaja.lv ---
+    @app.get("/lv/{path:path}")
+    async def events_page(path: str, request: Request):
+        app.state.counters["events_pages"] += 1
+        await asyncio.sleep(delays.events_page)
+        params = dict(part.split(":", 1) for part in path.split(",") if ":" in part)
+        day, page = params.get("date_from", ""), int(params.get("page") or 1)
+        content = calendar.page(day, page) if calendar else events_page_html(day, page).encode()
+        etag = f'"{hashlib.sha1(content).hexdigest()[:16]}"'
+        if request.headers.get("if-none-match") == etag:
+            app.state.counters["events_not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        return HTMLResponse(content, headers={"ETag": etag})
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.counters
+
+    return app
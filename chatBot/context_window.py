@@ -0,0 +1,136 @@
+# context_window.py
+
+# Bounded context for long conversations. A run on an OpenAI thread sends the whole
+# thread to the model, so without a bound every turn of a long conversation is slower
+# and dearer than the one before.
+#  - Per thread, the prompt size of its last run (from run usage) and the tokens spent
+#    so far are kept in the 'thread_context' table.
+#  - Once a thread's prompt passes summary_tokens, its older messages are rolled up into
+#    a short summary: one small chat completion, run in the background after the turn.
+#    Later runs see the summary (as additional instructions) and only the messages after
+#    it (truncation_strategy 'last_messages'), so the prompt stays between the two sizes.
+#  - Whatever happens to summaries, a run never sees more than max_messages messages.
+
+import asyncio
+import contextvars
+import logging
+import sqlite3
+import time
+
+from message_store import MessageStore
+from telemetry import span
+
+log = logging.getLogger(__name__)
+
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_INSTRUCTIONS = (
+    "You keep a running summary of a conversation between a user and a Liepāja city guide assistant. "
+    "Merge the summary so far with the new messages into one short summary (at most 150 words). "
+    "Keep what later questions may refer to: places, events, dates, routes, the user's plans and preferences. "
+    "Write plain sentences, no lists.")
+SUMMARY_PREFIX = "Summary of the earlier conversation (older messages are not shown):\n"
+
+
+class ContextWindow:
+    def __init__(self, db_path: str, message_store: MessageStore, openai_client, keep_messages: int = 10,
+                 max_messages: int = 40, summary_tokens: int = 4000, summary_model: str = "gpt-4o-mini"):
+        """summary_tokens: prompt size at which older messages are summarized (0 = only the max_messages cap)."""
+        self.message_store = message_store
+        self.openai_client = openai_client
+        self.keep_messages = keep_messages
+        self.max_messages = max(max_messages, keep_messages)
+        self.summary_tokens = summary_tokens
+        self.summary_model = summary_model
+        self.rolling = {} # thread_id -> running roll-up task
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS thread_context (
+                thread_id TEXT PRIMARY KEY,
+                context_tokens INTEGER NOT NULL DEFAULT 0, -- prompt size of the last model step
+                prompt_tokens INTEGER NOT NULL DEFAULT 0, -- totals over all runs
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                runs INTEGER NOT NULL DEFAULT 0,
+                summary TEXT,
+                summarized_messages INTEGER NOT NULL DEFAULT 0, -- the summary covers this many first messages
+                updated_at REAL
+            )""")
+        self.db.commit()
+        self.stats = {"truncated_runs": 0, "summarized_runs": 0, "rollups": 0, "rollup_failures": 0}
+
+    def _summary_state(self, thread_id: str):
+        row = self.db.execute("SELECT summary, summarized_messages FROM thread_context WHERE thread_id = ?",
+                              (thread_id,)).fetchone()
+        return row or (None, 0)
+
+    def run_options(self, thread_id: str):
+        """
+        (truncation_strategy, instructions) for the next run on a thread: which messages the
+        run may see and the summary of the ones it can't (None when nothing is left out).
+        """
+        summary, summarized = self._summary_state(thread_id)
+        total = self.message_store.count(thread_id)
+        visible = min(self.max_messages, max(self.keep_messages, total - summarized))
+        truncation = None
+        if total > visible:
+            truncation = {"type": "last_messages", "last_messages": visible}
+            self.stats["truncated_runs"] += 1
+        if summary:
+            self.stats["summarized_runs"] += 1
+        return truncation, SUMMARY_PREFIX + summary if summary else None
+
+    def record_usage(self, thread_id: str, usage, context_tokens: int):
+        """
+        Adds a finished run's usage; a run whose prompt got too big schedules a roll-up.
+        usage adds up every model step of the run, context_tokens is the prompt of its last
+        (largest) step: what the next turn starts from.
+        """
+        with self.db:
+            self.db.execute(
+                "INSERT INTO thread_context (thread_id, context_tokens, prompt_tokens, completion_tokens, runs, updated_at) "
+                "VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT(thread_id) DO UPDATE SET "
+                "context_tokens = excluded.context_tokens, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, runs = runs + 1, "
+                "updated_at = excluded.updated_at",
+                (thread_id, context_tokens, usage.prompt_tokens, usage.completion_tokens, time.time()))
+        if self.summary_tokens and context_tokens >= self.summary_tokens and thread_id not in self.rolling:
+            # Outside the turn's trace context: the turn is over before the summary is
+            task = contextvars.Context().run(asyncio.create_task, self.roll_up(thread_id)) # create_task(context=) is 3.11+
+            self.rolling[thread_id] = task
+            task.add_done_callback(lambda _: self.rolling.pop(thread_id, None))
+
+    async def roll_up(self, thread_id: str):
+        """Folds every message but the last keep_messages into the thread's summary."""
+        summary, summarized = self._summary_state(thread_id)
+        upto = self.message_store.count(thread_id) - self.keep_messages
+        if upto <= summarized:
+            return
+        try:
+            with span("context_rollup"):
+                messages = await self.message_store.messages_range(thread_id, summarized, upto)
+                transcript = "\n".join(f"{'User' if m['sender'] == 'user' else 'Assistant'}: {m['content']}"
+                                       for m in messages)
+                prompt = (f"Summary so far:\n{summary}\n\n" if summary else "") + f"New messages:\n{transcript}"
+                response = await self.openai_client.chat.completions.create(
+                    model=self.summary_model, max_tokens=SUMMARY_MAX_TOKENS, temperature=0,
+                    messages=[{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": prompt}])
+                new_summary = (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            self.stats["rollup_failures"] += 1
+            log.warning("Could not summarize thread %s: %s", thread_id, e)
+            return
+        if not new_summary:
+            self.stats["rollup_failures"] += 1
+            return
+        with self.db:
+            # Another worker may have rolled the thread up meanwhile; the first one wins
+            self.db.execute(
+                "UPDATE thread_context SET summary = ?, summarized_messages = ?, updated_at = ? "
+                "WHERE thread_id = ? AND summarized_messages = ?", (new_summary, upto, time.time(), thread_id, summarized))
+        self.stats["rollups"] += 1
+        log.debug("Thread %s: summarized messages %d-%d", thread_id, summarized, upto - 1)
+
+    def snapshot(self) -> dict:
+        threads, summarized, avg_context = self.db.execute(
+            "SELECT COUNT(*), COUNT(summary), AVG(context_tokens) FROM thread_context").fetchone()
+        return {**self.stats, "threads": threads, "summarized_threads": summarized,
+                "avg_context_tokens": round(avg_context or 0)}
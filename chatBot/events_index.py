@@ -0,0 +1,383 @@
+# events_index.py
+
+# Local index of the kalendars.liepaja.lv events calendar.
+# A background job crawls every day of a rolling window (all page:N pages of each day)
+# and stores the parsed events in an indexed SQLite table, so the events tool answers
+# date range / category questions with a local query instead of scraping per request.
+# Crawling is incremental: pages are fetched with If-None-Match / If-Modified-Since and
+# their content hash is compared with the last crawl, so an unchanged page is neither
+# parsed nor rewritten. Changed pages are parsed with a SoupStrainer, which builds only
+# the event list subtree instead of the whole document.
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+import unicodedata
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+
+from telemetry import UPSTREAM_REQUESTS, UPSTREAM_SECONDS, span
+
+log = logging.getLogger(__name__)
+
+EVENT_ITEM_SELECTOR = '.events.list li'
+# Only elements with the 'events' class (and everything inside them) are built while parsing
+EVENT_LIST_STRAINER = SoupStrainer(class_=re.compile(r"\bevents\b"))
+CATEGORY_SELECTOR = '.event-category, .category, .event-type'
+MAX_PAGES_PER_DAY = 10
+PAGE_CONCURRENCY = 4 # calendar pages fetched at once (the site is small)
+USER_AGENT = 'LiepajaStudyBot/1.0 (+http://example.com)'
+try:
+    CITY_TIMEZONE = ZoneInfo("Europe/Riga") # "today" and "open now" are Liepāja's, whatever the server's zone
+except ZoneInfoNotFoundError: # no tz database on this machine: the server's local time
+    CITY_TIMEZONE = None
+
+# Canonical category -> word stems (Latvian and English, diacritics removed) that identify it
+CATEGORY_SYNONYMS = {
+    "concerts": ["koncert", "concert", "music", "muzik", "opera", "orkestr"],
+    "exhibitions": ["izstad", "exhibition", "ekspozicij", "gallery", "galerij", "museum", "muzej"],
+    "theatre": ["teatr", "theat", "izrad", "performance"],
+    "sports": ["sport", "skrej", "marathon", "maraton", "futbol", "basketbol", "hokej", "turnir", "tournament"],
+    "festivals": ["festival", "svetki", "festiv"],
+    "cinema": ["kino", "film", "cinema", "movie"],
+    "children": ["bern", "child", "kids", "family", "gimen"],
+    "lectures": ["lekcij", "lecture", "seminar", "talk", "diskusij", "workshop", "darbnic"],
+    "dance": ["dej", "dance", "balet", "ballet"],
+    "markets": ["tirg", "market", "gadatirg", "fair"],
+}
+
+
+def city_now() -> datetime:
+    return datetime.now(CITY_TIMEZONE) if CITY_TIMEZONE else datetime.now()
+
+
+def city_today() -> date:
+    return city_now().date()
+
+
+def fold(text: str) -> str:
+    """Lower-case and strip diacritics ('Izstādes' -> 'izstades')."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def canonical_category(*texts: str) -> str | None:
+    """Maps a category label (or, failing that, a title) to one of CATEGORY_SYNONYMS."""
+    for text in texts:
+        folded = fold(text)
+        if not folded:
+            continue
+        for category, stems in CATEGORY_SYNONYMS.items():
+            if any(stem in folded for stem in stems):
+                return category
+    return None
+
+
+def parse_events_page(content: bytes, limit: int | None = None):
+    """
+    Parses one calendar page. Returns the number of event list items found and
+    the extracted details of the first `limit` of them (all when limit is None).
+    """
+    soup = BeautifulSoup(content, 'lxml', parse_only=EVENT_LIST_STRAINER)
+
+    event_elements = soup.select(EVENT_ITEM_SELECTOR)
+
+    extracted_events = []
+    for event_li in event_elements[:limit]:
+        try:
+            # --- Use the class names within each 'li' ---
+            title_element = event_li.select_one('.title')
+            date_element = event_li.select_one('.event-date')
+            location_element = event_li.select_one('.event-place')
+            fee_element = event_li.select_one('.event-fee')
+            category_element = event_li.select_one(CATEGORY_SELECTOR)
+            # ------------------------------------------
+
+            title = title_element.get_text(strip=True) if title_element else "N/A"
+            # Combine date/time/place extraction, clean up whitespace
+            date_str = date_element.get_text(separator=' ', strip=True) if date_element else "N/A"
+            location = location_element.get_text(strip=True) if location_element else "N/A"
+            fee = fee_element.get_text(strip=True) if fee_element else None
+            category = category_element.get_text(strip=True) if category_element else None
+
+            if title != "N/A":
+                event_data = { "title": title, "date": date_str, "location": location }
+                if fee: event_data["fee"] = fee
+                if category: event_data["category"] = category
+                extracted_events.append(event_data)
+
+        except Exception as extract_error:
+            log.debug("Error extracting details from one event element: %s", extract_error)
+            continue
+
+    return len(event_elements), extracted_events
+
+
+def parse_events_timed(content: bytes):
+    """parse_events_page for a worker thread: returns (events, CPU seconds the parse took)."""
+    started = time.thread_time()
+    _, events = parse_events_page(content)
+    return events, time.thread_time() - started
+
+
+class EventsIndex:
+    def __init__(self, db_path: str, http_client: httpx.AsyncClient, base_url: str,
+                 window_days: int = 31, refresh_interval: float = 1800, locks=None,
+                 page_concurrency: int = PAGE_CONCURRENCY):
+        """locks: SharedLocks, so several worker processes crawl each day (and the window) only once."""
+        self.http_client = http_client
+        self.page_slots = asyncio.Semaphore(page_concurrency)
+        self.locks = locks
+        self.base_url = base_url
+        self.window_days = window_days
+        self.refresh_interval = refresh_interval
+        self.last_refresh = None
+        self.day_locks = {} # day -> asyncio.Lock, so a day is never crawled twice at once
+        self.stats = {"pages": 0, "not_modified": 0, "unchanged": 0, "parsed": 0, "parse_cpu_seconds": 0.0,
+                      "days_unchanged": 0, "days_rewritten": 0}
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                event_date TEXT NOT NULL,
+                title TEXT NOT NULL,
+                date_text TEXT,
+                place TEXT,
+                fee TEXT,
+                category TEXT,
+                category_key TEXT,
+                search_text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_date ON events (event_date);
+            CREATE INDEX IF NOT EXISTS idx_events_category_date ON events (category_key, event_date);
+            CREATE TABLE IF NOT EXISTS event_days (
+                event_date TEXT PRIMARY KEY,
+                refreshed_at REAL NOT NULL,
+                event_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS event_pages (
+                url TEXT PRIMARY KEY,
+                event_date TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                events TEXT NOT NULL, -- JSON list of the page's parsed events
+                fetched_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_event_pages_date ON event_pages (event_date, page);
+        """)
+        self.db.commit()
+
+    # --- Ingestion ---
+    def day_url(self, day: date, page: int) -> str:
+        day_str = day.strftime('%Y-%m-%d')
+        return f"{self.base_url}page:{page},date_from:{day_str},date_until:{day_str},a:f"
+
+    async def fetch_page(self, day: date, page: int):
+        """
+        Fetches one calendar page; returns (events, changed). A page the server reports as
+        not modified, or whose content hash matches the last crawl, is not parsed again.
+        """
+        url = self.day_url(day, page)
+        cached = self.db.execute(
+            "SELECT etag, last_modified, content_hash, events FROM event_pages WHERE url = ?", (url,)).fetchone()
+        headers = {'User-Agent': USER_AGENT}
+        if cached and cached[0]:
+            headers['If-None-Match'] = cached[0]
+        if cached and cached[1]:
+            headers['If-Modified-Since'] = cached[1]
+        async with self.page_slots:
+            with span("events_fetch", page=page) as fetch:
+                response = await self.http_client.get(url, headers=headers)
+                fetch["status"] = response.status_code
+        UPSTREAM_SECONDS.observe(response.elapsed.total_seconds(), upstream="events", endpoint="day_page")
+        UPSTREAM_REQUESTS.inc(upstream="events", endpoint="day_page", status=f"http_{response.status_code}")
+        self.stats["pages"] += 1
+        if response.status_code == 304 and cached:
+            self.stats["not_modified"] += 1
+            return json.loads(cached[3]), False
+        response.raise_for_status()
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        if cached and cached[2] == content_hash:
+            self.stats["unchanged"] += 1
+            events, changed = json.loads(cached[3]), False
+        else:
+            with span("events_parse", bytes=len(response.content)):
+                events, cpu_seconds = await asyncio.to_thread(parse_events_timed, response.content)
+            self.stats["parsed"] += 1
+            self.stats["parse_cpu_seconds"] += cpu_seconds
+            changed = True
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO event_pages (url, event_date, page, etag, last_modified, content_hash, events, "
+                "fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, day.isoformat(), page, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 content_hash, json.dumps(events, ensure_ascii=False), time.time()))
+        return events, changed
+
+    async def fetch_day(self, day: date):
+        """Crawls every page of one calendar day; returns (its parsed events, whether any page changed)."""
+        # The pages the last crawl found are fetched side by side, any further ones one at a time
+        known_pages = self.db.execute(
+            "SELECT COUNT(*) FROM event_pages WHERE event_date = ?", (day.isoformat(),)).fetchone()[0]
+        first_batch = await asyncio.gather(
+            *(self.fetch_page(day, page) for page in range(1, max(1, min(known_pages, MAX_PAGES_PER_DAY)) + 1)))
+        events, seen_titles, changed = [], set(), False
+        last_page = 0
+        for page in range(1, MAX_PAGES_PER_DAY + 1):
+            if page <= len(first_batch):
+                page_events, page_changed = first_batch[page - 1]
+            else:
+                page_events, page_changed = await self.fetch_page(day, page)
+            last_page = page
+            changed = changed or page_changed
+            # Past the last page the site may repeat a page or return an empty list
+            new_events = [ev for ev in page_events if (ev["title"], ev["date"]) not in seen_titles]
+            if not new_events:
+                break
+            seen_titles.update((ev["title"], ev["date"]) for ev in new_events)
+            events.extend(new_events)
+        # The day got shorter: forget the pages past its end, and the day's events changed
+        with self.db:
+            dropped = self.db.execute("DELETE FROM event_pages WHERE event_date = ? AND page > ?",
+                                      (day.isoformat(), last_page)).rowcount
+        return events, changed or dropped > 0
+
+    async def refresh_day(self, day: date, only_if_stale: bool = False):
+        lock = self.day_locks.setdefault(day, asyncio.Lock())
+        async with lock:
+            if self.locks:
+                # Another worker may be crawling the same day; its result lands in the shared table
+                async with self.locks.hold(f"events_day:{day.isoformat()}", ttl=120, timeout=120):
+                    await self._refresh_day(day, only_if_stale)
+            else:
+                await self._refresh_day(day, only_if_stale)
+
+    async def _refresh_day(self, day: date, only_if_stale: bool):
+        # Another caller may have refreshed the day while we waited for the lock
+        if only_if_stale and not self.stale_days(day, day):
+            return
+        events, changed = await self.fetch_day(day)
+        day_str = day.strftime('%Y-%m-%d')
+        if not changed and self.db.execute("SELECT 1 FROM event_days WHERE event_date = ?", (day_str,)).fetchone():
+            # Same pages as last time: the stored events are still right
+            self.stats["days_unchanged"] += 1
+            with self.db:
+                self.db.execute("UPDATE event_days SET refreshed_at = ? WHERE event_date = ?", (time.time(), day_str))
+            return
+        self.stats["days_rewritten"] += 1
+        rows = [
+            (day_str, ev["title"], ev["date"], ev["location"], ev.get("fee"), ev.get("category"),
+             canonical_category(ev.get("category"), ev["title"]),
+             fold(" ".join(filter(None, [ev["title"], ev.get("category"), ev["location"]]))))
+            for ev in events
+        ]
+        # Replace the day's events in one transaction, so readers never see a half-written day
+        with self.db:
+            self.db.execute("DELETE FROM events WHERE event_date = ?", (day_str,))
+            self.db.executemany(
+                "INSERT INTO events (event_date, title, date_text, place, fee, category, category_key, search_text) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute(
+                "INSERT OR REPLACE INTO event_days (event_date, refreshed_at, event_count) VALUES (?, ?, ?)",
+                (day_str, time.time(), len(rows)))
+
+    async def refresh_window(self):
+        """
+        Re-crawls today + window_days: days side by side, at most page_concurrency pages
+        at once. A failing day keeps its previous data.
+        """
+        started = time.time()
+        before = dict(self.stats)
+        today = city_today()
+        days = [today + timedelta(days=offset) for offset in range(self.window_days)]
+        results = await asyncio.gather(*(self.refresh_day(day) for day in days), return_exceptions=True)
+        failures = 0
+        for day, result in zip(days, results):
+            if isinstance(result, Exception):
+                failures += 1
+                log.warning("Events index: failed to refresh %s: %s", day, result)
+        with self.db:
+            self.db.execute("DELETE FROM events WHERE event_date < ?", (today.strftime('%Y-%m-%d'),))
+            self.db.execute("DELETE FROM event_days WHERE event_date < ?", (today.strftime('%Y-%m-%d'),))
+            self.db.execute("DELETE FROM event_pages WHERE event_date < ?", (today.isoformat(),))
+        for day in [d for d in self.day_locks if d < today]:
+            del self.day_locks[day]
+        self.last_refresh = time.time()
+        pages = self.stats["pages"] - before["pages"]
+        skipped = pages - (self.stats["parsed"] - before["parsed"])
+        log.info("Events index refreshed: %d days, %d failed, %d pages (%d not parsed again), %.0f ms parse CPU, %.1fs",
+                 self.window_days, failures, pages, skipped,
+                 (self.stats["parse_cpu_seconds"] - before["parse_cpu_seconds"]) * 1000, time.time() - started)
+
+    async def run_forever(self):
+        """Background job: refresh the window now and then every refresh_interval seconds."""
+        while True:
+            try:
+                # With several workers, whoever takes the interval's lease crawls; the rest read its results
+                if not self.locks or await self.locks.try_acquire("job:events_refresh", ttl=self.refresh_interval * 0.9):
+                    await self.refresh_window()
+            except Exception as e:
+                log.error("Events index refresh error: %s", e)
+            await asyncio.sleep(self.refresh_interval)
+
+    def snapshot(self) -> dict:
+        pages, parsed = self.stats["pages"], self.stats["parsed"]
+        return {
+            **self.stats,
+            "skip_rate": round((self.stats["not_modified"] + self.stats["unchanged"]) / pages, 3) if pages else 0.0,
+            "parse_ms_per_page": round(self.stats["parse_cpu_seconds"] * 1000 / parsed, 2) if parsed else 0.0,
+        }
+
+    # --- Queries ---
+    def stale_days(self, start_date: date, end_date: date) -> list:
+        """Days in the range that were never crawled or whose data is older than two refresh intervals."""
+        rows = dict(self.db.execute(
+            "SELECT event_date, refreshed_at FROM event_days WHERE event_date BETWEEN ? AND ?",
+            (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))).fetchall())
+        cutoff = time.time() - 2 * self.refresh_interval
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        return [day for day in days if rows.get(day.strftime('%Y-%m-%d'), 0) < cutoff]
+
+    async def ensure_days(self, start_date: date, end_date: date):
+        """Crawls on demand any day the background job hasn't covered yet (e.g. right after startup)."""
+        missing = self.stale_days(start_date, end_date)
+        if missing:
+            await asyncio.gather(*(self.refresh_day(day, only_if_stale=True) for day in missing))
+
+    def query(self, start_date: date, end_date: date, category: str | None = None, limit: int = 10):
+        """
+        Returns (total, events) for the date range, optionally filtered by category.
+        Known categories use the (category_key, event_date) index; anything else is
+        matched as text against title, category and place.
+        """
+        params = [start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')]
+        where = "event_date BETWEEN ? AND ?"
+        if category:
+            category_key = canonical_category(category)
+            if category_key:
+                where += " AND category_key = ?"
+                params.append(category_key)
+            else:
+                where += " AND search_text LIKE ?"
+                params.append(f"%{fold(category).strip()}%")
+
+        # Multi-day events are listed on every day they run; report each one once
+        total = self.db.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM events WHERE {where} GROUP BY title, place)", params).fetchone()[0]
+        rows = self.db.execute(
+            f"SELECT MIN(event_date), title, MIN(date_text), place, fee, category FROM events WHERE {where} "
+            "GROUP BY title, place ORDER BY 1, 3 LIMIT ?", params + [limit]).fetchall()
+        events = [
+            {"event_date": r[0], "title": r[1], "date": r[2], "location": r[3], "fee": r[4], "category": r[5]}
+            for r in rows
+        ]
+        return total, events
@@ -0,0 +1,194 @@
+# gazetteer.py
+
+# Local gazetteer of Liepāja landmarks and neighbourhoods, so the names people
+# actually ask about ("Jūrmalas parks", "Karosta", "Peter's Market") resolve to
+# coordinates without a geocoding pass. Matching is diacritic- and case-insensitive
+# and tolerates small typos. Anything the table doesn't know is geocoded once through
+# the Maps client (whose cache persists the answer) and reused from then on.
+
+import asyncio
+import difflib
+import logging
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from events_index import fold
+
+log = logging.getLogger(__name__)
+
+# Rough bounding box of the city (south-west, north-east), used to bias and sanity-check geocoding
+LIEPAJA_BOUNDS = ((56.44, 20.95), (56.60, 21.12))
+
+# Words that don't help telling places apart ("the Karosta prison, Liepāja" -> "karosta prison")
+NOISE_WORDS = {"the", "in", "at", "of", "liepaja", "liepajas", "latvia", "latvija"}
+
+FUZZY_CUTOFF = 0.85 # difflib ratio needed to accept a near miss
+
+# Names that mean "where the user is" (normalized)
+HERE_NAMES = {"near me", "nearby", "me", "here", "my location", "current location", "my current location",
+              "where i am", "around me", "close to me"}
+
+# (lat, lng) the app sent with the current request, if any
+user_location: ContextVar[tuple | None] = ContextVar("user_location", default=None)
+USER_LOCATION_RADIUS = 1000 # metres, search bias radius around the user
+
+
+@dataclass
+class Landmark:
+    name: str
+    lat: float
+    lng: float
+    radius: int = 800 # metres around the point that count as "near" it (search bias radius)
+    aliases: tuple = ()
+
+    @property
+    def latlng(self) -> str:
+        return f"{self.lat},{self.lng}"
+
+
+# The whole city: what "Liepāja" on its own (or "in Liepāja, Latvia") resolves to
+CITY = Landmark("Liepāja", 56.5107, 21.0106, 6000)
+
+# Coordinates are those of the landmark's main entrance or centre (WGS84)
+LANDMARKS = [
+    Landmark("Liepāja city centre", 56.5093, 21.0131, 2500,
+             ("city centre", "city center", "centre", "center", "centrs", "old town", "Rožu laukums",
+              "Rose Square", "Rožu square")),
+    Landmark("Peter's Market", 56.5118, 21.0127, 300, ("Pētertirgus", "Petertirgus", "Peter market", "Peters market")),
+    Landmark("Holy Trinity Cathedral", 56.5114, 21.0145, 300,
+             ("Sv. Trīsvienības katedrāle", "Trīsvienības katedrāle", "Trinity Cathedral", "Holy Trinity Church")),
+    Landmark("St. Anne's Church", 56.5046, 21.0142, 300, ("Sv. Annas baznīca", "Annas baznīca", "St Anne's Church", "Saint Anne's Church")),
+    Landmark("Great Amber Concert Hall", 56.5138, 21.0108, 300,
+             ("Lielais dzintars", "Great Amber", "Concert Hall Great Amber", "koncertzāle Lielais dzintars")),
+    Landmark("Liepāja Theatre", 56.5088, 21.0140, 300, ("Liepājas teātris", "theatre", "theater", "Liepaja Theater")),
+    Landmark("Liepāja University", 56.5105, 21.0122, 300, ("Liepājas Universitāte", "university")),
+    Landmark("Trade Canal", 56.5145, 21.0085, 600, ("Tirdzniecības kanāls", "canal", "promenade", "Liepāja promenade")),
+    Landmark("Seaside Park", 56.5050, 20.9990, 1200,
+             ("Jūrmalas parks", "Jūrmalas Park", "Jurmala Park", "Seaside park", "beach park")),
+    Landmark("Liepāja Beach", 56.5040, 20.9935, 1500, ("Liepājas pludmale", "beach", "pludmale", "Blue Flag beach")),
+    Landmark("Pūt, vējiņi! Open-Air Stage", 56.5060, 20.9985, 300, ("Pūt vējiņi estrāde", "estrāde", "open air stage")),
+    Landmark("Liepāja Museum", 56.5044, 21.0037, 300, ("Liepājas muzejs", "museum", "city museum")),
+    Landmark("Museum of Occupation Regimes", 56.5066, 21.0059, 300,
+             ("Liepāja Occupation Museum", "Okupāciju režīmos muzejs", "occupation museum")),
+    Landmark("Railway Station", 56.5197, 21.0252, 300,
+             ("Liepājas stacija", "Liepāja station", "train station", "stacija", "railway")),
+    Landmark("Bus Station", 56.5194, 21.0236, 300, ("Liepājas autoosta", "autoosta", "bus terminal", "coach station")),
+    Landmark("Ferry Terminal", 56.5189, 21.0042, 500, ("prāmju terminālis", "ferry port", "port", "Liepāja port")),
+    Landmark("Liepāja Airport", 56.5175, 21.0969, 800, ("Liepājas lidosta", "airport", "lidosta")),
+    Landmark("Liepāja Olympic Centre", 56.5254, 21.0173, 500,
+             ("Olimpiskais centrs", "Olympic Center", "Liepājas Olimpiskais centrs", "sports centre")),
+    Landmark("Lake Liepāja", 56.4800, 21.0800, 3000, ("Liepājas ezers", "lake", "ezers")),
+    Landmark("Oskars Kalpaks Bridge", 56.5364, 21.0150, 300, ("Oskara Kalpaka tilts", "Kalpaka tilts", "Karosta bridge", "swing bridge")),
+    Landmark("Karosta", 56.5470, 21.0060, 2000, ("Karostas", "Kara osta", "naval port", "military port")),
+    Landmark("Karosta Prison", 56.5499, 21.0195, 300, ("Karostas cietums", "prison", "military prison")),
+    Landmark("St. Nicholas Naval Cathedral", 56.5536, 21.0216, 300,
+             ("Sv. Nikolaja Jūras katedrāle", "Nikolaja katedrāle", "Naval Cathedral", "St Nicholas Cathedral",
+              "Orthodox Cathedral")),
+    Landmark("Northern Forts", 56.5710, 21.0000, 800, ("Ziemeļu forti", "Northern Fortifications", "forts")),
+    Landmark("Karosta Northern Breakwater", 56.5585, 20.9960, 500, ("Ziemeļu mols", "northern pier", "breakwater", "mols")),
+    Landmark("Vecliepāja", 56.5060, 21.0110, 1200, ("Old Liepāja",)),
+    Landmark("Jaunliepāja", 56.5200, 21.0250, 1500, ("New Liepāja",)),
+    Landmark("Ezerkrasts", 56.4930, 21.0450, 1500, ("Ezerkrasta", "lakeside")),
+    Landmark("Zaļā birze", 56.4935, 21.0240, 1200, ("Zala birze", "Green Grove")),
+    Landmark("Tosmare", 56.5330, 21.0400, 1500, ()),
+]
+
+
+def normalize_place_name(name: str) -> str:
+    """'Jūrmalas Park, Liepāja' -> 'jurmalas park'; 'Peter's' and 'Peters' normalize the same."""
+    folded = fold(name).replace("'", "").replace("’", "")
+    words = re.findall(r"[a-z0-9]+", folded)
+    return " ".join(w for w in words if w not in NOISE_WORDS)
+
+
+def in_liepaja(lat: float, lng: float) -> bool:
+    (south, west), (north, east) = LIEPAJA_BOUNDS
+    return south <= lat <= north and west <= lng <= east
+
+
+class Gazetteer:
+    def __init__(self, landmarks: list = LANDMARKS):
+        self.index = {} # normalized name or alias -> Landmark
+        for landmark in landmarks:
+            for alias in (landmark.name, *landmark.aliases):
+                key = normalize_place_name(alias)
+                if key:
+                    self.index.setdefault(key, landmark)
+
+    def match(self, name: str) -> Landmark | None:
+        """Exact match on the normalized name first, then the closest alias within FUZZY_CUTOFF."""
+        key = normalize_place_name(name)
+        if not key:
+            return CITY if name and name.strip() else None
+        if key in self.index:
+            return self.index[key]
+        close = difflib.get_close_matches(key, self.index.keys(), n=1, cutoff=FUZZY_CUTOFF)
+        return self.index[close[0]] if close else None
+
+
+@dataclass
+class ResolvedPlace:
+    query: str       # what to send to the Maps API: "lat,lng", or the text fallback
+    latlng: tuple | None
+    radius: int | None
+    source: str      # "user", "gazetteer", "geocode", "text", or "no_location" ("here" without a shared location)
+
+
+class PlaceResolver:
+    """
+    Turns free-text place names into coordinates: the user's own location for "near me",
+    then the gazetteer, then (cached) geocoding, then plain text.
+    """
+
+    def __init__(self, gazetteer: Gazetteer, maps_client=None, default_radius: int = 1500):
+        self.gazetteer = gazetteer
+        self.maps_client = maps_client
+        self.default_radius = default_radius
+        self.stats = {"user": 0, "no_location": 0, "gazetteer": 0, "geocode": 0, "text": 0}
+
+    async def resolve(self, name: str) -> ResolvedPlace:
+        if normalize_place_name(name) in HERE_NAMES:
+            location = user_location.get()
+            if location:
+                self.stats["user"] += 1
+                return ResolvedPlace(f"{location[0]},{location[1]}", location, USER_LOCATION_RADIUS, "user")
+            # No location shared. Callers must say so, not present some point as the user's position
+            self.stats["no_location"] += 1
+            return ResolvedPlace("Liepāja, Latvia", None, None, "no_location")
+
+        landmark = self.gazetteer.match(name)
+        if landmark:
+            self.stats["gazetteer"] += 1
+            return ResolvedPlace(landmark.latlng, (landmark.lat, landmark.lng), landmark.radius, "gazetteer")
+
+        if self.maps_client:
+            try:
+                location = await self.geocode(name)
+                if location:
+                    self.stats["geocode"] += 1
+                    return ResolvedPlace(f"{location[0]},{location[1]}", location, self.default_radius, "geocode")
+            except Exception as e:
+                log.warning("Geocoding '%s' failed, using the name as text: %s", name, e)
+
+        self.stats["text"] += 1
+        return ResolvedPlace(f"{name}, Liepāja, Latvia", None, None, "text")
+
+    async def resolve_many(self, names: list) -> dict:
+        """Resolves each distinct name once, concurrently. Returns name -> ResolvedPlace."""
+        unique = list(dict.fromkeys(names))
+        resolved = await asyncio.gather(*(self.resolve(name) for name in unique))
+        return dict(zip(unique, resolved))
+
+    async def geocode(self, name: str):
+        """(lat, lng) of the best geocoding match inside Liepāja, or None."""
+        body = await self.maps_client.geocode(f"{name}, Liepāja, Latvia", bounds=LIEPAJA_BOUNDS, region="lv")
+        for result in body.get("results", []):
+            # A bare "Liepāja" answer means Google didn't know the place; routing to the
+            # city centroid would be worse than letting Directions try the text itself
+            if "locality" in result.get("types", []) or "political" in result.get("types", []):
+                continue
+            location = result.get("geometry", {}).get("location", {})
+            if "lat" in location and in_liepaja(location["lat"], location["lng"]):
+                return location["lat"], location["lng"]
+        return None
@@ -0,0 +1,190 @@
+# http_pool.py
+
+# Shared outbound HTTP layer. Every upstream (OpenAI, Google Maps, the events calendar)
+# gets its own sized, keep-alive connection pool; HTTP/2 is negotiated when the optional
+# 'h2' package is installed and the server supports it. Requests are retried on 429/5xx
+# with exponential backoff and full jitter, and never outlive the current run's deadline.
+
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"} # safe to repeat after a response/partial send
+
+# Absolute time.monotonic() deadline of the run the current task is working for (None = no limit)
+run_deadline: ContextVar[float | None] = ContextVar("run_deadline", default=None)
+
+
+def set_run_deadline(seconds_from_now: float):
+    """Every outbound request made from this task (and tasks it starts) must finish within this budget."""
+    run_deadline.set(time.monotonic() + seconds_from_now)
+
+
+def remaining_budget() -> float | None:
+    deadline = run_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value and value.strip().isdigit():
+        return float(value.strip())
+    return None
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """A response body that reports when it is closed, i.e. when its connection is free again."""
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close:
+                self.on_close()
+                self.on_close = None
+
+
+class RetryingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, name: str, wrapped: httpx.AsyncHTTPTransport, stats: dict,
+                 retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0):
+        self.name = name
+        self.wrapped = wrapped
+        self.stats = stats
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: spreads retries of many clients hitting the same limit
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def apply_deadline(self, request: httpx.Request):
+        remaining = remaining_budget()
+        if remaining is None:
+            return
+        if remaining <= 0:
+            self.stats["deadline_exceeded"] += 1
+            raise httpx.TimeoutException(f"Run deadline exceeded before request to {self.name}", request=request)
+        timeouts = dict(request.extensions.get("timeout") or {})
+        for phase in ("connect", "read", "write", "pool"):
+            configured = timeouts.get(phase)
+            timeouts[phase] = remaining if configured is None else min(configured, remaining)
+        request.extensions["timeout"] = timeouts
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self.apply_deadline(request)
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            try:
+                response = await self.wrapped.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # Nothing reached the server yet, so any method can be retried
+                delay = self.backoff(attempt)
+                if attempt >= self.retries or not self._can_wait(delay):
+                    self.stats["failures"] += 1
+                    raise
+                log.info("HTTP %s: %s, retrying in %.2fs", self.name, type(e).__name__, delay)
+            except httpx.HTTPError:
+                self.stats["failures"] += 1
+                raise
+            else:
+                if (response.status_code not in RETRY_STATUSES or request.method not in RETRY_METHODS
+                        or attempt >= self.retries):
+                    if response.status_code >= 400:
+                        self.stats["error_responses"] += 1
+                    return self._track_body(response)
+                delay = retry_after_seconds(response) or self.backoff(attempt)
+                if not self._can_wait(delay):
+                    self.stats["error_responses"] += 1
+                    return self._track_body(response)
+                await response.aclose()
+                log.info("HTTP %s: status %s, retrying in %.2fs", self.name, response.status_code, delay)
+            finally:
+                self.stats["in_flight"] -= 1
+            self.stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _track_body(self, response: httpx.Response) -> httpx.Response:
+        """Counts the response as open until its body is closed (streamed answers hold a connection for long)."""
+        self.stats["open_responses"] += 1
+        response.stream = TrackedStream(response.stream, self._body_closed)
+        return response
+
+    def _body_closed(self):
+        self.stats["open_responses"] -= 1
+
+    def _can_wait(self, delay: float) -> bool:
+        remaining = remaining_budget()
+        return remaining is None or delay < remaining - 0.5
+
+    async def aclose(self):
+        await self.wrapped.aclose()
+
+
+class OutboundHttp:
+    """Creates and tracks the per-upstream clients, and reports their pool statistics."""
+
+    def __init__(self):
+        self.clients = {} # name -> (client, transport, settings)
+
+    def create(self, name: str, max_connections: int, max_keepalive: int, timeout: float = 10.0,
+               retries: int = 2, keepalive_expiry: float = 30.0, **client_kwargs) -> httpx.AsyncClient:
+        stats = {"requests": 0, "retries": 0, "failures": 0, "error_responses": 0, "deadline_exceeded": 0, "in_flight": 0,
+                 "open_responses": 0}
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                              keepalive_expiry=keepalive_expiry)
+        transport = RetryingTransport(name, httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2_AVAILABLE),
+                                      stats, retries=retries)
+        client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(timeout), **client_kwargs)
+        self.clients[name] = (client, transport, {"max_connections": max_connections, "max_keepalive": max_keepalive})
+        return client
+
+    def pool_stats(self) -> dict:
+        report = {}
+        for name, (_, transport, settings) in self.clients.items():
+            # Requests holding or waiting for a connection: sent and not answered yet, or body still open
+            active = transport.stats["in_flight"] + transport.stats["open_responses"]
+            report[name] = {
+                **settings,
+                **transport.stats,
+                "http2_enabled": HTTP2_AVAILABLE,
+                "active_requests": active,
+                # Over HTTP/1.1 a connection carries one request at a time; HTTP/2 multiplexes them
+                "waiting_requests": 0 if HTTP2_AVAILABLE else max(0, active - settings["max_connections"]),
+                **self._connection_counts(transport),
+            }
+        return report
+
+    @staticmethod
+    def _connection_counts(transport: RetryingTransport) -> dict:
+        """Open and idle connections, read from httpcore's pool. Not a stable API: left out if it changes."""
+        try:
+            connections = list(transport.wrapped._pool.connections)
+            return {"connections": len(connections), "idle_connections": sum(1 for c in connections if c.is_idle())}
+        except Exception:
+            return {}
+
+    async def aclose(self):
+        for client, _, _ in self.clients.values():
+            await client.aclose()
@@ -2,19 +2,38 @@
 
 # Importing libraries
 import json
-import openai
+import logging
+from openai import NOT_GIVEN, AsyncOpenAI
 import time
 import asyncio
 # import pandas as pd # 
-import requests
-from bs4 import BeautifulSoup
-from datetime import date, timedelta # For date calculations
+import httpx
+from datetime import timedelta # For date calculations
 import re
-
-from fastapi import FastAPI, HTTPException 
-from pydantic import BaseModel
-
-import googlemaps
+import uuid
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from maps_client import AsyncMapsClient
+from tool_cache import ToolCache
+from events_index import EventsIndex, city_now, city_today
+from assistant_registry import AssistantRegistry
+from message_store import MessageStore
+from http_pool import OutboundHttp, set_run_deadline
+from gazetteer import Gazetteer, PlaceResolver, user_location
+from poi_index import PoiIndex, category_for
+from thread_scheduler import ThreadScheduler
+from answer_cache import AnswerCache, SpareThreads
+from prefetch import Prefetcher
+from admission import AdmissionController, Rejected, peer_address, trusted_networks
+from shared_locks import SharedLocks
+from context_window import ContextWindow
+from place_store import PlaceStore, minute_of_week, parse_moment
+from telemetry import REGISTRY, TOKENS, TOOL_CALLS, annotate, end_trace, record_span, span, start_trace
 import os
 # from dotenv import load_dotenv 
 
@@ -22,8 +41,61 @@ import os
 
 # --- Replace with environment variables in a real project. ---
 
-openai.api_key = ""
-MAPS_API_KEY = "" 
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+MAPS_API_KEY = os.getenv("MAPS_API_KEY", "")
+EVENTS_BASE_URL = os.getenv("EVENTS_BASE_URL", "https://kalendars.liepaja.lv/lv/")
+
+# Per-tool and per-stage details are logged at DEBUG; turn traces are sampled (see telemetry.py)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("chatbot")
+logging.getLogger("httpx").setLevel(logging.WARNING) # one INFO line per upstream request is too much under load
+
+# SQLite database next to this file (threads, messages, caches)
+DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "assistant_threads.db"))
+# Set TOOL_CACHE_PERSIST=0 to keep the Maps cache in memory only
+TOOL_CACHE_PERSIST = os.getenv("TOOL_CACHE_PERSIST", "1") != "0"
+# Events calendar index: how many days ahead are kept and how often they are re-crawled
+EVENTS_WINDOW_DAYS = int(os.getenv("EVENTS_WINDOW_DAYS", "31"))
+EVENTS_REFRESH_INTERVAL = float(os.getenv("EVENTS_REFRESH_INTERVAL", "1800"))
+EVENTS_OUTPUT_LIMIT = 10
+# Outbound connection pool sizes (connections per upstream, per worker process)
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "256"))
+MAPS_POOL_SIZE = int(os.getenv("MAPS_POOL_SIZE", "64"))
+EVENTS_POOL_SIZE = int(os.getenv("EVENTS_POOL_SIZE", "4"))
+# Seconds between background refreshes of the local places snapshot (0 = only learn from tool calls)
+POI_REFRESH_INTERVAL = float(os.getenv("POI_REFRESH_INTERVAL", "86400"))
+# Whole-answer cache for first turns of new threads (0 entries = off). ANSWER_CACHE_SIMILARITY > 0
+# also matches reworded questions (cosine of char trigram TF-IDF, e.g. 0.75); 0 = exact text only.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+SPARE_THREADS = int(os.getenv("SPARE_THREADS", "4")) # empty threads kept ready for cached answers
+# Start the tool calls a message most likely needs while the run is still queued (0 = off)
+TOOL_PREFETCH = os.getenv("TOOL_PREFETCH", "1") != "0"
+# Admission control: turns worked on at once, how many may queue and for how long (seconds),
+# and rate limits in messages per minute (0 = no limit): per peer address (everyone behind one NAT),
+# per client within it (X-Client-Id, else the address) and per thread
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "128"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+PEER_RATE_PER_MINUTE = float(os.getenv("PEER_RATE_PER_MINUTE", "300"))
+CLIENT_RATE_PER_MINUTE = float(os.getenv("CLIENT_RATE_PER_MINUTE", "30"))
+THREAD_RATE_PER_MINUTE = float(os.getenv("THREAD_RATE_PER_MINUTE", "12"))
+# Reverse proxies (addresses or CIDR ranges, comma separated) whose X-Forwarded-For names the real peer
+TRUSTED_PROXIES = trusted_networks(os.getenv("TRUSTED_PROXIES", ""))
+# Bounded context for long threads: runs see at most CONTEXT_MAX_MESSAGES messages, and once a thread's
+# prompt passes CONTEXT_SUMMARY_TOKENS all but the last CONTEXT_KEEP_MESSAGES are rolled up into a summary
+# (0 = no summaries, only the cap)
+CONTEXT_KEEP_MESSAGES = int(os.getenv("CONTEXT_KEEP_MESSAGES", "10"))
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "40"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "4000"))
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+# Run engine: "assistants" (OpenAI threads and runs) or "chat" (streamed Chat Completions, history kept locally)
+CHAT_ENGINE = os.getenv("CHAT_ENGINE", "assistants")
+# Several worker processes (uvicorn --workers N) share the SQLite database. With SHARED_STATE on (the
+# default, since a worker can't tell whether it has siblings), runs on a thread are also serialized
+# across workers; background jobs always run in one worker only. SHARED_STATE=0 saves a single
+# worker the lock queries.
+SHARED_STATE = os.getenv("SHARED_STATE", "1") != "0"
 
 # Define the tools (API calls)
 tools = [
@@ -35,7 +107,7 @@ tools = [
             "parameters": {
                 "type": "object", "properties": {
                     "place_type": { "type": "string", "description": "The type of place to search for (e.g., 'pizza restaurant', 'cafe', 'supermarket', 'pharmacy', 'beach access'). Be specific." },
-                    "area": { "type": "string", "description": "Optional. The specific area or landmark in Liepāja to search near (e.g., 'city center', 'Jūrmalas Park', 'Karosta', 'Peter's Market'). If not specified, assumes a general city search." }
+                    "area": { "type": "string", "description": "Optional. The specific area or landmark in Liepāja to search near (e.g., 'city center', 'Jūrmalas Park', 'Karosta', 'Peter's Market'), or 'near me' for places near the user's current location. If not specified, assumes a general city search." }
                 }, "required": ["place_type"]
             }
         }
@@ -53,6 +125,20 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_opening_hours",
+            "description": "Checks whether one or more places in Liepāja are open now, or at a given time and day. Use this for questions like 'which of these cafes are open now' or 'is the museum open on Sunday at 11:00', passing every place name in one call.",
+            "parameters": {
+                "type": "object", "properties": {
+                    "place_names": { "type": "array", "items": { "type": "string" }, "description": "Names of the places in Liepāja to check (up to 10), as found with 'find_places_in_liepaja'." },
+                    "time": { "type": "string", "description": "Optional. Time of day, e.g. '21:00' or '9pm'. Defaults to now." },
+                    "day": { "type": "string", "description": "Optional. 'today', 'tomorrow' or a weekday name, e.g. 'Sunday'. Defaults to today." }
+                }, "required": ["place_names"]
+            }
+        }
+    },
     { 
         "type": "function",
         "function": {
@@ -81,6 +167,20 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_distance_matrix",
+            "description": "Calculates travel distance and duration from each of several origins to each of several destinations in Liepāja in one lookup. Use this instead of repeated 'get_distance_time' calls when comparing multiple places, e.g. 'how far is each of these cafes from me'.",
+            "parameters": {
+                "type": "object", "properties": {
+                    "origins": { "type": "array", "items": { "type": "string" }, "description": "Starting point addresses or landmarks in Liepāja (up to 25)." },
+                    "destinations": { "type": "array", "items": { "type": "string" }, "description": "Destination addresses or landmarks in Liepāja (up to 25)." },
+                    "mode": { "type": "string", "description": "Optional mode of transport. Defaults to 'driving'. Options: 'driving', 'walking', 'bicycling', 'transit'." }
+                }, "required": ["origins", "destinations"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -95,7 +195,7 @@ tools = [
                     },
                     "category": {
                         "type": "string",
-                        "description": "Optional. Filter events by category if possible (e.g., 'concerts', 'exhibitions', 'sports')."
+                        "description": "Optional. Filter events by category, e.g., 'concerts', 'exhibitions', 'theatre', 'sports', 'festivals', 'cinema', 'children', 'lectures', 'dance', 'markets'. Other words are matched against event titles and places."
                     }
                 },
                 "required": [] 
@@ -104,34 +204,44 @@ tools = [
     }
 ]
 
-# Initialize clients (with error handling)
-assistant = None
-if openai.api_key:
-    try:
-        assistant = openai.beta.assistants.create(
-            name="Liepāja Helper Bot",
-            instructions="You are a helpful assistant focused on providing information about Liepāja, Latvia. Use the available tools to answer questions about locations and local information. Be concise and helpful.",
-            model="gpt-4o-mini",
-            tools=tools
-        )
-        print(f"OpenAI Assistant created/retrieved with ID: {assistant.id}")
-    except Exception as e:
-        print(f"CRITICAL ERROR creating OpenAI assistant: {e}")
-else:
-    print("CRITICAL ERROR: OpenAI API Key is missing!")
-
-gmaps = None
-if MAPS_API_KEY:
-    try:
-        gmaps = googlemaps.Client(key=MAPS_API_KEY)
-        print("Google Maps client initialized.")
-    except Exception as e:
-        print(f"ERROR initializing Google Maps client: {e}")
-else:
-    print("ERROR: Google Maps API Key is missing!")
-
-# Define coordinates for Liepāja (approx center)
+# Assistant configuration. The assistant itself is created once and reused across restarts
+# (see assistant_registry.py); changing anything here updates it on the next start.
+ASSISTANT_KEY = os.getenv("ASSISTANT_KEY", "liepaja-helper-bot")
+ASSISTANT_CONFIG = {
+    "name": "Liepāja Helper Bot",
+    "instructions": "You are a helpful assistant focused on providing information about Liepāja, Latvia. Use the available tools to answer questions about locations and local information. Be concise and helpful.",
+    "model": "gpt-4o-mini",
+    "tools": tools,
+}
+
+# Clients and shared state. Importing this module has no side effects: everything
+# below is created in the FastAPI lifespan hook (see FASTAPI APP AND ENDPOINTS).
+outbound: OutboundHttp | None = None # Sized keep-alive pools for every upstream, with retries and deadlines
+openai_client: AsyncOpenAI | None = None # Threads, runs, streaming
+assistant_id: str | None = None
+gmaps: AsyncMapsClient | None = None
+place_resolver: PlaceResolver | None = None # Landmark names -> coordinates (gazetteer, then cached geocoding)
+poi_index: PoiIndex | None = None # Local snapshot of places for nearest-N questions
+scheduler: ThreadScheduler | None = None # One run at a time per thread; concurrent messages are coalesced
+tool_cache: ToolCache | None = None # Maps answers; the same handful of queries dominates traffic
+events_index: EventsIndex | None = None # Local, indexed copy of the events calendar
+message_store: MessageStore | None = None # Local copy of every conversation, written behind
+answer_cache: AnswerCache | None = None # Finished answers to common first questions
+spare_threads: SpareThreads | None = None # Pre-created threads handed out with cached answers
+prefetcher: Prefetcher | None = None # Guesses tool calls from the message and starts them early
+admission: AdmissionController | None = None # Bounded queue, rate limits and load shedding for the chat endpoints
+shared_locks: SharedLocks | None = None # Leases shared by all worker processes (thread runs, background jobs)
+context_window: ContextWindow | None = None # Per-thread token counts, truncation and summaries of old turns
+place_store: PlaceStore | None = None # Place details by place_id, opening hours as week intervals, name index
+
+# Define coordinates for Liepāja (approx center), used to bias searches to the city
 LIEPAJA_COORDS = (56.5107, 21.0106)
+LIEPAJA_SEARCH_RADIUS = 6000 # metres, covers the city including Karosta
+MAX_HOURS_PLACES = 10 # places per check_opening_hours call
+NO_LOCATION_MESSAGE = ("The user's location has not been shared with the app, so 'here' / 'my location' is unknown. "
+                       "Ask them to allow location access in the app or to name a place in Liepāja.")
+# Neighbourhoods the places snapshot is refreshed around
+POI_REFRESH_AREAS = ["city centre", "Karosta", "Jaunliepāja", "Ezerkrasts", "Zaļā birze", "Tosmare"]
 
 # //////////////////////////////////////// TOOL FUNCTIONS /////////////////////////////////////////////////
 
@@ -140,21 +250,49 @@ def strip_html(text):
     if not text: return ""
     return re.sub('<[^<]+?>', '', text)
 
-def find_places_in_liepaja(place_type: str, area: str = "Liepāja"):
+async def find_places_in_liepaja(place_type: str, area: str = "Liepāja"):
     """
     Finds places using Google Maps Places API based on type and area within Liepāja.
     """
-    print(f"Tool Function: Finding '{place_type}' in area '{area}'")
+    log.debug("Tool: finding '%s' in area '%s'", place_type, area)
     if not gmaps:
          return "Error: Google Maps client is not available on the server."
     try:
-        search_query = f"{place_type} in {area}, Liepāja, Latvia"
+        # Known areas/landmarks (and "near me") become a real location bias instead of words Google has to geocode
+        resolved = await place_resolver.resolve(area)
+        area_label = "your location" if resolved.source == "user" else area
+        if resolved.source == "no_location":
+            # Still useful city-wide, as long as the answer doesn't pretend it is near the user
+            area = "Liepāja"
+            area_label = "Liepāja (the user's location is not shared, so this is a city-wide search)"
+
+        # Common categories near a known point are answered from the local snapshot
+        category = category_for(place_type)
+        if category and resolved.latlng:
+            nearby = poi_index.answer(*resolved.latlng, category, limit=3, radius=resolved.radius)
+            if nearby:
+                place_store.remember_names((place.place_id, place.name, place.address) for _, place in nearby)
+                output_lines = [f"Found these '{place_type}' options near '{area_label}':"]
+                for i, (distance, place) in enumerate(nearby, 1):
+                    output_lines.append(f"{i}. {place.name} at {place.address or 'N/A'} "
+                                        f"(Rating: {place.rating or 'N/A'}, {distance / 1000:.1f} km away)")
+                return "\n".join(output_lines)
+
+        if resolved.latlng:
+            search_query = f"{place_type}, Liepāja"
+            location, radius = resolved.latlng, resolved.radius
+        else:
+            search_query = f"{place_type} in {area}, Liepāja, Latvia"
+            location, radius = LIEPAJA_COORDS, LIEPAJA_SEARCH_RADIUS
         # Use Text Search for flexibility
-        places_result = gmaps.places(query=search_query, language='en')
+        places_result = await gmaps.places(query=search_query, language='en', location=location, radius=radius)
 
         if places_result.get('status') == 'OK' and places_result.get('results'):
             results = places_result['results']
-            output_lines = [f"Found these '{place_type}' options near '{area}':"]
+            poi_index.ingest(results) # every answer from Maps grows the local snapshot
+            place_store.remember_names((place.get('place_id'), place.get('name'),
+                                        place.get('vicinity', place.get('formatted_address'))) for place in results)
+            output_lines = [f"Found these '{place_type}' options near '{area_label}':"]
             for i, place in enumerate(results[:3], 1): # Limit to top 3
                 name = place.get('name', 'N/A')
                 address = place.get('vicinity', place.get('formatted_address', 'N/A'))
@@ -166,73 +304,125 @@ def find_places_in_liepaja(place_type: str, area: str = "Liepāja"):
         elif places_result.get('status') == 'ZERO_RESULTS':
             return f"Sorry, I couldn't find any '{place_type}' matching your search near '{area}' in Liepāja."
         else:
-            print(f"Google Maps API Error Status: {places_result.get('status')}")
+            log.warning("Places search error status: %s", places_result.get('status'))
+            annotate(status="error") # a quota or key failure must not end up in the answer cache
             return f"Sorry, there was an issue searching for places (Status: {places_result.get('status')}). Check API key/quota?"
     except Exception as e:
-        print(f"Error calling Google Maps API: {e}")
+        log.warning("Error calling Google Maps API: %s", e)
+        annotate(status="error")
         return "Sorry, I encountered an error while searching for places."
     
-def get_place_details(place_name: str, address: str = None):
-    """Gets details for a specific place using Google Maps Places API."""
-    print(f"Tool Function: Getting details for '{place_name}'" + (f" at '{address}'" if address else ""))
-    if not gmaps: return "Error: Google Maps client is not available."
+async def load_place_details(place_name: str, address: str = None):
+    """
+    (PlaceDetails, None) for a named place, or (None, message for the model). Places looked
+    up before are answered from the place store; otherwise the name index spares the text
+    search, and only a place never seen in any answer needs both Maps calls.
+    """
+    place = place_store.lookup(place_name, address)
+    if place:
+        return place, None
+    if not gmaps:
+        annotate(status="error")
+        return None, "Error: Google Maps client is not available."
 
-    try:
+    place_id = place_store.place_id_for(place_name, address)
+    if not place_id:
         query = f"{place_name} in Liepāja, Latvia"
         if address: query = f"{place_name}, {address}, Liepāja, Latvia"
 
-        find_result = gmaps.places(query=query, language='en')
+        find_result = await gmaps.places(query=query, language='en', location=LIEPAJA_COORDS, radius=LIEPAJA_SEARCH_RADIUS)
 
         if not (find_result.get('status') == 'OK' and find_result.get('results')):
-            print(f"GMaps Find Error Status: {find_result.get('status')}")
-            return f"Sorry, I couldn't find a unique place matching '{place_name}'" + (f" at '{address}'" if address else "") + "."
+            log.debug("Place details lookup status: %s", find_result.get('status'))
+            if find_result.get('status') not in ('OK', 'ZERO_RESULTS'):
+                annotate(status="error")
+            return None, f"Sorry, I couldn't find a unique place matching '{place_name}'" + (f" at '{address}'" if address else "") + "."
+        results = find_result['results']
+        place_store.remember_names((r.get('place_id'), r.get('name'), r.get('formatted_address')) for r in results)
 
         # Assume the first result is the best match (could be improved)
-        place_id = find_result['results'][0].get('place_id')
-        if not place_id: return "Sorry, couldn't get a place ID to fetch details."
-
-        print(f"  Found place_id: {place_id}")
-
-        # Get details using the place_id
-        fields = ['name', 'formatted_address', 'international_phone_number',
-                  'website', 'opening_hours', 'rating', 'user_ratings_total']
-        details_result = gmaps.place(place_id=place_id, fields=fields, language='en')
-
-        if details_result.get('status') == 'OK':
-            place = details_result.get('result', {})
-            details = [f"Details for {place.get('name', place_name)}:"]
-            if place.get('formatted_address'): details.append(f"- Address: {place.get('formatted_address')}")
-            if place.get('international_phone_number'): details.append(f"- Phone: {place.get('international_phone_number')}")
-            if place.get('website'): details.append(f"- Website: {place.get('website')}")
-            if place.get('rating'): details.append(f"- Rating: {place.get('rating')} ({place.get('user_ratings_total', 0)} reviews)")
-            if 'opening_hours' in place and place['opening_hours'].get('weekday_text'):
-                details.append("- Opening Hours:")
-                details.extend([f"  {line}" for line in place['opening_hours']['weekday_text']])
-            elif 'opening_hours' in place:
-                 details.append(f"- Open Now: {'Yes' if place['opening_hours'].get('open_now') else 'No'}")
-
-            return "\n".join(details)
-        else:
-            print(f"GMaps Details Error Status: {details_result.get('status')}")
-            return f"Sorry, couldn't fetch details. Status: {details_result.get('status')}"
+        place_id = results[0].get('place_id')
+        if not place_id:
+            annotate(status="error")
+            return None, "Sorry, couldn't get a place ID to fetch details."
+
+    # Get details using the place_id
+    fields = ['name', 'formatted_address', 'international_phone_number',
+              'website', 'opening_hours', 'rating', 'user_ratings_total']
+    details_result = await gmaps.place(place_id=place_id, fields=fields, language='en')
+
+    if details_result.get('status') != 'OK':
+        log.warning("Place details error status: %s", details_result.get('status'))
+        annotate(status="error")
+        return None, f"Sorry, couldn't fetch details. Status: {details_result.get('status')}"
+    return place_store.store(place_id, details_result.get('result', {}), asked_as=(place_name, address)), None
+
+async def get_place_details(place_name: str, address: str = None):
+    """Gets details for a specific place, from the place store or the Google Maps Places API."""
+    log.debug("Tool: getting details for '%s' at '%s'", place_name, address)
+    try:
+        place, error = await load_place_details(place_name, address)
+        if error: return error
+
+        details = [f"Details for {place.name}:"]
+        if place.address: details.append(f"- Address: {place.address}")
+        if place.phone: details.append(f"- Phone: {place.phone}")
+        if place.website: details.append(f"- Website: {place.website}")
+        if place.rating: details.append(f"- Rating: {place.rating} ({place.ratings_total or 0} reviews)")
+        if place.weekday_text:
+            details.append("- Opening Hours:")
+            details.extend([f"  {line}" for line in place.weekday_text])
+        open_now = place.describe_open(minute_of_week(city_now())) # from the stored hours, not a stale open_now
+        if open_now:
+            details.append(f"- Open Now: {open_now}")
+
+        return "\n".join(details)
 
     except Exception as e:
-        print(f"Error getting place details: {e}")
+        log.warning("Error getting place details: %s", e)
+        annotate(status="error")
         return "Sorry, an error occurred while fetching place details."
 
-def get_directions(origin: str, destination: str, mode: str = 'driving'):
+async def check_opening_hours(place_names: list, at_time: str = None, day: str = None):
+    """Whether each place is open at a moment (now by default), evaluated against the stored opening hours."""
+    log.debug("Tool: checking opening hours of %s at '%s' on '%s'", place_names, at_time, day)
+    names = [name for name in place_names if name and name.strip()][:MAX_HOURS_PLACES]
+    if not names: return "Please name the places to check."
+    try:
+        minute, label = parse_moment(at_time, day)
+    except ValueError as e:
+        annotate(status="bad_arguments")
+        return f"Sorry, I {e}. Please give the day as 'today', 'tomorrow' or a weekday name, and the time like '21:00'."
+    # Each name is one stored-record lookup once seen; the rest are fetched side by side
+    found = await asyncio.gather(*(load_place_details(name) for name in names), return_exceptions=True)
+
+    output_lines = [f"Opening hours checked for {label} (Liepāja time):"]
+    for name, result in zip(names, found):
+        if isinstance(result, Exception):
+            log.warning("Error checking opening hours of '%s': %s", name, result)
+            annotate(status="error")
+            output_lines.append(f"- {name}: Sorry, an error occurred while fetching its details.")
+            continue
+        place, error = result
+        if error:
+            output_lines.append(f"- {name}: {error}")
+        else:
+            output_lines.append(f"- {place.name}: {place.describe_open(minute) or 'opening hours are not listed'}")
+    return "\n".join(output_lines)
+
+async def get_directions(origin: str, destination: str, mode: str = 'driving'):
     """Gets directions using Google Maps Directions API."""
-    print(f"Tool Function: Getting directions from '{origin}' to '{destination}' by {mode}")
+    log.debug("Tool: directions from '%s' to '%s' by %s", origin, destination, mode)
     if not gmaps: return "Error: Google Maps client is not available."
 
-    # Append city/country for better geocoding by Google
-    origin_full = f"{origin}, Liepāja, Latvia"
-    destination_full = f"{destination}, Liepāja, Latvia"
     valid_modes = ['driving', 'walking', 'bicycling', 'transit']
     if mode.lower() not in valid_modes: mode = 'driving' # Default to driving if mode is invalid
 
     try:
-        directions_result = gmaps.directions(origin_full, destination_full, mode=mode.lower(), language='en')
+        # Coordinates when the place is known, "<name>, Liepāja, Latvia" otherwise
+        places = await place_resolver.resolve_many([origin, destination])
+        if any(place.source == "no_location" for place in places.values()): return NO_LOCATION_MESSAGE
+        directions_result = await gmaps.directions(places[origin].query, places[destination].query, mode=mode.lower(), language='en')
 
         if directions_result: # API returns a list of routes
             route = directions_result[0] # Get the first route
@@ -253,21 +443,22 @@ def get_directions(origin: str, destination: str, mode: str = 'driving'):
             return f"Sorry, couldn't find directions from '{origin}' to '{destination}' by {mode}."
 
     except Exception as e:
-        print(f"Error getting directions: {e}")
+        log.warning("Error getting directions: %s", e)
+        annotate(status="error")
         return "Sorry, an error occurred while fetching directions."
 
-def get_distance_time(origin: str, destination: str, mode: str = 'driving'):
+async def get_distance_time(origin: str, destination: str, mode: str = 'driving'):
     """Gets distance and travel time using Google Maps Distance Matrix API."""
-    print(f"Tool Function: Getting distance/time from '{origin}' to '{destination}' by {mode}")
+    log.debug("Tool: distance/time from '%s' to '%s' by %s", origin, destination, mode)
     if not gmaps: return "Error: Google Maps client is not available."
 
-    origin_full = f"{origin}, Liepāja, Latvia"
-    destination_full = f"{destination}, Liepāja, Latvia"
     valid_modes = ['driving', 'walking', 'bicycling', 'transit']
     if mode.lower() not in valid_modes: mode = 'driving'
 
     try:
-        matrix_result = gmaps.distance_matrix(origins=[origin_full], destinations=[destination_full], mode=mode.lower(), language='en')
+        places = await place_resolver.resolve_many([origin, destination])
+        if any(place.source == "no_location" for place in places.values()): return NO_LOCATION_MESSAGE
+        matrix_result = await gmaps.distance_matrix(origins=[places[origin].query], destinations=[places[destination].query], mode=mode.lower(), language='en')
 
         if matrix_result.get('status') == 'OK' and matrix_result['rows'][0]['elements'][0].get('status') == 'OK':
             element = matrix_result['rows'][0]['elements'][0]
@@ -277,267 +468,755 @@ def get_distance_time(origin: str, destination: str, mode: str = 'driving'):
         elif matrix_result.get('status') == 'OK' and matrix_result['rows'][0]['elements'][0].get('status') == 'ZERO_RESULTS':
              return f"Could not calculate route between {origin} and {destination} by {mode}."
         else:
-            print(f"GMaps Matrix Error Status: {matrix_result.get('status')}, Element Status: {matrix_result['rows'][0]['elements'][0].get('status')}")
+            log.warning("Distance Matrix error status: %s", matrix_result.get('status'))
+            annotate(status="error")
             return f"Sorry, couldn't calculate distance/time. Status: {matrix_result.get('status')}"
 
     except Exception as e:
-        print(f"Error getting distance matrix: {e}")
+        log.warning("Error getting distance matrix: %s", e)
+        annotate(status="error")
         return "Sorry, an error occurred while calculating distance/time."
-    
-def get_liepaja_events(date_range: str = "next_7_days", category: str = None):
+
+# Distance Matrix limits per request: 25 origins, 25 destinations, 100 elements
+MATRIX_MAX_SIDE = 25
+MATRIX_MAX_ELEMENTS = 100
+
+def matrix_chunks(origins: list, destinations: list):
+    """Splits origins x destinations into blocks that each fit in one Distance Matrix request."""
+    dest_size = min(MATRIX_MAX_SIDE, len(destinations))
+    origin_size = max(1, min(MATRIX_MAX_SIDE, MATRIX_MAX_ELEMENTS // dest_size))
+    for o in range(0, len(origins), origin_size):
+        for d in range(0, len(destinations), dest_size):
+            yield o, d, origins[o:o + origin_size], destinations[d:d + dest_size]
+
+async def get_distance_matrix(origins: list, destinations: list, mode: str = 'driving'):
+    """Gets distance and travel time for every origin/destination pair using as few Distance Matrix requests as possible."""
+    log.debug("Tool: distance matrix for %d origin(s) x %d destination(s) by %s", len(origins), len(destinations), mode)
+    if not gmaps: return "Error: Google Maps client is not available."
+
+    origins = [str(o).strip() for o in origins if str(o).strip()][:MATRIX_MAX_SIDE]
+    destinations = [str(d).strip() for d in destinations if str(d).strip()][:MATRIX_MAX_SIDE]
+    if not origins or not destinations:
+        return "Please provide at least one origin and one destination."
+    valid_modes = ['driving', 'walking', 'bicycling', 'transit']
+    if mode.lower() not in valid_modes: mode = 'driving'
+
+    try:
+        places = await place_resolver.resolve_many(origins + destinations)
+        if any(place.source == "no_location" for place in places.values()): return NO_LOCATION_MESSAGE
+        chunks = list(matrix_chunks(origins, destinations))
+        # Blocks are independent, so they are requested concurrently
+        results = await asyncio.gather(*(
+            gmaps.distance_matrix(origins=[places[o].query for o in chunk_origins],
+                                  destinations=[places[d].query for d in chunk_destinations],
+                                  mode=mode.lower(), language='en')
+            for _, _, chunk_origins, chunk_destinations in chunks
+        ))
+
+        cells = {} # (origin index, destination index) -> "15 mins, 3.2 km"
+        for (o_start, d_start, _, _), matrix_result in zip(chunks, results):
+            if matrix_result.get('status') != 'OK':
+                log.warning("Distance Matrix error status: %s", matrix_result.get('status'))
+                annotate(status="error")
+                return f"Sorry, couldn't calculate distance/time. Status: {matrix_result.get('status')}"
+            for i, row in enumerate(matrix_result['rows']):
+                for j, element in enumerate(row['elements']):
+                    if element.get('status') == 'OK':
+                        cells[(o_start + i, d_start + j)] = f"{element['duration']['text']}, {element['distance']['text']}"
+                    else:
+                        cells[(o_start + i, d_start + j)] = "no route"
+
+        # --- Format Output: one compact line per origin ---
+        output_lines = [f"Travel {mode} (time, distance):"]
+        for i, origin in enumerate(origins):
+            pairs = "; ".join(f"{destination}: {cells.get((i, j), 'no route')}" for j, destination in enumerate(destinations))
+            output_lines.append(f"From {origin} -> {pairs}")
+        annotate(matrix_requests=len(chunks), matrix_elements=len(origins) * len(destinations))
+        return "\n".join(output_lines)
+
+    except Exception as e:
+        log.warning("Error getting distance matrix: %s", e)
+        annotate(status="error")
+        return "Sorry, an error occurred while calculating distance/time."
+
+async def get_liepaja_events(date_range: str = "next_7_days", category: str = None):
     """
-    Fetches upcoming events from the Liepāja event calendar website by scraping.
-    date_range options: 'today', 'tomorrow', 'this_weekend', 'next_7_days', etc.
+    Answers from the local events index, which a background job fills from the Liepāja event calendar.
+    date_range options: 'today', 'tomorrow', 'this_weekend', 'this_week', 'next_7_days', etc.
     """
-    print(f"Tool Function: Getting events for date_range '{date_range}'")
+    log.debug("Tool: events for date_range '%s', category '%s'", date_range, category)
 
     # --- Calculate Date Range ---
-    today = date.today()
+    date_range = (date_range or "next_7_days").strip().lower().replace(" ", "_") # 'this weekend' -> 'this_weekend'
+    today = city_today()
     start_date = today
     end_date = today + timedelta(days=7) # Default: next 7 days
 
-    # ... (Date calculation logic remains the same) ...
     if date_range == "today": end_date = start_date
     elif date_range == "tomorrow": start_date = today + timedelta(days=1); end_date = start_date
     elif date_range == "this_weekend": start_date = today + timedelta(days=(5 - today.weekday() + 7) % 7); end_date = start_date + timedelta(days=1)
+    elif date_range == "this_week": end_date = today + timedelta(days=6 - today.weekday())
     elif date_range == "next_7_days": end_date = today + timedelta(days=6)
 
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
-    print(f"  Date range calculated: {start_date_str} to {end_date_str}")
-
-    # --- Construct URL ---
-    base_url = "https://kalendars.liepaja.lv/lv/"
-    target_url = f"{base_url}page:1,date_from:{start_date_str},date_until:{end_date_str},a:f"
-    print(f"  Fetching URL: {target_url}")
 
     try:
-        # --- Fetch HTML ---
-        headers = {'User-Agent': 'LiepajaStudyBot/1.0 (+http://example.com)'}
-        response = requests.get(target_url, headers=headers, timeout=10)
-        response.raise_for_status()
-
-        # --- Parse HTML ---
-        soup = BeautifulSoup(response.content, 'lxml')
-
-        # --- Find Event Elements using the CORRECTED selector ---
-        event_item_selector = '.events.list li' # <--- UPDATED SELECTOR
-        event_elements = soup.select(event_item_selector)
-        # -------------------------------------------------------
-        print(f"  Found {len(event_elements)} elements matching '{event_item_selector}'.")
-
-        if not event_elements:
-            return f"No event list items found on the calendar page for {start_date_str} to {end_date_str} using selector '{event_item_selector}'."
-
-        extracted_events = []
-        for event_li in event_elements[:5]: # Limit to first 5 events
-            try:
-                # --- Use the class names within each 'li' ---
-                title_element = event_li.select_one('.title')
-                date_element = event_li.select_one('.event-date')
-                location_element = event_li.select_one('.event-place')
-                fee_element = event_li.select_one('.event-fee')
-                # ------------------------------------------
-
-                title = title_element.get_text(strip=True) if title_element else "N/A"
-                # Combine date/time/place extraction, clean up whitespace
-                date_str = date_element.get_text(separator=' ', strip=True) if date_element else "N/A"
-                location = location_element.get_text(strip=True) if location_element else "N/A"
-                fee = fee_element.get_text(strip=True) if fee_element else None
-
-                if title != "N/A":
-                    event_data = { "title": title, "date": date_str, "location": location }
-                    if fee: event_data["fee"] = fee
-                    extracted_events.append(event_data)
-
-            except Exception as extract_error:
-                print(f"  Error extracting details from one event element: {extract_error}")
-                continue
+        # Days the background job hasn't reached yet (e.g. right after startup) are crawled now
+        with span("events_ensure_days"):
+            await events_index.ensure_days(start_date, end_date)
+        with span("events_query"):
+            total, extracted_events = events_index.query(start_date, end_date, category=category, limit=EVENTS_OUTPUT_LIMIT)
 
         # --- Format Output ---
+        category_info = f" matching '{category}'" if category else ""
         if not extracted_events:
-             return f"Found event list items but couldn't extract details for {start_date_str} to {end_date_str}."
+            return f"No events{category_info} found in the Liepāja calendar for {start_date_str} to {end_date_str}."
 
-        output_lines = [f"Upcoming Events in Liepāja ({start_date_str} to {end_date_str}):"]
+        output_lines = [f"Upcoming Events in Liepāja{category_info} ({start_date_str} to {end_date_str}):"]
         for i, ev in enumerate(extracted_events, 1):
-             fee_info = f" ({ev['fee']})" if 'fee' in ev else ""
-             # Improved formatting for date/time which might be multiline
+             fee_info = f" ({ev['fee']})" if ev['fee'] else ""
              output_lines.append(f"{i}. {ev['title']} [{ev['date']}] at {ev['location']}{fee_info}")
 
-        if len(event_elements) > 5:
-             output_lines.append("...")
+        if total > len(extracted_events):
+             output_lines.append(f"...and {total - len(extracted_events)} more.")
 
         return "\n".join(output_lines)
 
-    except requests.exceptions.RequestException as req_err: # ...
-        print(f"Error fetching event page: {req_err}")
+    except httpx.HTTPError as req_err: # ...
+        log.warning("Error fetching event page: %s", req_err)
+        annotate(status="error")
         return "Sorry, I couldn't connect to the Liepāja event calendar right now."
     except Exception as e: # ...
-        print(f"Error processing events: {e}")
+        log.warning("Error processing events: %s", e)
+        annotate(status="error")
         return "Sorry, an error occurred while processing events."
 
 
+# /////////////////////////////////////// TOOL CALL DISPATCH //////////////////////////////////////////////////
+
+# Tool calls from one requires_action step are independent of each other, so they run
+# side by side on the event loop. Step latency is then the slowest tool, not the sum.
+TOOL_CALL_TIMEOUT = 20 # seconds per tool call
+
+async def execute_tool_call(function_name: str, raw_arguments: str | None):
+    """Runs a single tool function by name and returns its output."""
+    try:
+        function_args = json.loads(raw_arguments) if raw_arguments else {}
+    except json.JSONDecodeError as e:
+        log.warning("Invalid arguments for %s: %s", function_name, e)
+        annotate(status="bad_arguments")
+        return "Error: The tool arguments could not be parsed."
+    output = "Function not recognized"
+
+    # --- Call appropriate function based on name ---
+    if function_name == "find_places_in_liepaja":
+        place_type = function_args.get("place_type", "")
+        area = function_args.get("area", "Liepāja")
+        output = await find_places_in_liepaja(place_type=place_type, area=area)
+
+    elif function_name == "get_place_details":
+        place_name = function_args.get("place_name", "")
+        address = function_args.get("address")
+        output = await get_place_details(place_name=place_name, address=address)
+
+    elif function_name == "check_opening_hours":
+        place_names = function_args.get("place_names") or []
+        # Tolerate a single string where a list was expected
+        if isinstance(place_names, str): place_names = [place_names]
+        output = await check_opening_hours(place_names=place_names, at_time=function_args.get("time"),
+                                           day=function_args.get("day"))
+
+    elif function_name == "get_directions":
+        origin = function_args.get("origin", "")
+        destination = function_args.get("destination", "")
+        mode = function_args.get("mode", "driving")
+        output = await get_directions(origin=origin, destination=destination, mode=mode)
+
+    elif function_name == "get_distance_time":
+        origin = function_args.get("origin", "")
+        destination = function_args.get("destination", "")
+        mode = function_args.get("mode", "driving")
+        output = await get_distance_time(origin=origin, destination=destination, mode=mode)
+
+    elif function_name == "get_distance_matrix":
+        origins = function_args.get("origins") or []
+        destinations = function_args.get("destinations") or []
+        # Tolerate a single string where a list was expected
+        if isinstance(origins, str): origins = [origins]
+        if isinstance(destinations, str): destinations = [destinations]
+        mode = function_args.get("mode", "driving")
+        output = await get_distance_matrix(origins=origins, destinations=destinations, mode=mode)
+
+    elif function_name == "get_liepaja_events":
+        date_range = function_args.get("date_range", "next_7_days") # Default if not specified by MI
+        category = function_args.get("category")
+        output = await get_liepaja_events(date_range=date_range, category=category)
+
+    else:
+        log.warning("Unknown function call requested: %s", function_name)
+        annotate(status="unknown_function")
+    # ------------------------------------------------
+
+    return output
+
+async def run_tool_call_with_timeout(tool_call, timeout: float, prefetch=None):
+    """
+    Runs one tool call under its own timeout; errors become the tool output.
+    A call that was prefetched for this turn uses the prefetch instead of starting again.
+    """
+    name = tool_call.function.name
+    # The span collects what the tool and the Maps client annotate (status, upstream statuses)
+    with span(f"tool:{name}") as tool_span:
+        try:
+            prefetched = prefetch.claim(name, tool_call.function.arguments) if prefetch else None
+            if prefetched:
+                tool_span["prefetched"] = True
+                output, tool_span["status"] = await asyncio.wait_for(prefetched, timeout)
+            else:
+                output = await asyncio.wait_for(execute_tool_call(name, tool_call.function.arguments), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Tool %s timed out after %ss", name, timeout)
+            tool_span["status"] = "timeout"
+            output = f"Sorry, the {name} lookup took too long to respond."
+        except Exception as e:
+            log.warning("Tool %s raised an error: %s", name, e)
+            tool_span["status"] = "error"
+            output = f"Sorry, an error occurred while running {name}."
+        tool_span.setdefault("status", "ok")
+    TOOL_CALLS.inc(tool=name, status=tool_span["status"])
+    output = str(output)
+    log.debug("Tool output (%s): %.200s", name, output)
+    return {"tool_call_id": tool_call.id, "output": output}
+
+async def run_tool_calls(tool_calls, timeout: float = TOOL_CALL_TIMEOUT, prefetch=None):
+    """
+    Runs all tool calls of one requires_action step concurrently.
+    Each call gets its own timeout; outputs are returned in tool_call order.
+    """
+    with span("tools", count=len(tool_calls)):
+        return await asyncio.gather(*(run_tool_call_with_timeout(tool_call, timeout, prefetch) for tool_call in tool_calls))
+
+
 # /////////////////////////////////////// FUNCTION TO WORK WITH ASSISTANT //////////////////////////////////////////////////
 
-def handle_user_query_with_assistant(user_input: str, thread_id: str | None = None):
+LOCATION_INSTRUCTIONS = ("The user shared their current location. For questions about places near them, "
+                         "use area 'near me' (or origin 'my location' for directions).")
+MAX_RUN_TIME = 60 # seconds, overall budget for one user turn
+RUN_END_STATUSES = {
+    "thread.run.completed": "completed",
+    "thread.run.failed": "failed",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.expired": "expired",
+    "thread.run.incomplete": "incomplete",
+}
+
+async def stream_assistant_run(user_input: str | list, thread_id: str | None = None, location: tuple | None = None):
     """
-    Handles interaction with the OpenAI assistant, including tool calls,
-    using an existing thread ID if provided, or creating a new one.
-    Returns a dictionary containing the answer and the thread_id used.
+    Event-driven run engine built on the Assistants streaming API.
+    Yields dict events as they happen:
+      {"type": "thread", "thread_id": ...}  - thread used for this turn
+      {"type": "delta", "text": ...}        - a chunk of the reply text
+      {"type": "tool_call", "name": ...}    - the assistant asked for a tool
+      {"type": "done", "answer": ..., "thread_id": ...}  - always the last event
+    Tool calls are answered as soon as the requires_action event arrives and the
+    run continues on the stream returned by submit_tool_outputs_stream.
+    location is the (lat, lng) the app sent, if any; the tools use it for "near me".
+    user_input may be a list: messages coalesced by the scheduler are answered by one run.
     """
-    if not assistant or not openai.api_key:
-         return {"answer": "Error: OpenAI Assistant is not configured correctly.", "thread_id": thread_id}
+    user_messages = [user_input] if isinstance(user_input, str) else list(user_input)
+    if not assistant_id or not openai_client:
+        yield {"type": "done", "answer": "Error: OpenAI Assistant is not configured correctly.", "thread_id": thread_id}
+        return
 
     current_thread_id = thread_id
+    run_id = None
+    deadline = time.time() + MAX_RUN_TIME
+    # Outbound requests of this turn (OpenAI and every tool) share the same budget
+    set_run_deadline(MAX_RUN_TIME)
+    # Tool calls run in tasks started from here, so they see the caller's location
+    user_location.set(location)
+    # Every stage below (and every tool) is a span of this turn's trace
+    trace = start_trace(messages=len(user_messages))
+    turn_status = "error"
+    # Likely tool calls start now and run while the thread is looked up and the run is queued
+    prefetch = prefetcher.begin(user_messages, location) if prefetcher else None
     try:
         # --- Thread Creation/Re-use ---
-        if current_thread_id:
-            print(f"Reusing existing thread: {current_thread_id}")
-            try:
-                # Verify thread exists before proceeding
-                thread = openai.beta.threads.retrieve(current_thread_id)
-            except Exception as thread_error:
-                 print(f"Failed to retrieve thread {current_thread_id}, creating new one. Error: {thread_error}")
-                 current_thread_id = None # Force creation
-        if not current_thread_id:
-            thread_object = openai.beta.threads.create()
-            current_thread_id = thread_object.id
-            print(f"Created new thread: {current_thread_id}")
+        with span("thread_lookup") as lookup:
+            if current_thread_id:
+                lookup["source"] = "local"
+                # Threads we created or already verified are known locally; only unknown IDs cost a round trip
+                if not message_store.is_known_thread(current_thread_id):
+                    try:
+                        # Verify thread exists before proceeding
+                        lookup["source"] = "retrieved"
+                        await openai_client.beta.threads.retrieve(current_thread_id)
+                        message_store.remember_thread(current_thread_id)
+                    except Exception as thread_error:
+                        log.warning("Failed to retrieve thread %s, creating new one. Error: %s", current_thread_id, thread_error)
+                        current_thread_id = None # Force creation
+            if not current_thread_id:
+                lookup["source"] = "created"
+                thread_object = await openai_client.beta.threads.create()
+                current_thread_id = thread_object.id
+        trace.attrs["thread_id"] = current_thread_id
+        for message in user_messages:
+            message_store.record(current_thread_id, "user", message)
+        yield {"type": "thread", "thread_id": current_thread_id}
         # -----------------------------
 
-        openai.beta.threads.messages.create(
-            thread_id=current_thread_id, role="user", content=user_input
+        # Long threads: the run sees only the latest messages, plus a summary of the older ones
+        truncation, summary = None, None
+        if context_window:
+            with span("context_window"):
+                truncation, summary = context_window.run_options(current_thread_id)
+        instructions = "\n\n".join(filter(None, [LOCATION_INSTRUCTIONS if location else None, summary])) or None
+
+        # The user message(s) ride along with the run request, saving separate messages.create calls
+        stream_manager = openai_client.beta.threads.runs.stream(
+            thread_id=current_thread_id, assistant_id=assistant_id,
+            additional_messages=[{"role": "user", "content": message} for message in user_messages],
+            additional_instructions=instructions,
+            truncation_strategy=truncation,
+            timeout=MAX_RUN_TIME,
         )
-        run = openai.beta.threads.runs.create(
-            thread_id=current_thread_id, assistant_id=assistant.id
-        )
-
-        # Wait loop (consider adding a maximum timeout)
-        max_wait_time = 60 # seconds
-        start_time = time.time()
-        while run.status in ["queued", "in_progress", "cancelling"]:
-            if time.time() - start_time > max_wait_time:
-                 print("Run timed out.")
-                 # Try to cancel the run
-                 try: openai.beta.threads.runs.cancel(thread_id=current_thread_id, run_id=run.id)
-                 except: pass # Ignore cancel error if already finished/failed
-                 return {"answer": "Sorry, the request took too long to process.", "thread_id": current_thread_id}
-
-            time.sleep(1)
-            run = openai.beta.threads.runs.retrieve(thread_id=current_thread_id, run_id=run.id)
-            print(f"Run status: {run.status}")
-
-        # Handle Tool Calls
-        if run.status == "requires_action":
-            print("Run requires action...")
-            tool_outputs = []
-            if run.required_action and run.required_action.type == "submit_tool_outputs":
-                for tool_call in run.required_action.submit_tool_outputs.tool_calls:
-                    function_args = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
-                    output = "Function not recognized"
-
-                    # --- Call appropriate function based on name ---
-                    if tool_call.function.name == "find_places_in_liepaja":
-                        print("  Calling find_places_in_liepaja tool")
-                        place_type = function_args.get("place_type", "")
-                        area = function_args.get("area", "Liepāja")
-                        output = find_places_in_liepaja(place_type=place_type, area=area)
-
-                    elif tool_call.function.name == "get_place_details": 
-                        print("  Calling get_place_details tool")
-                        place_name = function_args.get("place_name", "")
-                        address = function_args.get("address") 
-                        output = get_place_details(place_name=place_name, address=address)
-
-                    elif tool_call.function.name == "get_directions": 
-                        print("  Calling get_directions tool")
-                        origin = function_args.get("origin", "")
-                        destination = function_args.get("destination", "")
-                        mode = function_args.get("mode", "driving")
-                        output = get_directions(origin=origin, destination=destination, mode=mode)
-
-                    elif tool_call.function.name == "get_distance_time": 
-                        print("  Calling get_distance_time tool")
-                        origin = function_args.get("origin", "")
-                        destination = function_args.get("destination", "")
-                        mode = function_args.get("mode", "driving")
-                        output = get_distance_time(origin=origin, destination=destination, mode=mode)
-
-                    elif tool_call.function.name == "get_liepaja_events": 
-                        print("  Calling get_liepaja_events tool")
-                        date_range = function_args.get("date_range", "next_7_days") # Default if not specified by MI
-                        category = function_args.get("category") 
-                        output = get_liepaja_events(date_range=date_range, category=category)
-
-                    else:
-                        print(f"Unknown function call requested: {tool_call.function.name}")
-                    # ------------------------------------------------
-
-                    print(f"  Tool Output: {output[:200]}...")
-                    tool_outputs.append({"tool_call_id": tool_call.id, "output": str(output)})
-
-                # Submit outputs
-                run = openai.beta.threads.runs.submit_tool_outputs(
-                    thread_id=current_thread_id, run_id=run.id, tool_outputs=tool_outputs
+        answer_parts = []
+        final_status = None
+        error_message = None
+        # Stage boundaries are stream events, so these stages are timed between events
+        step_started = time.perf_counter() # run request sent / tool outputs submitted
+        run_created_at = None
+        first_token_seen = False
+        context_tokens = 0 # prompt of the largest model step, from the run step events
+
+        while stream_manager is not None:
+            tool_outputs = None
+            async with stream_manager as stream:
+                async for event in stream:
+                    if time.time() > deadline:
+                        log.warning("Run %s on thread %s timed out.", run_id, current_thread_id)
+                        turn_status = "timeout"
+                        if run_id:
+                            try: await openai_client.beta.threads.runs.cancel(thread_id=current_thread_id, run_id=run_id)
+                            except Exception: pass # Ignore cancel error if already finished/failed
+                        yield {"type": "done", "answer": "Sorry, the request took too long to process.", "thread_id": current_thread_id}
+                        return
+
+                    now = time.perf_counter()
+                    if event.event == "thread.run.created":
+                        run_id = event.data.id
+                        run_created_at = now
+                        # Includes adding the user message(s), which ride along with the run request
+                        record_span("run_create", now - step_started)
+                    elif event.event == "thread.run.in_progress" and run_created_at is not None:
+                        record_span("run_queue", now - run_created_at)
+                        run_created_at = None
+                        step_started = now
+                    elif event.event == "thread.message.delta":
+                        if not first_token_seen:
+                            first_token_seen = True
+                            record_span("time_to_first_token", now - trace.started)
+                        for part in event.data.delta.content or []:
+                            if part.type == "text" and part.text and part.text.value:
+                                answer_parts.append(part.text.value)
+                                yield {"type": "delta", "text": part.text.value}
+                    elif event.event == "thread.message.completed":
+                        record_span("final_message", now - step_started)
+                    elif event.event == "thread.run.step.completed" and event.data.usage:
+                        context_tokens = max(context_tokens, event.data.usage.prompt_tokens)
+                    elif event.event == "thread.run.requires_action":
+                        run = event.data
+                        record_span("model_step", now - step_started)
+                        if run.required_action and run.required_action.type == "submit_tool_outputs":
+                            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                            for tool_call in tool_calls:
+                                yield {"type": "tool_call", "name": tool_call.function.name}
+                            tool_outputs = await run_tool_calls(tool_calls, prefetch=prefetch)
+                        else:
+                            log.error("Run %s requires action but no valid action was found.", run_id)
+                            final_status = "failed"
+                            error_message = "Error processing required action."
+                    elif event.event in RUN_END_STATUSES:
+                        final_status = RUN_END_STATUSES[event.event]
+                        if event.data.last_error:
+                            error_message = event.data.last_error.message
+                        if event.data.usage:
+                            TOKENS.inc(event.data.usage.prompt_tokens, kind="prompt")
+                            TOKENS.inc(event.data.usage.completion_tokens, kind="completion")
+                            trace.attrs["tokens"] = event.data.usage.total_tokens
+                            if context_window:
+                                # Without step events, the run's total is a safe over-estimate
+                                context_window.record_usage(current_thread_id, event.data.usage,
+                                                            context_tokens or event.data.usage.prompt_tokens)
+                    elif event.event == "error":
+                        final_status = "failed"
+                        error_message = str(event.data)
+
+            # Submit-and-continue: the run resumes on a new stream
+            stream_manager = None
+            if tool_outputs is not None:
+                stream_manager = openai_client.beta.threads.runs.submit_tool_outputs_stream(
+                    thread_id=current_thread_id, run_id=run_id, tool_outputs=tool_outputs,
+                    timeout=max(1, deadline - time.time()),
                 )
-                # Wait again
-                start_time = time.time() # Reset timeout start
-                while run.status in ["queued", "in_progress", "cancelling"]:
-                     if time.time() - start_time > max_wait_time:
-                         print("Run timed out after tool submission.")
-                         try: openai.beta.threads.runs.cancel(thread_id=current_thread_id, run_id=run.id)
-                         except: pass
-                         return {"answer": "Sorry, the request took too long after using a tool.", "thread_id": current_thread_id}
-                     time.sleep(1)
-                     run = openai.beta.threads.runs.retrieve(thread_id=current_thread_id, run_id=run.id)
-                     print(f"Run status after tool submission: {run.status}")
-            else:
-                 print("Error: requires_action but no valid action found.")
-                 return {"answer": "Error processing required action.", "thread_id": current_thread_id}
+                step_started = time.perf_counter()
 
         # Final Response Check
-        final_answer = "Sorry, an unexpected error occurred."
-        if run.status == "completed":
-            messages_response = openai.beta.threads.messages.list(thread_id=current_thread_id, order="desc", limit=1)
-            if messages_response.data and messages_response.data[0].content:
-                 content_item = messages_response.data[0].content[0]
-                 if hasattr(content_item, 'text') and hasattr(content_item.text, 'value'):
-                     final_answer = content_item.text.value
-                 else: final_answer = "Received unexpected response format from AI."
-            else: final_answer = "Could not retrieve response from AI."
-        elif run.status == "failed":
-            error_message = run.last_error.message if hasattr(run, 'last_error') and run.last_error else "Unknown failure reason."
-            print(f"Run failed! Error: {error_message}")
-            final_answer = f"Sorry, the request failed." # Keep user message simpler
+        if final_status == "completed":
+            final_answer = "".join(answer_parts) or "Could not retrieve response from AI."
+            message_store.record(current_thread_id, "bot", final_answer)
+        elif final_status == "failed":
+            log.error("Run %s failed: %s", run_id, error_message or 'Unknown failure reason.')
+            final_answer = "Sorry, the request failed." # Keep user message simpler
         else:
-            print(f"Run ended with unexpected status: {run.status}")
-            final_answer = f"Sorry, the process ended unexpectedly."
+            log.error("Run %s ended with unexpected status: %s", run_id, final_status)
+            final_answer = "Sorry, the process ended unexpectedly."
+        turn_status = final_status or "unknown"
+        tool_errors = sum(1 for s in trace.spans if s["name"].startswith("tool:") and s.get("status") != "ok")
 
-        return {"answer": final_answer, "thread_id": current_thread_id}
+        yield {"type": "done", "answer": final_answer, "thread_id": current_thread_id,
+               "status": turn_status, "tool_errors": tool_errors}
 
     except Exception as e:
-        print(f"An error occurred in handle_user_query_with_assistant: {e}")
-        return {"answer": "An internal server error occurred while processing your request.", "thread_id": current_thread_id}
+        log.exception("An error occurred in stream_assistant_run: %s", e)
+        yield {"type": "done", "answer": "An internal server error occurred while processing your request.", "thread_id": current_thread_id}
+    finally:
+        if prefetch:
+            prefetch.discard() # guesses the model never asked for
+        end_trace(trace, turn_status)
+
+# Chat Completions engine: the history lives in the local message store, so a turn is one
+# streamed request per model step (plus the tools), instead of thread, run and stream calls.
+MAX_MODEL_STEPS = 5 # model calls per turn; the last one may not call tools
+
+def new_chat_thread_id() -> str:
+    return f"chat_{uuid.uuid4().hex}"
+
+async def stream_chat_run(user_input: str | list, thread_id: str | None = None, location: tuple | None = None):
+    """
+    Run engine built on streamed Chat Completions with function calling; yields the same
+    events as stream_assistant_run. Thread IDs are local (known to the message store),
+    threads started on the Assistants engine continue here with their stored history.
+    """
+    user_messages = [user_input] if isinstance(user_input, str) else list(user_input)
+    if not openai_client:
+        yield {"type": "done", "answer": "Error: OpenAI is not configured correctly.", "thread_id": thread_id}
+        return
+
+    deadline = time.time() + MAX_RUN_TIME
+    set_run_deadline(MAX_RUN_TIME)
+    user_location.set(location)
+    trace = start_trace(messages=len(user_messages), engine="chat")
+    turn_status = "error"
+    prefetch = prefetcher.begin(user_messages, location) if prefetcher else None
+    current_thread_id = thread_id
+    try:
+        with span("thread_lookup") as lookup:
+            lookup["source"] = "local"
+            if not current_thread_id or not message_store.is_known_thread(current_thread_id):
+                lookup["source"] = "created"
+                current_thread_id = new_chat_thread_id()
+        trace.attrs["thread_id"] = current_thread_id
+        # Earlier turns from the local store, bounded like an Assistants run would be
+        with span("history"):
+            truncation, summary = None, None
+            if context_window:
+                truncation, summary = context_window.run_options(current_thread_id)
+            total = message_store.count(current_thread_id)
+            visible = truncation["last_messages"] if truncation else total
+            history = await message_store.messages_range(current_thread_id, total - visible, total) if total else []
+        for message in user_messages:
+            message_store.record(current_thread_id, "user", message)
+        yield {"type": "thread", "thread_id": current_thread_id}
+
+        instructions = "\n\n".join(filter(None, [ASSISTANT_CONFIG["instructions"],
+                                                  LOCATION_INSTRUCTIONS if location else None, summary]))
+        messages = [{"role": "system", "content": instructions}]
+        messages += [{"role": "user" if m["sender"] == "user" else "assistant", "content": m["content"]} for m in history]
+        messages += [{"role": "user", "content": message} for message in user_messages]
+
+        answer_parts = []
+        prompt_tokens = completion_tokens = context_tokens = 0
+        final_status = None
+        first_token_seen = False
+        for step in range(1, MAX_MODEL_STEPS + 1):
+            step_started = time.perf_counter()
+            step_tools = {} # index -> {"id", "name", "arguments"} assembled from the deltas
+            finish_reason = None
+            stream = await openai_client.chat.completions.create(
+                model=ASSISTANT_CONFIG["model"], messages=messages, stream=True, stream_options={"include_usage": True},
+                # The last step must answer with what it has
+                tools=tools if step < MAX_MODEL_STEPS else NOT_GIVEN,
+                timeout=max(1, deadline - time.time()),
+            )
+            async with stream:
+                async for chunk in stream:
+                    if time.time() > deadline:
+                        raise asyncio.TimeoutError()
+                    if chunk.usage:
+                        prompt_tokens += chunk.usage.prompt_tokens
+                        context_tokens = max(context_tokens, chunk.usage.prompt_tokens)
+                        completion_tokens += chunk.usage.completion_tokens
+                    for choice in chunk.choices:
+                        delta = choice.delta
+                        if delta and delta.content:
+                            if not first_token_seen:
+                                first_token_seen = True
+                                record_span("time_to_first_token", time.perf_counter() - trace.started)
+                            answer_parts.append(delta.content)
+                            yield {"type": "delta", "text": delta.content}
+                        for call in (delta.tool_calls if delta else None) or []:
+                            assembled = step_tools.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+                            if call.id:
+                                assembled["id"] = call.id
+                            if call.function and call.function.name:
+                                assembled["name"] += call.function.name
+                            if call.function and call.function.arguments:
+                                assembled["arguments"] += call.function.arguments
+                        finish_reason = choice.finish_reason or finish_reason
+            record_span("model_step", time.perf_counter() - step_started)
+
+            if finish_reason != "tool_calls" or not step_tools:
+                final_status = "completed" if finish_reason in ("stop", "tool_calls") else finish_reason or "incomplete"
+                break
+            tool_calls = [SimpleNamespace(id=t["id"], function=SimpleNamespace(name=t["name"], arguments=t["arguments"]))
+                          for _, t in sorted(step_tools.items())]
+            for tool_call in tool_calls:
+                yield {"type": "tool_call", "name": tool_call.function.name}
+            tool_outputs = await run_tool_calls(tool_calls, prefetch=prefetch)
+            messages.append({"role": "assistant", "content": "".join(answer_parts) or None, "tool_calls": [
+                {"id": t.id, "type": "function", "function": {"name": t.function.name, "arguments": t.function.arguments}}
+                for t in tool_calls]})
+            messages += [{"role": "tool", "tool_call_id": o["tool_call_id"], "content": o["output"]} for o in tool_outputs]
+            answer_parts = [] # text before the tool calls isn't part of the answer
+
+        TOKENS.inc(prompt_tokens, kind="prompt")
+        TOKENS.inc(completion_tokens, kind="completion")
+        trace.attrs["tokens"] = prompt_tokens + completion_tokens
+        if context_window and prompt_tokens:
+            context_window.record_usage(current_thread_id, SimpleNamespace(
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens), context_tokens)
+
+        if final_status == "completed":
+            final_answer = "".join(answer_parts) or "Could not retrieve response from AI."
+            message_store.record(current_thread_id, "bot", final_answer)
+        else:
+            log.error("Chat turn on thread %s ended with status: %s", current_thread_id, final_status)
+            final_answer = "Sorry, the process ended unexpectedly."
+        turn_status = final_status or "unknown"
+        tool_errors = sum(1 for s in trace.spans if s["name"].startswith("tool:") and s.get("status") != "ok")
+        yield {"type": "done", "answer": final_answer, "thread_id": current_thread_id,
+               "status": turn_status, "tool_errors": tool_errors}
+
+    except asyncio.TimeoutError:
+        log.warning("Chat turn on thread %s timed out.", current_thread_id)
+        turn_status = "timeout"
+        yield {"type": "done", "answer": "Sorry, the request took too long to process.", "thread_id": current_thread_id}
+    except Exception as e:
+        log.exception("An error occurred in stream_chat_run: %s", e)
+        yield {"type": "done", "answer": "An internal server error occurred while processing your request.", "thread_id": current_thread_id}
+    finally:
+        if prefetch:
+            prefetch.discard()
+        end_trace(trace, turn_status)
+
+async def answer_from_cache(question: str, answer: str):
+    """
+    Serves a cached answer in the engine's event format, on a spare thread. The thread is
+    seeded with the exchange afterwards; the scheduler holds follow-ups until that is done.
+    The chat engine's threads are local, so it just starts a new one.
+    """
+    trace = start_trace(messages=1, cached=True)
+    with span("answer_cache"):
+        thread_id = await spare_threads.take() if spare_threads else new_chat_thread_id()
+    trace.attrs["thread_id"] = thread_id
+    message_store.record(thread_id, "user", question)
+    message_store.record(thread_id, "bot", answer)
+    end_trace(trace, "cached")
+    yield {"type": "thread", "thread_id": thread_id}
+    yield {"type": "delta", "text": answer}
+    yield {"type": "done", "answer": answer, "thread_id": thread_id, "status": "cached"}
+    if spare_threads:
+        await spare_threads.seed(thread_id, question, answer)
+
+async def answer_turn(user_input: str | list, thread_id: str | None = None, location: tuple | None = None):
+    """
+    The engine the scheduler runs. A single first message without a location (so the answer
+    doesn't depend on who asks) is looked up in the answer cache; misses and everything else
+    go through the configured run engine, and cleanly completed first answers are cached.
+    """
+    user_messages = [user_input] if isinstance(user_input, str) else list(user_input)
+    cacheable = (answer_cache is not None and (spare_threads is not None or CHAT_ENGINE == "chat")
+                 and not thread_id and location is None and len(user_messages) == 1)
+    if cacheable:
+        answer = answer_cache.get(user_messages[0])
+        if answer is not None:
+            async for event in answer_from_cache(user_messages[0], answer):
+                yield event
+            return
+
+    tools_used = set()
+    run_engine = stream_chat_run if CHAT_ENGINE == "chat" else stream_assistant_run
+    async for event in run_engine(user_messages, thread_id, location):
+        if event["type"] == "tool_call":
+            tools_used.add(event["name"])
+        elif event["type"] == "done" and cacheable and event.get("status") == "completed" and not event.get("tool_errors"):
+            answer_cache.set(user_messages[0], event["answer"], tools_used)
+        yield event
+
+async def handle_user_query_with_assistant(user_input: str, thread_id: str | None = None, location: tuple | None = None,
+                                           idempotency_key: str | None = None):
+    """
+    Handles interaction with the OpenAI assistant, including tool calls,
+    using an existing thread ID if provided, or creating a new one.
+    Goes through the per-thread scheduler, so the answer may cover other messages
+    sent to the same thread while its previous run was still active.
+    Returns a dictionary containing the answer and the thread_id used.
+    """
+    turn = scheduler.submit(thread_id, user_input, location, idempotency_key)
+    return await turn.result()
 
 
 # ////////////////////////////// FASTAPI APP AND ENDPOINTS /////////////////////////////////
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Creates the clients and shared state on startup and closes them on shutdown."""
+    global outbound, openai_client, assistant_id, gmaps, place_resolver, poi_index, tool_cache, events_index, message_store
+    global scheduler, answer_cache, spare_threads, prefetcher, admission, shared_locks, context_window, place_store
+
+    # One pooled async client per upstream, sized for its traffic. Requests are coroutines,
+    # so a single worker can keep hundreds of them in flight over a few warm connections.
+    outbound = OutboundHttp()
+    # Every conversation holds one streaming connection to OpenAI for the whole run.
+    # The SDK already retries 429/5xx itself, so the pool doesn't retry again.
+    openai_http = outbound.create("openai", max_connections=OPENAI_POOL_SIZE, max_keepalive=64, timeout=MAX_RUN_TIME, retries=0)
+    maps_http = outbound.create("maps", max_connections=MAPS_POOL_SIZE, max_keepalive=32)
+    # Kept small on purpose: the city calendar is a small site
+    events_http = outbound.create("events", max_connections=EVENTS_POOL_SIZE, max_keepalive=EVENTS_POOL_SIZE,
+                                  follow_redirects=True)
+    message_store = MessageStore(DB_PATH) # first, as it switches the database to WAL mode
+    shared_locks = SharedLocks(DB_PATH)
+    tool_cache = ToolCache(max_entries=2048, db_path=DB_PATH if TOOL_CACHE_PERSIST else None)
+    events_index = EventsIndex(DB_PATH, events_http, EVENTS_BASE_URL,
+                               window_days=EVENTS_WINDOW_DAYS, refresh_interval=EVENTS_REFRESH_INTERVAL,
+                               locks=shared_locks, page_concurrency=EVENTS_POOL_SIZE)
+    poi_index = PoiIndex(DB_PATH, origin=LIEPAJA_COORDS)
+    place_store = PlaceStore(DB_PATH)
+
+    if OPENAI_API_KEY:
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=openai_http)
+        if CHAT_ENGINE == "chat":
+            log.info("Using the Chat Completions engine with model %s", ASSISTANT_CONFIG["model"])
+        else:
+            try:
+                # Workers starting together must not each create their own assistant
+                async with shared_locks.hold(f"assistant:{ASSISTANT_KEY}", ttl=60, timeout=60):
+                    assistant_id = await AssistantRegistry(DB_PATH).ensure(openai_client, ASSISTANT_KEY, ASSISTANT_CONFIG)
+                log.info("Using OpenAI Assistant: %s", assistant_id)
+            except Exception as e:
+                log.critical("Could not create the OpenAI assistant: %s", e)
+        context_window = ContextWindow(DB_PATH, message_store, openai_client, keep_messages=CONTEXT_KEEP_MESSAGES,
+                                       max_messages=CONTEXT_MAX_MESSAGES, summary_tokens=CONTEXT_SUMMARY_TOKENS,
+                                       summary_model=CONTEXT_SUMMARY_MODEL)
+    else:
+        log.critical("OpenAI API Key is missing!")
+
+    if MAPS_API_KEY:
+        gmaps = AsyncMapsClient(key=MAPS_API_KEY, http_client=maps_http, cache=tool_cache)
+        log.info("Google Maps client initialized.")
+    else:
+        log.error("Google Maps API Key is missing!")
+    # Geocoded names are kept in the (persistent) tool cache, like every other Maps answer
+    gazetteer = Gazetteer()
+    place_resolver = PlaceResolver(gazetteer, gmaps)
+    prefetcher = Prefetcher(execute_tool_call, gazetteer, enabled=TOOL_PREFETCH)
+
+    events_refresher = asyncio.create_task(events_index.run_forever())
+    poi_refresher = None
+    if gmaps and POI_REFRESH_INTERVAL > 0:
+        anchors = [(m.lat, m.lng, m.radius) for m in map(gazetteer.match, POI_REFRESH_AREAS)]
+        poi_refresher = asyncio.create_task(poi_index.run_forever(gmaps, anchors, POI_REFRESH_INTERVAL, locks=shared_locks))
+    if ANSWER_CACHE_SIZE > 0:
+        answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY, DB_PATH)
+    if openai_client and assistant_id:
+        spare_threads = SpareThreads(openai_client, SPARE_THREADS)
+        spare_threads.refill()
+    message_store.start()
+    scheduler = ThreadScheduler(answer_turn, locks=shared_locks if SHARED_STATE else None, lock_ttl=MAX_RUN_TIME + 30)
+    admission = AdmissionController(ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT,
+                                    client_rate=CLIENT_RATE_PER_MINUTE / 60, thread_rate=THREAD_RATE_PER_MINUTE / 60,
+                                    peer_rate=PEER_RATE_PER_MINUTE / 60)
+    # Component counters are exported on /metrics as gauges next to the latency histograms
+    REGISTRY.collectors.clear()
+    REGISTRY.register_stats("chatbot_tool_cache", tool_cache.snapshot)
+    REGISTRY.register_stats("chatbot_scheduler", scheduler.snapshot)
+    REGISTRY.register_stats("chatbot_admission", admission.snapshot)
+    REGISTRY.register_stats("chatbot_poi_index", poi_index.snapshot)
+    REGISTRY.register_stats("chatbot_events_index", events_index.snapshot)
+    REGISTRY.register_stats("chatbot_place_store", place_store.snapshot)
+    REGISTRY.register_stats("chatbot_place_resolver", lambda: place_resolver.stats)
+    REGISTRY.register_stats("chatbot_message_store", lambda: message_store.stats)
+    REGISTRY.register_stats("chatbot_prefetch", lambda: prefetcher.stats)
+    REGISTRY.register_stats("chatbot_shared_locks", lambda: shared_locks.stats)
+    if answer_cache:
+        REGISTRY.register_stats("chatbot_answer_cache", answer_cache.snapshot)
+    if context_window:
+        REGISTRY.register_stats("chatbot_context", context_window.snapshot)
+    if spare_threads:
+        REGISTRY.register_stats("chatbot_spare_threads", lambda: {**spare_threads.stats, "ready": len(spare_threads.spare)})
+    REGISTRY.register_stats("chatbot_http_pool", outbound.pool_stats, label="pool")
+    yield
+    events_refresher.cancel()
+    if poi_refresher:
+        poi_refresher.cancel()
+    await message_store.stop() # writes out anything still buffered
+    await tool_cache.flush()
+    await place_store.flush()
+    # Close pooled connections on shutdown
+    await outbound.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Request Body Model
 class ChatRequest(BaseModel):
     message: str
     thread_id: str | None = None
+    # Sent by the app for "near me" questions when location permission is granted
+    latitude: float | None = Field(default=None, ge=-90, le=90)
+    longitude: float | None = Field(default=None, ge=-180, le=180)
+
+    @property
+    def location(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return (self.latitude, self.longitude)
+
+# --- Admission ---
+async def admit(http_request: Request, client_id: str | None, thread_id: str | None):
+    """
+    Waits for a turn slot. Clients are told to back off right away (429/503 with
+    Retry-After) when they are over their rate or the queue is full or too slow.
+    """
+    peer = peer_address(http_request.client.host if http_request.client else None,
+                        http_request.headers.get("x-forwarded-for"), TRUSTED_PROXIES)
+    try:
+        return await admission.acquire(peer, client_id, thread_id)
+    except Rejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
 
 # --- Send Message Endpoint ---
 @app.post("/send-message/")
-async def process_message_and_respond(request: ChatRequest):
+async def process_message_and_respond(request: ChatRequest, http_request: Request,
+                                      idempotency_key: str | None = Header(default=None),
+                                      x_client_id: str | None = Header(default=None)):
     user_message = request.message
     received_thread_id = request.thread_id
+    ticket = await admit(http_request, x_client_id, received_thread_id)
 
     try:
-        result = await asyncio.to_thread(handle_user_query_with_assistant, user_message, received_thread_id) # Run synchronous OpenAI calls in a threadpool
-        # result = handle_user_query_with_assistant(user_message, received_thread_id) # If using OpenAI async client v1.0+
+        result = await handle_user_query_with_assistant(user_message, received_thread_id, request.location, idempotency_key)
 
         assistant_response = result.get("answer", "Error: No answer found.")
         current_thread_id = result.get("thread_id")
@@ -548,17 +1227,109 @@ async def process_message_and_respond(request: ChatRequest):
             "message_received": user_message
         }
     except Exception as e:
-         print(f"Error in FastAPI endpoint /send-message/: {e}")
+         log.exception("Error in FastAPI endpoint /send-message/: %s", e)
          # Return a generic error response
          raise HTTPException(status_code=500, detail="Internal Server Error processing message")
+    finally:
+        ticket.release()
+
+
+# --- Streaming Send Message Endpoint ---
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    Gives the admission slot back however the response ends. A client that disconnects
+    before the body is sent never starts the generator, so its finally can't be relied on.
+    """
+
+    def __init__(self, ticket, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
+
+def format_sse(event: dict) -> str:
+    """Formats one run engine event as a Server-Sent Events frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.post("/send-message-stream/")
+async def process_message_and_stream(request: ChatRequest, http_request: Request,
+                                     idempotency_key: str | None = Header(default=None),
+                                     x_client_id: str | None = Header(default=None)):
+    """
+    Same contract as /send-message/, but the reply is sent as Server-Sent Events
+    while the run is still going: 'thread', 'tool_call' and 'delta' events, then a final 'done'.
+    """
+    user_message = request.message
+    # Admitted before the stream starts, so a shed request still gets a plain 429/503
+    ticket = await admit(http_request, x_client_id, request.thread_id)
+    try:
+        # Submitted right away, so the message keeps its place in the thread's queue
+        turn = scheduler.submit(request.thread_id, user_message, request.location, idempotency_key)
+    except BaseException:
+        ticket.release()
+        raise
+
+    async def event_stream():
+        # One SSE frame per engine event, written as soon as it is produced
+        async for event in turn.stream():
+            if event["type"] == "done":
+                event = {**event, "message_received": user_message}
+            yield format_sse(event)
+
+    return AdmittedStreamingResponse(
+        ticket, event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # --- Conversation History Endpoint ---
 @app.get("/conversation-history/")
-async def conversation_history(thread_id: str):
-     # ... (Implement if needed using SQLite) ...
-     return {"detail": "Not implemented yet"}
+async def conversation_history(thread_id: str, limit: int = 50, cursor: str | None = None):
+    """
+    Returns stored messages of a thread from the local database (no OpenAI calls).
+    Newest page first; pass next_cursor back as 'cursor' to load older messages.
+    """
+    if not message_store.is_known_thread(thread_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+    limit = max(1, min(limit, 200))
+    try:
+        messages, next_cursor = await message_store.history(thread_id, limit=limit, before=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"thread_id": thread_id, "conversation_history": messages, "next_cursor": next_cursor}
+
+
+
+# --- Cache Statistics Endpoint ---
+@app.get("/cache-stats/")
+async def cache_stats():
+    return {"tool_cache": tool_cache.snapshot(), "place_resolver": place_resolver.stats, "poi_index": poi_index.snapshot(),
+            "answer_cache": answer_cache.snapshot() if answer_cache else None, "prefetch": prefetcher.stats,
+            "events_index": events_index.snapshot(), "place_store": place_store.snapshot(),
+            "context_window": context_window.snapshot() if context_window else None}
+
+
+# --- Prometheus Metrics Endpoint ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# --- Thread Scheduler Statistics Endpoint ---
+@app.get("/scheduler-stats/")
+async def scheduler_stats():
+    return {"scheduler": scheduler.snapshot(), "admission": admission.snapshot(), "shared_locks": shared_locks.stats,
+            "pid": os.getpid()}
+
 
+# --- Outbound Connection Pool Statistics Endpoint ---
+@app.get("/pool-stats/")
+async def pool_stats():
+    return {"pools": outbound.pool_stats()}
 
 
 # --- Simple root endpoint for testing ---
@@ -0,0 +1,112 @@
+# maps_client.py
+
+# Small async client for the Google Maps web services used by the tools.
+# Method names and return values follow googlemaps.Client, so the tool
+# functions read the same as before, just with 'await' in front.
+
+import os
+import time
+
+import httpx
+
+from telemetry import UPSTREAM_REQUESTS, UPSTREAM_SECONDS, annotate
+from tool_cache import ToolCache, make_cache_key
+
+MAPS_BASE_URL = os.getenv("MAPS_BASE_URL", "https://maps.googleapis.com")
+
+# How long each kind of answer stays valid (seconds). Place details change rarely,
+# search results a bit more often, routes and travel times most often.
+MAPS_CACHE_TTLS = {
+    "geocode": 30 * 24 * 3600,
+    "place_details": 7 * 24 * 3600,
+    "text_search": 24 * 3600,
+    "directions": 3600,
+    "distance_matrix": 3600,
+}
+
+# Only these statuses are real answers; errors and quota problems are never cached
+CACHEABLE_STATUSES = ("OK", "ZERO_RESULTS")
+
+
+class MapsApiError(Exception):
+    """Raised when a Maps endpoint answers with an error status."""
+
+
+class AsyncMapsClient:
+    def __init__(self, key: str, http_client: httpx.AsyncClient, base_url: str = MAPS_BASE_URL,
+                 cache: ToolCache | None = None, cache_ttls: dict = MAPS_CACHE_TTLS):
+        self.key = key
+        self.http_client = http_client
+        self.base_url = base_url.rstrip("/")
+        self.cache = cache
+        self.cache_ttls = cache_ttls
+
+    async def _fetch(self, kind: str, path: str, params: dict):
+        started = time.perf_counter()
+        try:
+            response = await self.http_client.get(f"{self.base_url}{path}", params={**params, "key": self.key})
+            response.raise_for_status()
+            body = response.json()
+        except httpx.HTTPStatusError as e:
+            UPSTREAM_REQUESTS.inc(upstream="maps", endpoint=kind, status=f"http_{e.response.status_code}")
+            raise
+        except httpx.HTTPError as e:
+            UPSTREAM_REQUESTS.inc(upstream="maps", endpoint=kind, status=type(e).__name__)
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream="maps", endpoint=kind)
+        UPSTREAM_REQUESTS.inc(upstream="maps", endpoint=kind, status=body.get("status", "unknown"))
+        return body
+
+    async def _request(self, kind: str, path: str, params: dict):
+        """GETs a Maps endpoint, going through the cache when one is configured."""
+        params = {k: v for k, v in params.items() if v is not None}
+        if not self.cache:
+            body = await self._fetch(kind, path, params)
+        else:
+            body = await self.cache.get_or_compute(
+                make_cache_key(kind, params), self.cache_ttls[kind], lambda: self._fetch(kind, path, params),
+                should_cache=lambda body: body.get("status") in CACHEABLE_STATUSES,
+            )
+        # Recorded on the calling tool's span (cached answers included)
+        annotate(**{f"maps_{kind}": body.get("status")})
+        return body
+
+    async def places(self, query: str, language: str = None, location=None, radius: int = None):
+        """Text Search. Returns the raw response dict (status, results)."""
+        if location is not None:
+            location = f"{location[0]},{location[1]}"
+        return await self._request("text_search", "/maps/api/place/textsearch/json", {
+            "query": query, "language": language, "location": location, "radius": radius,
+        })
+
+    async def geocode(self, address: str, bounds=None, region: str = None, language: str = None):
+        """Geocoding. bounds is ((south, west), (north, east)) and only biases the result. Returns the raw response dict."""
+        if bounds is not None:
+            (south, west), (north, east) = bounds
+            bounds = f"{south},{west}|{north},{east}"
+        return await self._request("geocode", "/maps/api/geocode/json", {
+            "address": address, "bounds": bounds, "region": region, "language": language,
+        })
+
+    async def place(self, place_id: str, fields: list = None, language: str = None):
+        """Place Details. Returns the raw response dict (status, result)."""
+        return await self._request("place_details", "/maps/api/place/details/json", {
+            "place_id": place_id, "fields": ",".join(fields) if fields else None, "language": language,
+        })
+
+    async def directions(self, origin: str, destination: str, mode: str = None, language: str = None):
+        """Directions. Returns the list of routes, empty when nothing was found."""
+        body = await self._request("directions", "/maps/api/directions/json", {
+            "origin": origin, "destination": destination, "mode": mode, "language": language,
+        })
+        if body.get("status") not in ("OK", "ZERO_RESULTS"):
+            raise MapsApiError(f"Directions API error: {body.get('status')} {body.get('error_message', '')}".strip())
+        return body.get("routes", [])
+
+    async def distance_matrix(self, origins: list, destinations: list, mode: str = None, language: str = None):
+        """Distance Matrix. Returns the raw response dict (status, rows)."""
+        return await self._request("distance_matrix", "/maps/api/distancematrix/json", {
+            "origins": "|".join(origins), "destinations": "|".join(destinations),
+            "mode": mode, "language": language,
+        })
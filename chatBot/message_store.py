@@ -0,0 +1,187 @@
+# message_store.py
+
+# Local store for conversation threads and messages (the 'threads' and 'messages'
+# tables of assistant_threads.db).
+#  - Write-behind: record() only appends to a buffer; a background task writes the
+#    buffer in batches, one transaction per batch, so the request path never waits on disk.
+#  - Known-thread cache: threads we created or already saw are remembered, so a
+#    follow-up turn doesn't need an OpenAI round trip just to check the thread exists.
+#  - History reads are served from SQLite with cursor pagination.
+#  - count() and messages_range() give context management (context_window.py) a
+#    thread's length and its older messages by position.
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.2 # seconds between background flushes
+FLUSH_BATCH_SIZE = 200 # flush early once this many messages are waiting
+
+
+def utc_timestamp() -> str:
+    # Same layout as SQLite's CURRENT_TIMESTAMP, plus milliseconds, so values sort as text
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def encode_cursor(timestamp: str, rowid: int) -> str:
+    return f"{timestamp}|{rowid}"
+
+
+def decode_cursor(cursor: str):
+    timestamp, _, rowid = cursor.rpartition("|")
+    if not timestamp or not rowid.isdigit():
+        raise ValueError("Invalid cursor")
+    return timestamp, int(rowid)
+
+
+class MessageStore:
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db_lock = threading.Lock() # the connection is used from the flush worker thread
+        self.db.execute("PRAGMA journal_mode=WAL") # readers don't block the batch writer
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                thread_id TEXT,
+                sender TEXT,
+                content TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (thread_id) REFERENCES threads(thread_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_thread_timestamp ON messages (thread_id, timestamp);
+        """)
+        self.db.commit()
+        self.known_threads = set()
+        self.pending_threads = []
+        self.pending_messages = []
+        self.writing = [] # the batch being written right now (one at a time, see flush_lock)
+        self.flush_lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        self.flusher = None
+        self.stats = {"messages_written": 0, "batches": 0}
+
+    # --- Known-thread cache ---
+    def is_known_thread(self, thread_id: str) -> bool:
+        if thread_id in self.known_threads:
+            return True
+        with self.db_lock:
+            row = self.db.execute("SELECT 1 FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row:
+            self.known_threads.add(thread_id)
+        return bool(row)
+
+    def remember_thread(self, thread_id: str):
+        if thread_id not in self.known_threads:
+            self.known_threads.add(thread_id)
+            self.pending_threads.append(thread_id)
+
+    # --- Write-behind ---
+    def record(self, thread_id: str, sender: str, content: str):
+        """Queues a message for writing. Never blocks on the database."""
+        self.remember_thread(thread_id)
+        self.pending_messages.append((thread_id, sender, content, utc_timestamp()))
+        if len(self.pending_messages) >= FLUSH_BATCH_SIZE:
+            self.wake.set()
+
+    def _write_batch(self, threads: list, messages: list):
+        with self.db_lock:
+            with self.db:
+                self.db.executemany("INSERT OR IGNORE INTO threads (thread_id) VALUES (?)", [(t,) for t in threads])
+                self.db.executemany(
+                    "INSERT INTO messages (thread_id, sender, content, timestamp) VALUES (?, ?, ?, ?)", messages)
+            # Under the lock count() reads with: a message is in the table or in writing, never both
+            self.writing = []
+
+    async def flush(self):
+        """
+        Writes everything buffered so far in one transaction. Flushes run one at a time:
+        a reader flushing while the flusher writes waits for that batch, then writes the rest.
+        """
+        async with self.flush_lock:
+            if not self.pending_threads and not self.pending_messages:
+                return
+            threads, self.pending_threads = self.pending_threads, []
+            messages, self.pending_messages = self.pending_messages, []
+            self.writing = messages
+            try:
+                await asyncio.to_thread(self._write_batch, threads, messages)
+                self.stats["messages_written"] += len(messages)
+                self.stats["batches"] += 1
+            except Exception as e:
+                log.error("Message store: batch write failed, will retry: %s", e)
+                self.pending_threads = threads + self.pending_threads
+                self.pending_messages = messages + self.pending_messages
+                self.writing = []
+
+    async def run_flusher(self):
+        """Background task: flush every FLUSH_INTERVAL, or sooner when the buffer fills up."""
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    def start(self):
+        self.flusher = asyncio.create_task(self.run_flusher())
+
+    async def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
+        await self.flush()
+
+    # --- Reads ---
+    async def history(self, thread_id: str, limit: int = 50, before: str | None = None):
+        """
+        Returns (messages, next_cursor): the newest `limit` messages older than the
+        `before` cursor, in chronological order. next_cursor pages further back.
+        """
+        await self.flush() # include anything still buffered
+        params = [thread_id]
+        where = "thread_id = ?"
+        if before:
+            timestamp, rowid = decode_cursor(before)
+            where += " AND (timestamp, rowid) < (?, ?)"
+            params += [timestamp, rowid]
+
+        def read():
+            with self.db_lock:
+                return self.db.execute(
+                    f"SELECT rowid, sender, content, timestamp FROM messages WHERE {where} "
+                    "ORDER BY timestamp DESC, rowid DESC LIMIT ?", params + [limit + 1]).fetchall()
+
+        rows = await asyncio.to_thread(read)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0]) if has_more else None
+        messages = [{"sender": r[1], "content": r[2], "timestamp": r[3]} for r in reversed(rows)]
+        return messages, next_cursor
+
+    def count(self, thread_id: str) -> int:
+        """Messages of a thread, buffered ones included. One indexed count, no flush."""
+        with self.db_lock:
+            stored = self.db.execute("SELECT COUNT(*) FROM messages WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+            writing = self.writing
+        unwritten = sum(1 for m in self.pending_messages + writing if m[0] == thread_id)
+        return stored + unwritten
+
+    async def messages_range(self, thread_id: str, start: int, stop: int) -> list:
+        """Messages start..stop-1 of a thread, counted from its first message, in chronological order."""
+        await self.flush()
+
+        def read():
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT sender, content, timestamp FROM messages WHERE thread_id = ? "
+                    "ORDER BY timestamp, rowid LIMIT ? OFFSET ?", (thread_id, max(0, stop - start), start)).fetchall()
+
+        rows = await asyncio.to_thread(read)
+        return [{"sender": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
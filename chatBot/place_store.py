@@ -0,0 +1,330 @@
+# place_store.py
+
+# Structured place details (table 'place_details'), keyed by Google place_id, so a place
+# looked up once is answered locally afterwards: no text search, no details call.
+#  - Opening hours are kept as intervals of minutes in the week (Sunday 00:00 = 0, like
+#    Google's day numbering), so "is it open now / on Sunday at 21:00" is a lookup in a
+#    short sorted list instead of reading weekday_text strings.
+#  - A name -> place_id index (table 'place_aliases') is filled from every search result
+#    and details lookup, so the model can refer to places by the names it was shown.
+#    A name shared by several places (a chain's branches: "Rimi") is ambiguous and
+#    resolves to nothing, so the caller searches instead of guessing a branch.
+#  - Details older than max_age are fetched again; the index never expires.
+#  - Both tables are written behind, in batches on a worker thread, so a write lock held by
+#    another worker process never stalls the event loop; lookups see unwritten rows too.
+
+import asyncio
+import bisect
+import json
+import logging
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from events_index import city_now
+from gazetteer import normalize_place_name
+
+log = logging.getLogger(__name__)
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+DETAILS_MAX_AGE = 3 * 24 * 3600 # opening hours and phone numbers change rarely
+DAY_NAMES = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"] # Google's numbering
+DAY_WORDS = {"sun": 0, "svet": 0, "mon": 1, "pirm": 1, "tue": 2, "otr": 2, "wed": 3, "tres": 3, "thu": 4, "cet": 4,
+             "fri": 5, "piekt": 5, "sat": 6, "sest": 6} # English and Latvian (folded) prefixes
+DAY_QUALIFIERS = {"next", "this", "on", "coming", "nakamaja", "nakamo", "saja", "so"} # "next Monday", "nākamajā pirmdienā"
+TIME_PATTERN = re.compile(r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?")
+CLOCK_WORDS = {"noon": (12, 0), "midday": (12, 0), "midnight": (0, 0)}
+
+
+def week_minute(day: int, hhmm: str) -> int:
+    """(2, '2130') -> minute of the week for Tuesday 21:30."""
+    return day * DAY_MINUTES + int(hhmm[:2]) * 60 + int(hhmm[2:4])
+
+
+def hours_intervals(opening_hours: dict | None) -> list | None:
+    """Google 'opening_hours.periods' -> sorted, merged [start, end) week-minute intervals (None = not listed)."""
+    periods = (opening_hours or {}).get("periods")
+    if not periods:
+        return None
+    intervals = []
+    for period in periods:
+        start = week_minute(period["open"]["day"], period["open"].get("time", "0000"))
+        close = period.get("close")
+        if not close: # a single open period without a close means open around the clock
+            return [[0, WEEK_MINUTES]]
+        end = week_minute(close["day"], close.get("time", "0000"))
+        if end <= start: # open past Saturday midnight
+            intervals += [[start, WEEK_MINUTES], [0, end]]
+        else:
+            intervals.append([start, end])
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def minute_of_week(moment: datetime) -> int:
+    return ((moment.weekday() + 1) % 7) * DAY_MINUTES + moment.hour * 60 + moment.minute
+
+
+def open_state(intervals: list, minute: int):
+    """(is_open, minute of the week it next opens or closes; None when it never changes)."""
+    starts = [start for start, _ in intervals]
+    index = bisect.bisect_right(starts, minute) - 1
+    if index >= 0 and minute < intervals[index][1]:
+        end = intervals[index][1]
+        if end == WEEK_MINUTES: # may carry on into Sunday morning
+            end = intervals[0][1] if intervals[0][0] == 0 else 0
+            if end == WEEK_MINUTES:
+                return True, None
+        return True, end
+    following = intervals[index + 1] if index + 1 < len(intervals) else intervals[0]
+    return False, following[0]
+
+
+def describe_minute(minute: int, reference: int) -> str:
+    """'21:00' on the reference minute's day, else 'Monday 09:00'."""
+    minute %= WEEK_MINUTES
+    clock = f"{minute % DAY_MINUTES // 60:02d}:{minute % 60:02d}"
+    if minute // DAY_MINUTES == reference // DAY_MINUTES and minute >= reference:
+        return clock
+    return f"{DAY_NAMES[minute // DAY_MINUTES]} {clock}"
+
+
+def parse_day(day_text: str | None, today: int) -> int:
+    """'tomorrow', 'next Monday', 'svētdien' -> days from today; ValueError when it isn't a day."""
+    if not day_text or not day_text.strip():
+        return 0
+    words = normalize_place_name(day_text).split()
+    qualifiers = set()
+    while words and words[0] in DAY_QUALIFIERS:
+        qualifiers.add(words.pop(0))
+    if words in (["today"], ["now"], ["sodien"]):
+        return 0
+    if words in (["tomorrow"], ["rit"]):
+        return 1
+    if len(words) == 1:
+        for prefix, number in DAY_WORDS.items():
+            if words[0].startswith(prefix):
+                offset = (number - today) % 7
+                # "next Sunday" asked on a Sunday is a week away, not now
+                return 7 if offset == 0 and qualifiers & {"next", "nakamaja", "nakamo"} else offset
+    raise ValueError(f"couldn't understand the day '{day_text}'")
+
+
+def parse_clock(time_text: str) -> tuple:
+    """'21:00', '9pm', '9.30 am', 'noon' -> (hour, minute); ValueError when it isn't a time of day."""
+    text = time_text.strip().lower()
+    if text in CLOCK_WORDS:
+        return CLOCK_WORDS[text]
+    match = TIME_PATTERN.fullmatch(text)
+    if match:
+        hour, minute, half = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+        if half and 1 <= hour <= 12 and minute < 60:
+            return hour % 12 + (12 if half == "pm" else 0), minute
+        if not half and hour < 24 and minute < 60:
+            return hour, minute
+    raise ValueError(f"couldn't understand the time '{time_text}'")
+
+
+def parse_moment(time_text: str | None = None, day_text: str | None = None) -> tuple:
+    """
+    ('21:00', 'tomorrow') -> (minute of the week, label) in the city's time; no time (or
+    'now') means the current time of day. Raises ValueError for a day or time it can't read,
+    rather than quietly answering about another moment.
+    """
+    now = city_now()
+    moment = now + timedelta(days=parse_day(day_text, (now.weekday() + 1) % 7))
+    if time_text and time_text.strip().lower() != "now":
+        hour, minute = parse_clock(time_text)
+        moment = moment.replace(hour=hour, minute=minute)
+    elif moment.date() == now.date():
+        return minute_of_week(moment), f"now, {DAY_NAMES[(moment.weekday() + 1) % 7]} {moment.hour:02d}:{moment.minute:02d}"
+    return minute_of_week(moment), f"{DAY_NAMES[(moment.weekday() + 1) % 7]} {moment.hour:02d}:{moment.minute:02d}"
+
+
+@dataclass
+class PlaceDetails:
+    place_id: str
+    name: str
+    address: str = None
+    phone: str = None
+    website: str = None
+    rating: float = None
+    ratings_total: int = None
+    hours: list = None # [start, end) week-minute intervals, None when Google lists no hours
+    weekday_text: list = field(default_factory=list)
+    fetched_at: float = 0.0
+
+    def open_at(self, minute: int):
+        """open_state() at a minute of the week; None when the opening hours aren't known."""
+        return open_state(self.hours, minute) if self.hours else None
+
+    def describe_open(self, minute: int) -> str | None:
+        """'Yes (closes 21:00)', 'No (opens Monday 09:00)'; None when the opening hours aren't known."""
+        state = self.open_at(minute)
+        if state is None:
+            return None
+        is_open, change = state
+        if change is None:
+            return "Yes (open 24 hours)"
+        return f"Yes (closes {describe_minute(change, minute)})" if is_open else f"No (opens {describe_minute(change, minute)})"
+
+
+class PlaceStore:
+    def __init__(self, db_path: str, max_age: float = DETAILS_MAX_AGE):
+        self.max_age = max_age
+        self.places = {} # place_id -> PlaceDetails (read through from the table)
+        self.stats = {"local_hits": 0, "stored": 0, "stale": 0, "names_indexed": 0, "ambiguous_names": 0}
+        self.pending_details = {} # place_id -> place_details row, not yet written
+        self.pending_names = {} # name_key -> {place_id, ...}, not yet written
+        self.writer = None # the write-behind task, while it runs
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS place_details (
+                place_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                address TEXT,
+                phone TEXT,
+                website TEXT,
+                rating REAL,
+                ratings_total INTEGER,
+                hours TEXT, -- JSON [[start, end], ...] minutes of the week, Sunday 00:00 = 0
+                weekday_text TEXT, -- JSON list, as Google formats it
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS place_aliases (
+                name_key TEXT NOT NULL,
+                place_id TEXT NOT NULL,
+                PRIMARY KEY (name_key, place_id)
+            );
+            -- One place per name, whichever was written last; refilled as place_aliases
+            DROP TABLE IF EXISTS place_names;
+        """)
+        self.db.commit()
+        # Only ever used by the write-behind task, on a worker thread
+        self.write_db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self.write_db.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def name_keys(name: str, address: str | None = None) -> list:
+        """Index keys for a name, most specific first: 'name|address', then 'name'."""
+        key = normalize_place_name(name or "")
+        if not key:
+            return []
+        return ([f"{key}|{normalize_place_name(address)}"] if address else []) + [key]
+
+    # --- Name index ---
+    def remember_names(self, places):
+        """Indexes (place_id, name, address) tuples, e.g. from search results."""
+        indexed = 0
+        for place_id, name, address in places:
+            if place_id and name:
+                for key in self.name_keys(name, address):
+                    self.pending_names.setdefault(key, set()).add(place_id)
+                    indexed += 1
+        if indexed:
+            self.stats["names_indexed"] += indexed
+            self._schedule_write()
+
+    def place_ids_for_key(self, key: str) -> set:
+        rows = self.db.execute("SELECT place_id FROM place_aliases WHERE name_key = ?", (key,)).fetchall()
+        return {place_id for place_id, in rows} | self.pending_names.get(key, set())
+
+    def place_id_for(self, name: str, address: str | None = None) -> str | None:
+        """The one place known by this name, or None (unknown, or several places share it)."""
+        for key in self.name_keys(name, address):
+            place_ids = self.place_ids_for_key(key)
+            if len(place_ids) == 1:
+                return next(iter(place_ids))
+            if place_ids: # a less specific key can only be more ambiguous
+                self.stats["ambiguous_names"] += 1
+                return None
+        return None
+
+    # --- Details ---
+    def get(self, place_id: str) -> PlaceDetails | None:
+        """Fresh stored details of a place, or None (never stored, or older than max_age)."""
+        place = self.places.get(place_id)
+        if place is None or time.time() - place.fetched_at > self.max_age:
+            # Not seen yet, or possibly refreshed by another worker process
+            row = self.db.execute(
+                "SELECT place_id, name, address, phone, website, rating, ratings_total, hours, weekday_text, fetched_at "
+                "FROM place_details WHERE place_id = ?", (place_id,)).fetchone()
+            if not row:
+                return None
+            place = PlaceDetails(*row[:7], hours=json.loads(row[7]) if row[7] else None,
+                                 weekday_text=json.loads(row[8] or "[]"), fetched_at=row[9])
+            self.places[place_id] = place
+        if time.time() - place.fetched_at > self.max_age:
+            self.stats["stale"] += 1
+            return None
+        self.stats["local_hits"] += 1
+        return place
+
+    def lookup(self, name: str, address: str | None = None) -> PlaceDetails | None:
+        place_id = self.place_id_for(name, address)
+        return self.get(place_id) if place_id else None
+
+    def store(self, place_id: str, result: dict, asked_as: tuple = ()) -> PlaceDetails:
+        """
+        Keeps a Place Details 'result' and indexes its name (plus the (name, address) it was
+        asked for as, when that differs) under its place_id.
+        """
+        opening_hours = result.get("opening_hours") or {}
+        place = PlaceDetails(place_id, result.get("name") or (asked_as[0] if asked_as else "N/A"), result.get("formatted_address"),
+                             result.get("international_phone_number"), result.get("website"), result.get("rating"),
+                             result.get("user_ratings_total"), hours_intervals(opening_hours),
+                             opening_hours.get("weekday_text") or [], time.time())
+        self.pending_details[place_id] = (
+            place.place_id, place.name, place.address, place.phone, place.website, place.rating, place.ratings_total,
+            json.dumps(place.hours) if place.hours else None, json.dumps(place.weekday_text, ensure_ascii=False),
+            place.fetched_at)
+        self.places[place_id] = place
+        self.stats["stored"] += 1
+        self._schedule_write()
+        self.remember_names([(place_id, place.name, place.address)] + ([(place_id, *asked_as)] if asked_as else []))
+        return place
+
+    # --- Write-behind ---
+    def _schedule_write(self):
+        if not self.writer or self.writer.done():
+            self.writer = asyncio.create_task(self._write_behind())
+
+    async def _write_behind(self):
+        while self.pending_details or self.pending_names:
+            details, self.pending_details = list(self.pending_details.values()), {}
+            # Still visible to place_id_for until they are in the table
+            names = [(key, place_id) for key, place_ids in self.pending_names.items() for place_id in place_ids]
+            try:
+                await asyncio.to_thread(self._write_rows, details, names)
+            except sqlite3.Error as e:
+                log.warning("Place store: could not persist %d places, %d names: %s", len(details), len(names), e)
+            for key, place_id in names:
+                place_ids = self.pending_names.get(key)
+                if place_ids is not None:
+                    place_ids.discard(place_id)
+                    if not place_ids:
+                        del self.pending_names[key]
+
+    def _write_rows(self, details: list, names: list):
+        with self.write_db:
+            self.write_db.executemany(
+                "INSERT OR REPLACE INTO place_details (place_id, name, address, phone, website, rating, ratings_total, "
+                "hours, weekday_text, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", details)
+            self.write_db.executemany("INSERT OR IGNORE INTO place_aliases (name_key, place_id) VALUES (?, ?)", names)
+
+    async def flush(self):
+        """Waits until everything stored is in the tables (on shutdown)."""
+        if self.writer:
+            await self.writer
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "cached_places": len(self.places)}
@@ -0,0 +1,234 @@
+# poi_index.py
+
+# Local snapshot of points of interest in Liepāja for "near me" / "near X" questions.
+# Every Places text search result the tools see is kept (table 'pois'), and a background
+# job refreshes the common categories around the city's neighbourhoods. In memory the
+# POIs sit in a uniform lat/lng grid, so nearest-N and radius queries only look at the
+# cells around the point instead of scanning the whole city. With several worker
+# processes, each one picks up the others' new rows from the shared table (sync()).
+
+import asyncio
+import json
+import logging
+import math
+import sqlite3
+import time
+from dataclasses import dataclass, field
+
+from events_index import fold
+
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000
+GRID_CELL_M = 500 # edge of one grid cell (metres)
+POI_MAX_AGE = 30 * 24 * 3600 # POIs not seen in a search for this long are dropped
+SYNC_INTERVAL = 30 # seconds between reads of rows other workers added
+
+# Canonical category -> (Google place types, word stems that ask for it)
+POI_CATEGORIES = {
+    "cafe": (["cafe"], ["cafe", "kafejnic", "coffee", "kafij"]),
+    "restaurant": (["restaurant"], ["restaurant", "restoran", "eatery", "dinner", "lunch", "food"]),
+    "bar": (["bar", "night_club"], ["bar", "pub", "krog", "club", "klub"]),
+    "bakery": (["bakery"], ["baker", "maiznic", "konditor", "pastry"]),
+    "supermarket": (["supermarket", "grocery_or_supermarket"], ["supermarket", "grocer", "veikal", "lielveikal"]),
+    "pharmacy": (["pharmacy"], ["pharmac", "aptiek", "chemist", "drugstore"]),
+    "atm": (["atm"], ["atm", "bankomat", "cash machine"]),
+    "hotel": (["lodging"], ["hotel", "hostel", "viesnic", "guest house", "accommodation", "lodging"]),
+    "museum": (["museum"], ["museum", "muzej"]),
+    "park": (["park"], ["park", "parks"]),
+    "gas_station": (["gas_station"], ["gas station", "petrol", "fuel", "degviel"]),
+    "parking": (["parking"], ["parking", "stavviet", "autostavviet"]),
+}
+
+# Words that don't narrow a category down ("a good coffee place nearby" is still just cafe)
+FILLER_WORDS = {"a", "an", "the", "some", "any", "good", "nice", "nearby", "near", "closest", "nearest",
+                "place", "places", "shop", "shops", "spot", "spots", "to", "eat", "get", "buy", "for", "me"}
+
+
+def stem_matches(word: str, stem: str) -> bool:
+    # Short stems only match whole words or plurals, so "bar" doesn't match "barber"
+    if len(stem) < 5:
+        return word in (stem, stem + "s", stem + "es")
+    return word.startswith(stem)
+
+
+def category_for(place_type: str) -> str | None:
+    """
+    Maps a free-text place type to a POI_CATEGORIES key, but only when nothing else in the text
+    narrows it down: "coffee shop" -> cafe, while "vegan cafe" -> None (only Maps can judge "vegan").
+    """
+    text = " ".join(fold(place_type).replace("'", "").split())
+    for category, (_, stems) in POI_CATEGORIES.items():
+        rest, matched = f" {text} ", False
+        for stem in (s for s in stems if " " in s):
+            if f" {stem} " in rest:
+                rest, matched = rest.replace(f" {stem} ", " "), True
+        words = rest.split()
+        single = [s for s in stems if " " not in s]
+        matched_words = [w for w in words if any(stem_matches(w, stem) for stem in single)]
+        if not (matched or matched_words):
+            continue
+        leftover = [w for w in words if w not in matched_words and w not in FILLER_WORDS]
+        return None if leftover else category
+    return None
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle (haversine) distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+@dataclass
+class Poi:
+    place_id: str
+    name: str
+    lat: float
+    lng: float
+    address: str = None
+    rating: float = None
+    categories: set = field(default_factory=set)
+    seen_at: float = 0.0
+
+
+class PoiIndex:
+    def __init__(self, db_path: str, origin=(56.5107, 21.0106)):
+        # Cell sizes in degrees, fixed at the city's latitude (the city is small enough)
+        self.cell_lat = GRID_CELL_M / 111320
+        self.cell_lng = GRID_CELL_M / (111320 * math.cos(math.radians(origin[0])))
+        self.grid = {} # (row, col) -> {place_id: Poi}
+        self.pois = {} # place_id -> Poi
+        self.stats = {"local_answers": 0, "fallbacks": 0, "ingested": 0, "synced": 0}
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pois (
+                place_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                address TEXT,
+                rating REAL,
+                categories TEXT NOT NULL,
+                seen_at REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_pois_seen_at ON pois (seen_at)")
+        self.db.execute("DELETE FROM pois WHERE seen_at < ?", (time.time() - POI_MAX_AGE,))
+        self.db.commit()
+        self.synced_at = 0.0 # newest seen_at loaded from the table
+        self.last_sync = 0.0
+        self.sync()
+
+    def sync(self):
+        """Loads rows written since the last sync (by this or another worker process)."""
+        rows = self.db.execute("SELECT place_id, name, lat, lng, address, rating, categories, seen_at FROM pois "
+                               "WHERE seen_at > ?", (self.synced_at,)).fetchall()
+        for row in rows:
+            self._insert(Poi(*row[:6], categories=set(json.loads(row[6])), seen_at=row[7]))
+            self.synced_at = max(self.synced_at, row[7])
+        self.last_sync = time.time()
+        self.stats["synced"] += len(rows)
+
+    def _cell(self, lat: float, lng: float):
+        return int(math.floor(lat / self.cell_lat)), int(math.floor(lng / self.cell_lng))
+
+    def _insert(self, poi: Poi):
+        old = self.pois.get(poi.place_id)
+        if old:
+            self.grid.get(self._cell(old.lat, old.lng), {}).pop(old.place_id, None)
+            poi.categories |= old.categories
+        self.pois[poi.place_id] = poi
+        self.grid.setdefault(self._cell(poi.lat, poi.lng), {})[poi.place_id] = poi
+
+    # --- Ingestion ---
+    def ingest(self, results: list):
+        """Adds Places search results (raw 'results' dicts) to the snapshot, categorized by their Google types."""
+        now = time.time()
+        rows = []
+        for result in results:
+            location = result.get("geometry", {}).get("location", {})
+            if not result.get("place_id") or "lat" not in location:
+                continue
+            types = set(result.get("types", []))
+            categories = {key for key, (google_types, _) in POI_CATEGORIES.items() if types & set(google_types)}
+            poi = Poi(result["place_id"], result.get("name", "N/A"), location["lat"], location["lng"],
+                      result.get("vicinity", result.get("formatted_address")), result.get("rating"), categories, now)
+            self._insert(poi)
+            poi = self.pois[poi.place_id]
+            rows.append((poi.place_id, poi.name, poi.lat, poi.lng, poi.address, poi.rating,
+                         json.dumps(sorted(poi.categories)), now))
+        if rows:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO pois (place_id, name, lat, lng, address, rating, categories, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.stats["ingested"] += len(rows)
+
+    async def refresh(self, maps_client, anchors: list, categories: list = None):
+        """Runs one text search per category around each anchor (lat, lng, radius) and ingests the results."""
+        started = time.time()
+        failures = 0
+        for category in categories or list(POI_CATEGORIES):
+            for lat, lng, radius in anchors:
+                try:
+                    body = await maps_client.places(query=f"{category.replace('_', ' ')}, Liepāja", language='en',
+                                                    location=(lat, lng), radius=radius)
+                    if body.get("status") == "OK":
+                        self.ingest(body.get("results", []))
+                except Exception as e:
+                    failures += 1
+                    log.warning("POI index: refresh of '%s' near %s,%s failed: %s", category, lat, lng, e)
+        log.info("POI index refreshed: %d places, %d failed, %.1fs", len(self.pois), failures, time.time() - started)
+
+    async def run_forever(self, maps_client, anchors: list, interval: float, locks=None):
+        """
+        Background job: refresh the common categories now and then every interval seconds.
+        With locks (SharedLocks), only the worker that takes the interval's lease refreshes.
+        """
+        while True:
+            try:
+                if not locks or await locks.try_acquire("job:poi_refresh", ttl=interval * 0.9):
+                    await self.refresh(maps_client, anchors)
+            except Exception as e:
+                log.error("POI index refresh error: %s", e)
+            await asyncio.sleep(interval)
+
+    # --- Queries ---
+    def nearest(self, lat: float, lng: float, category: str, limit: int = 3, radius: float = 1500):
+        """
+        Returns up to `limit` (distance_m, Poi) of the category within `radius` metres, nearest first.
+        Searches ring by ring outwards and stops once no unvisited cell can hold anything closer.
+        """
+        row0, col0 = self._cell(lat, lng)
+        max_ring = int(math.ceil(radius / GRID_CELL_M)) + 1
+        found = []
+        for ring in range(max_ring + 1):
+            for row in range(row0 - ring, row0 + ring + 1):
+                for col in range(col0 - ring, col0 + ring + 1):
+                    if max(abs(row - row0), abs(col - col0)) != ring:
+                        continue # inner cells were visited in earlier rings
+                    for poi in self.grid.get((row, col), {}).values():
+                        if category in poi.categories:
+                            distance = distance_m(lat, lng, poi.lat, poi.lng)
+                            if distance <= radius:
+                                found.append((distance, poi))
+            found.sort(key=lambda item: item[0])
+            # Everything in later rings is at least ring * GRID_CELL_M away
+            if len(found) >= limit and found[limit - 1][0] <= ring * GRID_CELL_M:
+                break
+        return found[:limit]
+
+    def answer(self, lat: float, lng: float, category: str, limit: int = 3, radius: float = 1500):
+        """The `limit` nearest POIs when the snapshot has that many within radius, else None (ask Maps)."""
+        if time.time() - self.last_sync > SYNC_INTERVAL:
+            self.sync()
+        found = self.nearest(lat, lng, category, limit, radius)
+        if len(found) < limit:
+            self.stats["fallbacks"] += 1
+            return None
+        self.stats["local_answers"] += 1
+        return found
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "places": len(self.pois), "cells": len(self.grid)}
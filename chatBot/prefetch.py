@@ -0,0 +1,188 @@
+# prefetch.py
+
+# Speculative tool calls. From the moment a message arrives until the run's first
+# requires_action, the model is thinking and the server is idle. A keyword/regex intent
+# detector guesses the likely tool calls from the message text ("concerts this weekend",
+# "cafes near Karosta", "how do I get from Peter's Market to the beach") and starts
+# them right away. When the model then asks for the same call, its output is already
+# there (or on its way). Calls are compared by meaning, not by spelling: "Pētertirgus"
+# and "Peter's Market" are the same origin, "coffee shop" and "cafes" the same search.
+# Guesses the model doesn't ask for are cancelled (or dropped) and counted as wasted.
+
+import asyncio
+import json
+import logging
+import re
+
+from events_index import canonical_category, fold
+from gazetteer import CITY, HERE_NAMES, Gazetteer, normalize_place_name
+from poi_index import POI_CATEGORIES, category_for, stem_matches
+from telemetry import span
+from tool_cache import normalize_text
+
+log = logging.getLogger(__name__)
+
+MAX_PREFETCHES = 3 # per turn
+
+EVENT_WORDS = re.compile(r"\b(events?|happening|what'?s on|things to do|concerts?|festivals?|exhibitions?|gigs?|"
+                         r"pasakum\w*|koncert\w*|izstad\w*|festival\w*|izrad\w*)\b")
+ROUTE_WORDS = re.compile(r"\b(directions?|route|how (do|can|should) (i|we) get|how to get|way to|walk to|drive to|"
+                         r"get (me )?to|how far|how long)\b")
+DISTANCE_WORDS = re.compile(r"\b(how far|how long|distance)\b")
+FROM_TO = re.compile(r"\bfrom (.+?) to (.+)$")
+TO_FROM = re.compile(r"\bto (.+?) from (.+)$")
+TO_ONLY = re.compile(r"\bto (.+)$")
+AREA = re.compile(r"\b(?:near|around|close to|next to|by|in|at) (.+)$")
+TRAILING = re.compile(r"\s+(?:by|on|with) (?:car|foot|bike|bicycle|bus|tram|public transport)\b.*$|[?.!,;]+.*$")
+
+DATE_RANGES = [ # first match wins
+    (re.compile(r"\b(today|tonight|sodien|sovakar)\b"), "today"),
+    (re.compile(r"\b(tomorrow|rit)\b"), "tomorrow"),
+    (re.compile(r"\b(weekend|nogal\w*|brivdien\w*)\b"), "this_weekend"),
+    (re.compile(r"\bthis week\b"), "this_week"),
+]
+MODES = [
+    (re.compile(r"\b(walk\w*|on foot|kajam)\b"), "walking"),
+    (re.compile(r"\b(bike|bicycle|cycl\w*|ritenis|velo\w*)\b"), "bicycling"),
+    (re.compile(r"\b(bus|tram|transit|public transport|autobus\w*|tramvaj\w*)\b"), "transit"),
+]
+
+
+class Prefetcher:
+    """Guesses tool calls from a message and runs them ahead of the model; shared by all turns."""
+
+    def __init__(self, execute, gazetteer: Gazetteer, enabled: bool = True):
+        """execute(function_name, raw_arguments) runs one tool call (the tool dispatcher)."""
+        self.execute = execute
+        self.gazetteer = gazetteer
+        self.enabled = enabled
+        self.stats = {"started": 0, "used": 0, "wasted": 0, "cancelled": 0, "unpredicted_calls": 0}
+
+    # --- Call identity ---
+    def place_key(self, name: str | None) -> str:
+        key = normalize_place_name(name or "")
+        if key in HERE_NAMES:
+            return "@here"
+        landmark = self.gazetteer.match(name) if name else CITY
+        return f"@{landmark.name}" if landmark else key
+
+    def call_key(self, name: str, args: dict) -> str:
+        """Two calls with the same key give the same answer, however the arguments are worded."""
+        if name == "get_liepaja_events":
+            date_range = (args.get("date_range") or "next_7_days").strip().lower().replace(" ", "_")
+            category = args.get("category")
+            parts = [date_range, (canonical_category(category) or fold(category).strip()) if category else None]
+        elif name == "find_places_in_liepaja":
+            place_type = args.get("place_type") or ""
+            parts = [category_for(place_type) or normalize_text(place_type), self.place_key(args.get("area"))]
+        elif name in ("get_directions", "get_distance_time"):
+            parts = [self.place_key(args.get("origin")), self.place_key(args.get("destination")),
+                     (args.get("mode") or "driving").lower()]
+        else:
+            parts = [normalize_text(json.dumps(args, sort_keys=True, ensure_ascii=False))]
+        return json.dumps([name, *parts], ensure_ascii=False)
+
+    # --- Intent detection ---
+    def known_place(self, text: str, location) -> str | None:
+        """A gazetteer name (or 'near me'/'my location' when the app sent a location) for a phrase."""
+        text = TRAILING.sub("", text).strip()
+        if normalize_place_name(text) in HERE_NAMES:
+            return "here" if location else None
+        landmark = self.gazetteer.match(text)
+        return landmark.name if landmark else None
+
+    def predict(self, message: str, location=None) -> list:
+        """Likely (tool name, arguments) for a message, most likely first."""
+        text = " ".join(fold(message).replace("’", "'").split())
+        calls = []
+
+        if EVENT_WORDS.search(text):
+            date_range = next((value for pattern, value in DATE_RANGES if pattern.search(text)), "next_7_days")
+            categories = {canonical_category(word) for word in re.findall(r"[a-z]+", text)} - {None}
+            for category in sorted(categories)[:1]:
+                calls.append(("get_liepaja_events", {"date_range": date_range, "category": category}))
+            # The model doesn't always pass a category, and the plain query is a cheap local lookup
+            calls.append(("get_liepaja_events", {"date_range": date_range}))
+
+        elif ROUTE_WORDS.search(text):
+            origin = destination = None
+            for pattern, swap in ((FROM_TO, False), (TO_FROM, True)):
+                match = pattern.search(text)
+                if match:
+                    first, second = self.known_place(match.group(1), location), self.known_place(match.group(2), location)
+                    origin, destination = (second, first) if swap else (first, second)
+                    break
+            else:
+                match = TO_ONLY.search(text)
+                if match and location:
+                    origin, destination = "here", self.known_place(match.group(1), location)
+            if origin and destination:
+                origin = "my location" if origin == "here" else origin
+                destination = "my location" if destination == "here" else destination
+                mode = next((value for pattern, value in MODES if pattern.search(text)), "driving")
+                tool = "get_distance_time" if DISTANCE_WORDS.search(text) else "get_directions"
+                calls.append((tool, {"origin": origin, "destination": destination, "mode": mode}))
+
+        else:
+            words = re.findall(r"[a-z]+", text)
+            category = next((category for category, (_, stems) in POI_CATEGORIES.items()
+                             if any(stem_matches(word, stem) for word in words for stem in stems if " " not in stem)), None)
+            if category:
+                match = AREA.search(text)
+                area = self.known_place(match.group(1), location) if match else "Liepāja"
+                if area:
+                    calls.append(("find_places_in_liepaja", {"place_type": category.replace("_", " "),
+                                                             "area": "near me" if area == "here" else area}))
+        return calls[:MAX_PREFETCHES]
+
+    def begin(self, messages: list, location=None) -> "TurnPrefetch":
+        """Starts the predicted calls of a turn's message(s) in the background."""
+        prefetch = TurnPrefetch(self)
+        if self.enabled:
+            for message in messages:
+                for name, args in self.predict(message, location):
+                    prefetch.start(name, args)
+        return prefetch
+
+
+class TurnPrefetch:
+    """The prefetched calls of one turn; each can be claimed once."""
+
+    def __init__(self, prefetcher: Prefetcher):
+        self.prefetcher = prefetcher
+        self.tasks = {} # call key -> asyncio.Task returning (output, status)
+
+    def start(self, name: str, args: dict):
+        key = self.prefetcher.call_key(name, args)
+        if key in self.tasks or len(self.tasks) >= MAX_PREFETCHES:
+            return
+        self.prefetcher.stats["started"] += 1
+        log.debug("Prefetching %s %s", name, args)
+        self.tasks[key] = asyncio.create_task(self._run(name, args))
+
+    async def _run(self, name: str, args: dict):
+        with span(f"prefetch:{name}") as record:
+            output = await self.prefetcher.execute(name, json.dumps(args, ensure_ascii=False))
+            record.setdefault("status", "ok")
+        return output, record["status"]
+
+    def claim(self, name: str, raw_arguments: str | None):
+        """The running or finished prefetch task for this call, if it was guessed; else None."""
+        try:
+            args = json.loads(raw_arguments) if raw_arguments else {}
+        except json.JSONDecodeError:
+            return None
+        task = self.tasks.pop(self.prefetcher.call_key(name, args), None) if isinstance(args, dict) else None
+        self.prefetcher.stats["used" if task else "unpredicted_calls"] += 1
+        return task
+
+    def discard(self):
+        """Cancels whatever the model didn't ask for."""
+        for task in self.tasks.values():
+            self.prefetcher.stats["wasted"] += 1
+            if not task.done():
+                task.cancel()
+                self.prefetcher.stats["cancelled"] += 1
+            elif not task.cancelled():
+                task.exception() # retrieved, so a failed guess isn't reported as an unhandled error
+        self.tasks.clear()
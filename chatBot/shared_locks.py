@@ -0,0 +1,90 @@
+# shared_locks.py
+
+# Locks shared by every worker process on the machine, kept in the 'locks' table of the
+# SQLite database (WAL mode), so running several uvicorn workers needs no extra service.
+# A lock is a lease: it has an owner and an expiry, so a worker that dies while holding
+# one can't block the others for longer than the lease.
+#  - hold("thread:<id>") serializes runs on a thread across workers.
+#  - try_acquire("job:<name>", ttl=interval) without release makes one worker per
+#    interval run a background job (calendar crawl, places refresh).
+# Every statement runs on a worker thread: while another process holds SQLite's write
+# lock, waiting for it (up to the busy timeout) must not stall the event loop.
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+log = logging.getLogger(__name__)
+
+POLL_MIN = 0.05 # seconds between attempts while waiting for a lock, doubling up to POLL_MAX
+POLL_MAX = 0.5
+
+
+class SharedLocks:
+    def __init__(self, db_path: str):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self.db_lock = threading.Lock() # the connection is used from worker threads
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+        self.db.execute("DELETE FROM locks WHERE expires_at < ?", (time.time(),))
+        self.db.commit()
+        self.stats = {"acquired": 0, "contended": 0, "timeouts": 0}
+
+    async def try_acquire(self, name: str, ttl: float) -> bool:
+        """Takes (or renews) the lease if it is free, expired or already ours. Never waits for the holder."""
+        acquired = await asyncio.to_thread(self._try_acquire, name, ttl)
+        if acquired:
+            self.stats["acquired"] += 1
+        return acquired
+
+    def _try_acquire(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        with self.db_lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE locks.expires_at < ? OR locks.owner = excluded.owner",
+                (name, self.owner, now + ttl, now))
+            return cursor.rowcount > 0
+
+    async def release(self, name: str):
+        await asyncio.to_thread(self._release, name)
+
+    def _release(self, name: str):
+        with self.db_lock, self.db:
+            self.db.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, self.owner))
+
+    async def acquire(self, name: str, ttl: float, timeout: float):
+        """Waits up to timeout seconds for the lease; raises TimeoutError if another worker keeps it."""
+        deadline = time.monotonic() + timeout
+        delay = POLL_MIN
+        if await self.try_acquire(name, ttl):
+            return
+        self.stats["contended"] += 1
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            if await self.try_acquire(name, ttl):
+                return
+            delay = min(POLL_MAX, delay * 2)
+        self.stats["timeouts"] += 1
+        raise TimeoutError(f"Lock {name} is held by another worker")
+
+    @asynccontextmanager
+    async def hold(self, name: str, ttl: float, timeout: float):
+        await self.acquire(name, ttl, timeout)
+        try:
+            yield
+        finally:
+            await self.release(name)
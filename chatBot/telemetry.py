@@ -0,0 +1,191 @@
+# telemetry.py
+
+# Tracing spans, latency histograms and counters for the chat hot path, exported in the
+# Prometheus text format on /metrics (no client library needed).
+#  - span("thread_lookup") times a stage, feeds chatbot_stage_seconds{stage=...} and is
+#    attached to the current turn's trace, together with attributes such as upstream status.
+#  - Each turn's trace is logged as one JSON line, but only for a sample of turns, plus
+#    every slow or failed one, so logging stays cheap under load.
+
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+log = logging.getLogger("chatbot.trace")
+
+LOG_SAMPLE_RATE = float(os.getenv("TRACE_LOG_SAMPLE_RATE", "0.05")) # share of normal turns whose trace is logged
+SLOW_TURN_SECONDS = float(os.getenv("TRACE_SLOW_TURN_SECONDS", "10")) # slower turns are always logged
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _label_text(labelnames: tuple, values: tuple) -> str:
+    if not labelnames:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self.values = {} # label values -> float
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {} # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                labels = _label_text((*self.labelnames, "le"), (*key, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = [] # (prefix, label name, function returning a stats dict)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, snapshot, label: str | None = None):
+        """
+        Exports a component's stats dict (e.g. ToolCache.snapshot) as gauges named prefix_<key>.
+        With label set, snapshot returns {label value: stats dict} (e.g. one dict per pool).
+        """
+        self.collectors.append((prefix, label, snapshot))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for prefix, label, snapshot in self.collectors:
+            try:
+                stats = snapshot()
+            except Exception as e: # a component that isn't ready yet must not break /metrics
+                log.debug("Stats collector %s failed: %s", prefix, e)
+                continue
+            groups = stats.items() if label else [(None, stats)]
+            for group, values in groups:
+                labels = _label_text((label,), (group,)) if label else ""
+                for key, value in values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        lines.append(f"{prefix}_{key}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    "chatbot_stage_seconds", "Latency of each stage of a chat turn", ("stage",)))
+TOOL_CALLS = REGISTRY.add(Counter(
+    "chatbot_tool_calls_total", "Tool calls by tool and outcome", ("tool", "status")))
+UPSTREAM_SECONDS = REGISTRY.add(Histogram(
+    "chatbot_upstream_seconds", "Latency of upstream API requests", ("upstream", "endpoint")))
+UPSTREAM_REQUESTS = REGISTRY.add(Counter(
+    "chatbot_upstream_requests_total", "Upstream API requests by result status", ("upstream", "endpoint", "status")))
+TOKENS = REGISTRY.add(Counter(
+    "chatbot_tokens_total", "Tokens used by Assistant runs", ("kind",)))
+TURNS = REGISTRY.add(Counter(
+    "chatbot_turns_total", "Chat turns by final status", ("status",)))
+
+
+# --- Traces ---
+class Trace:
+    def __init__(self, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.attrs = attrs
+        self.spans = []
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+current_span: ContextVar[dict | None] = ContextVar("current_span", default=None)
+
+
+def start_trace(**attrs) -> Trace:
+    """Starts the trace of one chat turn; spans opened in this task and its child tasks join it."""
+    trace = Trace(**attrs)
+    current_trace.set(trace)
+    return trace
+
+
+def record_span(name: str, seconds: float, **attrs):
+    """Records a stage measured by the caller (e.g. between two stream events)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append({"name": name, "ms": round(seconds * 1000, 1), **attrs})
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Times the enclosed block as stage `name`. annotate() inside it adds attributes to it."""
+    record = dict(attrs)
+    token = current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        record_span(name, time.perf_counter() - started, **record)
+
+
+def annotate(**attrs):
+    """Adds attributes (e.g. upstream_status) to the innermost open span, if any."""
+    record = current_span.get()
+    if record is not None:
+        record.update(attrs)
+
+
+def end_trace(trace: Trace, status: str):
+    """Closes a turn's trace: counts it and logs it when sampled, slow or failed."""
+    total = time.perf_counter() - trace.started
+    STAGE_SECONDS.observe(total, stage="turn")
+    TURNS.inc(status=status)
+    unusual = status not in ("completed", "cached") or total > SLOW_TURN_SECONDS
+    if unusual or random.random() < LOG_SAMPLE_RATE:
+        log.log(logging.WARNING if unusual else logging.INFO, json.dumps({"trace_id": trace.trace_id, "status": status, "total_ms": round(total * 1000, 1),
+                             **trace.attrs, "spans": trace.spans}, ensure_ascii=False, default=str))
@@ -0,0 +1,10 @@
+# conftest.py
+
+# The service modules live side by side in chatBot/ and import each other by name,
+# the way uvicorn runs them, so the tests put that directory on the path.
+# Run from chatBot/: python -m pytest tests
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Rejected, peer_address, trusted_networks
+
+PROXIES = trusted_networks("10.0.0.1, 172.16.0.0/12")
+
+
+def test_forwarded_for_is_only_believed_from_trusted_proxies():
+    assert peer_address("203.0.113.5", "198.51.100.7", PROXIES) == "203.0.113.5"
+    assert peer_address("10.0.0.1", "198.51.100.7", PROXIES) == "198.51.100.7"
+    # A forged hop in front of the real one doesn't help: the nearest untrusted hop counts
+    assert peer_address("10.0.0.1", "1.2.3.4, 198.51.100.7, 172.16.5.5", PROXIES) == "198.51.100.7"
+    assert peer_address("10.0.0.1", None, PROXIES) == "10.0.0.1"
+    assert peer_address(None, None, PROXIES) == "unknown"
+
+
+def admitted(controller: AdmissionController, requests) -> int:
+    """How many (peer, client_id) requests get a slot, each released right away."""
+    async def scenario():
+        count = 0
+        for peer, client_id in requests:
+            try:
+                (await controller.acquire(peer, client_id)).release()
+                count += 1
+            except Rejected as e:
+                assert e.status_code == 429
+        return count
+    return asyncio.run(scenario())
+
+
+def test_new_client_ids_never_escape_the_peer_budget():
+    controller = AdmissionController(peer_rate=0.01, peer_burst=5, client_rate=0.01, client_burst=2)
+    assert admitted(controller, [("198.51.100.7", f"id-{i}") for i in range(20)]) == 5
+
+
+def test_client_id_splits_a_shared_address():
+    controller = AdmissionController(peer_rate=0.01, peer_burst=100, client_rate=0.01, client_burst=2)
+    # Two users behind one NAT each get their own bucket; without an id they share the address's
+    assert admitted(controller, [("198.51.100.7", "alice")] * 3 + [("198.51.100.7", "bob")] * 3) == 4
+    assert admitted(controller, [("203.0.113.5", None)] * 3) == 2
+
+
+def test_follow_ups_are_served_before_new_threads():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10, max_wait=5, client_rate=0, thread_rate=0,
+                                         peer_rate=0)
+        first = await controller.acquire("p")
+        order = []
+
+        async def request(name, thread_id):
+            ticket = await controller.acquire("p", thread_id=thread_id)
+            order.append(name)
+            ticket.release()
+
+        waiters = [asyncio.create_task(request("new", None)), asyncio.create_task(request("follow-up", "t1"))]
+        await asyncio.sleep(0)
+        first.release()
+        await asyncio.gather(*waiters)
+        return order, controller
+
+    order, controller = asyncio.run(scenario())
+    assert order == ["follow-up", "new"]
+    assert controller.active == 0 and controller.waiting == 0
+
+
+def test_full_queue_sheds_or_displaces_a_new_thread():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=1, max_wait=5, client_rate=0, thread_rate=0,
+                                         peer_rate=0)
+        holder = await controller.acquire("p")
+        new_thread = asyncio.create_task(controller.acquire("p"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as shed:
+            await controller.acquire("p") # another new thread: nobody to displace
+        follow_up = asyncio.create_task(controller.acquire("p", thread_id="t1"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as displaced:
+            await new_thread
+        holder.release()
+        (await follow_up).release()
+        return controller, shed.value, displaced.value
+
+    controller, shed, displaced = asyncio.run(scenario())
+    assert shed.status_code == 503 and shed.retry_after >= 1
+    assert displaced.status_code == 503
+    assert controller.stats["shed_queue_full"] == 1 and controller.stats["displaced"] == 1
+    assert controller.active == 0
+
+
+def test_waiting_too_long_is_shed_and_released_twice_is_harmless():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10, max_wait=0.05, client_rate=0, thread_rate=0,
+                                         peer_rate=0)
+        holder = await controller.acquire("p")
+        with pytest.raises(Rejected):
+            await controller.acquire("p")
+        holder.release()
+        holder.release()
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.stats["shed_timeout"] == 1
+    assert controller.active == 0 and controller.waiting == 0
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10, max_wait=5, client_rate=0, thread_rate=0,
+                                         peer_rate=0)
+        holder = await controller.acquire("p")
+        waiter = asyncio.create_task(controller.acquire("p"))
+        await asyncio.sleep(0)
+        waiter.cancel() # the client disconnected while queued
+        await asyncio.gather(waiter, return_exceptions=True)
+        holder.release()
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.active == 0 and controller.waiting == 0
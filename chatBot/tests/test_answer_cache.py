@@ -0,0 +1,61 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import answer_cache
+from answer_cache import AnswerCache, OPENING_HOURS_TTL, PLACE_TTL, normalize_question, seconds_until_midnight, ttl_for_tools
+
+RIGA = ZoneInfo("Europe/Riga")
+
+
+def test_questions_are_keyed_on_normalized_text():
+    assert normalize_question("What events are on THIS weekend?!") == "what events are on this weekend"
+    assert normalize_question("Kādi pasākumi šodien?") == "kadi pasakumi sodien"
+    assert normalize_question("?!") == ""
+
+
+def test_midnight_is_liepajas_not_the_servers():
+    # 23:30 UTC is already 02:30 the next day in Riga (summer time): 21.5 hours to go
+    now = datetime(2025, 7, 1, 23, 30, tzinfo=ZoneInfo("UTC")).timestamp()
+    assert seconds_until_midnight(now) == 21.5 * 3600
+    # The night clocks go forward has only 23 hours
+    now = datetime(2025, 3, 30, 0, 0, tzinfo=RIGA).timestamp()
+    assert seconds_until_midnight(now) == 23 * 3600
+
+
+def test_ttl_is_the_shortest_among_the_tools_used(monkeypatch):
+    monkeypatch.setattr(answer_cache, "seconds_until_midnight", lambda now=None: 100.0)
+    assert ttl_for_tools({"find_places_in_liepaja"}) == PLACE_TTL
+    assert ttl_for_tools({"find_places_in_liepaja", "check_opening_hours"}) == OPENING_HOURS_TTL
+    assert ttl_for_tools({"find_places_in_liepaja", "get_liepaja_events"}) == 100.0
+
+
+def test_exact_hit_after_rewording_punctuation_and_case():
+    cache = AnswerCache()
+    cache.set("Where can I eat sushi?", "Try X.", {"find_places_in_liepaja"})
+    assert cache.get("where can i eat SUSHI") == "Try X."
+    assert cache.get("where can i eat pizza") is None
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_expired_answers_are_not_served(monkeypatch):
+    cache = AnswerCache()
+    cache.set("what is on today", "A concert.", {"get_liepaja_events"})
+    expires_at = cache.entries["what is on today"][0]
+    monkeypatch.setattr(time, "time", lambda: expires_at + 1)
+    assert cache.get("what is on today") is None
+    assert cache.stats["expired"] == 1
+
+
+def test_similar_questions_must_agree_on_time_words():
+    cache = AnswerCache(similarity=0.6)
+    cache.set("what events are on this weekend", "Weekend list.", {"get_liepaja_events"})
+    assert cache.get("what events are there on this weekend") == "Weekend list."
+    assert cache.get("what events are on next weekend") is None
+
+
+def test_answers_are_shared_through_the_table(tmp_path):
+    db_path = str(tmp_path / "answers.db")
+    AnswerCache(db_path=db_path).set("museums near the beach", "The museum.", {"find_places_in_liepaja"})
+    other_worker = AnswerCache(db_path=db_path)
+    assert other_worker.get("Museums near the beach?") == "The museum."
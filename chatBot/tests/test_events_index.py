@@ -0,0 +1,76 @@
+import asyncio
+from datetime import date
+
+import httpx
+
+from bench.stub_servers import StubDelays, create_stub_app
+from events_index import EventsIndex, canonical_category
+
+DAY = date(2025, 6, 14)
+EVENTS_PER_DAY = 20 # the stub serves two pages of ten, then an empty one
+
+
+def crawl(db_path: str, *steps):
+    """Runs steps (async callables taking the index) against a fresh stub calendar; returns (index, stub)."""
+    stub = create_stub_app(StubDelays(events_page=0))
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://stub") as client:
+            index = EventsIndex(db_path, client, "http://stub/lv/", window_days=1)
+            for step in steps:
+                await step(index)
+            return index
+
+    return asyncio.run(scenario()), stub
+
+
+async def refresh(index):
+    await index.refresh_day(DAY)
+
+
+def test_first_crawl_parses_every_page(tmp_path):
+    index, stub = crawl(str(tmp_path / "events.db"), refresh)
+    assert index.stats["pages"] == 3
+    assert index.stats["parsed"] == 3
+    assert index.stats["days_rewritten"] == 1
+    total, events = index.query(DAY, DAY, limit=5)
+    assert total == EVENTS_PER_DAY and len(events) == 5
+
+
+def test_recrawl_is_conditional_and_keeps_the_day(tmp_path):
+    index, stub = crawl(str(tmp_path / "events.db"), refresh, refresh)
+    assert stub.state.counters["events_not_modified"] == 3 # every page answered 304
+    assert index.stats["parsed"] == 3 # only by the first crawl
+    assert index.stats["days_unchanged"] == 1
+    assert index.query(DAY, DAY)[0] == EVENTS_PER_DAY
+
+
+def test_unchanged_content_is_not_parsed_again_without_an_etag(tmp_path):
+    async def forget_etags(index):
+        with index.db:
+            index.db.execute("UPDATE event_pages SET etag = NULL")
+
+    index, stub = crawl(str(tmp_path / "events.db"), refresh, forget_etags, refresh)
+    assert stub.state.counters["events_not_modified"] == 0
+    assert index.stats["unchanged"] == 3 # same content hash as last time
+    assert index.stats["parsed"] == 3
+    assert index.stats["days_unchanged"] == 1
+
+
+def test_crawl_results_are_shared_through_the_table(tmp_path):
+    db_path = str(tmp_path / "events.db")
+    crawl(db_path, refresh)
+
+    async def ensure(index):
+        await index.ensure_days(DAY, DAY)
+
+    other_worker, stub = crawl(db_path, ensure)
+    assert stub.state.counters["events_pages"] == 0 # the day is fresh, nothing to fetch
+    assert other_worker.query(DAY, DAY)[0] == EVENTS_PER_DAY
+
+
+def test_categories_match_latvian_and_english_labels():
+    assert canonical_category("Koncerti") == "concerts"
+    assert canonical_category("Izstādes") == "exhibitions"
+    assert canonical_category("", "Rock koncerts pludmalē") == "concerts" # no label: the title decides
+    assert canonical_category("Dažādi") is None
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import place_store
+from place_store import (DAY_MINUTES, WEEK_MINUTES, PlaceDetails, PlaceStore, hours_intervals, open_state, parse_clock,
+                         parse_day, parse_moment, week_minute)
+
+MONDAY, SATURDAY, SUNDAY = 1, 6, 0
+
+
+def period(open_day, open_time, close_day, close_time):
+    return {"open": {"day": open_day, "time": open_time}, "close": {"day": close_day, "time": close_time}}
+
+
+def weekdays_nine_to_five():
+    return {"periods": [period(day, "0900", day, "1700") for day in range(1, 6)]}
+
+
+def test_hours_become_sorted_week_intervals():
+    assert hours_intervals(weekdays_nine_to_five())[0] == [week_minute(MONDAY, "0900"), week_minute(MONDAY, "1700")]
+    assert hours_intervals({}) is None
+    assert hours_intervals({"periods": [{"open": {"day": 0, "time": "0000"}}]}) == [[0, WEEK_MINUTES]]
+
+
+def test_saturday_night_wraps_into_sunday_morning():
+    intervals = hours_intervals({"periods": [period(SATURDAY, "2200", SUNDAY, "0300")]})
+    assert intervals == [[0, 3 * 60], [week_minute(SATURDAY, "2200"), WEEK_MINUTES]]
+    # Open at Saturday 23:00, and it closes at 03:00, not at midnight
+    assert open_state(intervals, week_minute(SATURDAY, "2300")) == (True, 3 * 60)
+
+
+def test_open_state_reports_the_next_change():
+    intervals = hours_intervals(weekdays_nine_to_five())
+    assert open_state(intervals, week_minute(MONDAY, "1000")) == (True, week_minute(MONDAY, "1700"))
+    assert open_state(intervals, week_minute(MONDAY, "1800")) == (False, week_minute(2, "0900"))
+    # After Friday's close the next opening is Monday, a week boundary later
+    assert open_state(intervals, week_minute(SATURDAY, "1200")) == (False, week_minute(MONDAY, "0900"))
+
+
+def test_describe_open_names_the_day_only_when_it_differs():
+    place = PlaceDetails("p1", "Cafe", hours=hours_intervals(weekdays_nine_to_five()))
+    assert place.describe_open(week_minute(MONDAY, "1000")) == "Yes (closes 17:00)"
+    assert place.describe_open(week_minute(SATURDAY, "1000")) == "No (opens Monday 09:00)"
+    assert PlaceDetails("p2", "Park").describe_open(0) is None
+    assert PlaceDetails("p3", "Shop", hours=[[0, WEEK_MINUTES]]).describe_open(DAY_MINUTES) == "Yes (open 24 hours)"
+
+
+def test_days_and_times_in_english_and_latvian():
+    assert parse_day(None, MONDAY) == 0
+    assert parse_day("tomorrow", MONDAY) == 1
+    assert parse_day("svētdien", MONDAY) == 6
+    assert parse_day("Monday", MONDAY) == 0
+    assert parse_day("next Monday", MONDAY) == 7
+    assert parse_clock("21:00") == (21, 0)
+    assert parse_clock("9.30 pm") == (21, 30)
+    assert parse_clock("12am") == (0, 0)
+    assert parse_clock("noon") == (12, 0)
+    for day in ("next week", "someday"):
+        with pytest.raises(ValueError):
+            parse_day(day, MONDAY)
+    for clock in ("25:00", "13pm", "late"):
+        with pytest.raises(ValueError):
+            parse_clock(clock)
+
+
+def test_moments_are_in_city_time(monkeypatch):
+    monkeypatch.setattr(place_store, "city_now", lambda: datetime(2025, 6, 16, 10, 15)) # a Monday
+    assert parse_moment() == (week_minute(MONDAY, "1015"), "now, Monday 10:15")
+    assert parse_moment("21:00", "tomorrow") == (week_minute(2, "2100"), "Tuesday 21:00")
+    with pytest.raises(ValueError):
+        parse_moment("25:00")
+
+
+def test_chain_names_are_ambiguous_until_an_address_picks_a_branch(tmp_path):
+    async def scenario():
+        store = PlaceStore(str(tmp_path / "places.db"))
+        store.remember_names([("a", "Rimi", "Graudu iela 1"), ("b", "Rimi", "Zivju iela 2"),
+                              ("c", "Kafejnīca Zītari", "Rožu laukums 3")])
+        before_write = store.place_id_for("Rimi"), store.place_id_for("Rimi", "Zivju iela 2")
+        await store.flush()
+        return before_write, PlaceStore(str(tmp_path / "places.db"))
+
+    (unwritten_chain, unwritten_branch), reopened = asyncio.run(scenario())
+    assert (unwritten_chain, unwritten_branch) == (None, "b")
+    assert reopened.place_id_for("Rimi") is None
+    assert reopened.place_id_for("rimi", "Graudu iela 1") == "a"
+    assert reopened.place_id_for("kafejnica zitari") == "c"
+    assert reopened.stats["ambiguous_names"] == 1
+
+
+def test_stored_details_are_read_back_until_they_are_stale(tmp_path):
+    async def scenario():
+        store = PlaceStore(str(tmp_path / "places.db"), max_age=60)
+        store.store("p1", {"name": "Cafe", "formatted_address": "Graudu iela 1",
+                           "opening_hours": weekdays_nine_to_five()}, asked_as=("the cafe", None))
+        await store.flush()
+        return PlaceStore(str(tmp_path / "places.db"), max_age=60)
+
+    reopened = asyncio.run(scenario())
+    place = reopened.lookup("the cafe")
+    assert place.name == "Cafe" and place.hours == hours_intervals(weekdays_nine_to_five())
+    reopened.places["p1"].fetched_at -= 120
+    with reopened.db:
+        reopened.db.execute("UPDATE place_details SET fetched_at = fetched_at - 120")
+    assert reopened.get("p1") is None
+    assert reopened.stats["stale"] == 1
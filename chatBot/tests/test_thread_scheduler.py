@@ -0,0 +1,123 @@
+import asyncio
+
+from thread_scheduler import ThreadScheduler
+
+
+class FakeEngine:
+    """A run engine whose runs finish when the test says so; records what each run was asked."""
+
+    def __init__(self, new_thread_id: str | None = None):
+        self.runs = []
+        self.release = asyncio.Event()
+        self.closed = 0
+        self.new_thread_id = new_thread_id
+
+    async def __call__(self, messages, thread_id, location):
+        self.runs.append(list(messages))
+        try:
+            if self.new_thread_id and not thread_id:
+                yield {"type": "thread", "thread_id": self.new_thread_id}
+            await self.release.wait()
+            yield {"type": "done", "answer": " / ".join(messages), "thread_id": thread_id or self.new_thread_id}
+        finally:
+            self.closed += 1
+
+
+class BusyLocks:
+    """SharedLocks stand-in: one name is held elsewhere for good."""
+
+    def __init__(self, busy: str):
+        self.busy = busy
+        self.held = set()
+
+    async def acquire(self, name, ttl, timeout=None):
+        if name == self.busy:
+            raise TimeoutError(name)
+        self.held.add(name)
+
+    async def release(self, name):
+        self.held.discard(name)
+
+
+def test_messages_during_a_run_are_coalesced_into_the_next_one():
+    async def scenario():
+        engine = FakeEngine()
+        scheduler = ThreadScheduler(engine)
+        first = scheduler.submit("t1", "a")
+        await asyncio.sleep(0)
+        second = scheduler.submit("t1", "b")
+        third = scheduler.submit("t1", "c")
+        assert second is third
+        engine.release.set()
+        return engine, scheduler, await first.result(), await third.result()
+
+    engine, scheduler, first, third = asyncio.run(scenario())
+    assert engine.runs == [["a"], ["b", "c"]]
+    assert first["answer"] == "a" and third["answer"] == "b / c"
+    assert scheduler.stats["coalesced"] == 1
+    assert scheduler.threads == {}
+
+
+def test_repeated_idempotency_key_replays_the_original_turn():
+    async def scenario():
+        engine = FakeEngine()
+        engine.release.set()
+        scheduler = ThreadScheduler(engine)
+        turn = scheduler.submit("t1", "hello", idempotency_key="k1")
+        answer = await turn.result()
+        return engine, scheduler.submit("t1", "hello", idempotency_key="k1"), turn, answer
+
+    engine, replayed, turn, answer = asyncio.run(scenario())
+    assert replayed is turn
+    assert engine.runs == [["hello"]]
+    assert answer["answer"] == "hello"
+
+
+def test_same_text_is_a_duplicate_only_without_a_key():
+    async def scenario():
+        engine = FakeEngine()
+        scheduler = ThreadScheduler(engine)
+        first = scheduler.submit("t1", "yes")
+        await asyncio.sleep(0)
+        unkeyed = scheduler.submit("t1", "yes") # a double submit of the running message
+        keyed = scheduler.submit("t1", "yes", idempotency_key="k2") # a second, deliberate "yes"
+        engine.release.set()
+        await keyed.result()
+        return engine, first, unkeyed, keyed
+
+    engine, first, unkeyed, keyed = asyncio.run(scenario())
+    assert unkeyed is first
+    assert keyed is not first
+    assert engine.runs == [["yes"], ["yes"]]
+
+
+def test_lock_timeout_closes_the_run_and_releases_its_locks():
+    async def scenario():
+        engine = FakeEngine(new_thread_id="t9")
+        locks = BusyLocks("thread:t9")
+        scheduler = ThreadScheduler(engine, locks=locks, lock_ttl=1)
+        answer = await scheduler.submit(None, "hi").result()
+        await asyncio.sleep(0) # let the run task's cleanup finish
+        return engine, locks, scheduler, answer
+
+    engine, locks, scheduler, answer = asyncio.run(scenario())
+    assert "still busy" in answer["answer"]
+    assert engine.closed == 1 # the engine's finally ran, not left to the garbage collector
+    assert locks.held == set()
+    assert scheduler.threads == {}
+
+
+def test_failing_run_still_answers_and_frees_the_thread():
+    async def failing(messages, thread_id, location):
+        raise RuntimeError("boom")
+        yield # an async generator, like the real engines
+
+    async def scenario():
+        scheduler = ThreadScheduler(failing)
+        answer = await scheduler.submit("t1", "hi").result()
+        await asyncio.sleep(0)
+        return scheduler, answer
+
+    scheduler, answer = asyncio.run(scenario())
+    assert answer["answer"] == "Sorry, the request failed."
+    assert scheduler.threads == {}
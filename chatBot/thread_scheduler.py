@@ -0,0 +1,210 @@
+# thread_scheduler.py
+
+# Sits in front of the run engine and decides when a message actually starts a run:
+#  - Runs are serialized per thread: OpenAI allows only one active run per thread.
+#  - Messages that arrive while a thread's run is active are coalesced into the thread's
+#    next run (one run answers all of them) instead of failing or queueing one run each.
+#  - Duplicate submissions (same Idempotency-Key, or, for clients that send no key, the same
+#    text again while the first copy is still being answered) attach to the original turn
+#    instead of starting another. A new key is always a new message, even a second "yes".
+# Runs execute in their own tasks, so a client disconnecting doesn't cancel a run
+# other requests are waiting on. With several worker processes, a shared lock per
+# thread (SharedLocks) also keeps runs of different workers on one thread apart.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = 600 # seconds a finished turn can still be replayed for a repeated key
+IDEMPOTENCY_MAX_KEYS = 10000
+DUPLICATE_WINDOW = 5 # seconds in which the same text on the same thread counts as a double submit (no key sent)
+
+
+class ThreadBusy(Exception):
+    """Another worker process kept the thread's lock for longer than we could wait."""
+
+
+class Turn:
+    """One run of the engine, answering one or more user messages. Fans its events out to every waiter."""
+
+    def __init__(self, thread_id: str | None, message: str, location=None):
+        self.thread_id = thread_id
+        self.messages = [message]
+        self.location = location
+        self.created_at = time.time()
+        self.events = []
+        self.finished = False
+        self.updated = asyncio.Event()
+        self.task = None
+        self.slots = set() # thread IDs this turn is the active run of
+
+    def add_message(self, message: str, location=None):
+        self.messages.append(message)
+        self.location = location or self.location
+
+    def publish(self, event: dict):
+        self.events.append(event)
+        if event["type"] == "done":
+            self.finished = True
+        # Wake everyone waiting, then start a fresh event for the next round of waits
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def stream(self):
+        """Yields every event of the turn from the beginning, then live ones until 'done'."""
+        sent = 0
+        while True:
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.finished:
+                return
+            await self.updated.wait()
+
+    async def result(self) -> dict:
+        async for event in self.stream():
+            if event["type"] == "done":
+                return {"answer": event["answer"], "thread_id": event["thread_id"]}
+        return {"answer": "Sorry, an unexpected error occurred.", "thread_id": self.thread_id}
+
+
+class ThreadScheduler:
+    def __init__(self, run_turn, locks=None, lock_ttl: float = 90):
+        """
+        run_turn(messages, thread_id, location) is the run engine: an async generator of event dicts.
+        locks (SharedLocks) makes the one-run-per-thread rule hold across worker processes;
+        lock_ttl must outlast the longest run.
+        """
+        self.run_turn = run_turn
+        self.locks = locks
+        self.lock_ttl = lock_ttl
+        self.threads = {} # thread_id -> {"active": Turn, "pending": Turn | None}
+        self.keys = OrderedDict() # idempotency key -> Turn
+        self.stats = {"runs": 0, "coalesced": 0, "duplicates": 0, "queued_behind_run": 0}
+
+    def submit(self, thread_id: str | None, message: str, location=None, idempotency_key: str | None = None) -> Turn:
+        """Returns the turn that will answer this message; starts a run only when the thread is idle."""
+        turn = self._lookup_key(idempotency_key)
+        if turn:
+            self.stats["duplicates"] += 1
+            return turn
+
+        state = self.threads.get(thread_id) if thread_id else None
+        if state is None:
+            turn = Turn(thread_id, message, location)
+            self._occupy(thread_id, turn)
+            self._start(turn)
+        else:
+            turn = None if idempotency_key else self._duplicate_of(state, message)
+            if turn:
+                self.stats["duplicates"] += 1
+            elif state["pending"]:
+                turn = state["pending"]
+                turn.add_message(message, location)
+                self.stats["coalesced"] += 1
+            else:
+                turn = state["pending"] = Turn(thread_id, message, location)
+                self.stats["queued_behind_run"] += 1
+
+        self._remember_key(idempotency_key, turn)
+        return turn
+
+    def _duplicate_of(self, state: dict, message: str) -> Turn | None:
+        now = time.time()
+        for turn in (state["active"], state["pending"]):
+            if turn and message in turn.messages and now - turn.created_at < DUPLICATE_WINDOW:
+                return turn
+        return None
+
+    def _lookup_key(self, key: str | None) -> Turn | None:
+        if not key:
+            return None
+        turn = self.keys.get(key)
+        if turn and time.time() - turn.created_at < IDEMPOTENCY_TTL:
+            return turn
+        return None
+
+    def _remember_key(self, key: str | None, turn: Turn):
+        if not key:
+            return
+        self.keys[key] = turn
+        self.keys.move_to_end(key)
+        while len(self.keys) > IDEMPOTENCY_MAX_KEYS:
+            self.keys.popitem(last=False)
+
+    def _occupy(self, thread_id: str | None, turn: Turn):
+        if thread_id and thread_id not in self.threads:
+            self.threads[thread_id] = {"active": turn, "pending": None}
+            turn.slots.add(thread_id)
+
+    def _start(self, turn: Turn):
+        self.stats["runs"] += 1
+        turn.task = asyncio.create_task(self._run(turn))
+
+    async def _run(self, turn: Turn):
+        held = None # name of the shared thread lock this run holds
+        events = None
+
+        async def hold(name: str):
+            nonlocal held
+            try:
+                await self.locks.acquire(name, self.lock_ttl, timeout=self.lock_ttl)
+            except TimeoutError:
+                raise ThreadBusy(name) from None
+            held = name
+
+        try:
+            if self.locks and turn.thread_id:
+                await hold(f"thread:{turn.thread_id}")
+            events = self.run_turn(list(turn.messages), turn.thread_id, turn.location)
+            async for event in events:
+                if event["type"] == "thread":
+                    # A new (or replaced) thread: follow-ups sent with its ID must wait for this run too
+                    turn.thread_id = event["thread_id"]
+                    self._occupy(turn.thread_id, turn)
+                    if self.locks and held != f"thread:{turn.thread_id}":
+                        if held:
+                            await self.locks.release(held)
+                            held = None
+                        await hold(f"thread:{turn.thread_id}")
+                turn.publish(event)
+        except ThreadBusy:
+            log.warning("Scheduler: thread %s stayed busy in another worker", turn.thread_id)
+            turn.publish({"type": "done", "answer": "Sorry, this conversation is still busy. Please try again.",
+                          "thread_id": turn.thread_id})
+        except Exception as e:
+            log.exception("Scheduler: run for thread %s failed: %s", turn.thread_id, e)
+        finally:
+            if events is not None:
+                # Left suspended on a lock timeout or error: let the engine's own cleanup run
+                try:
+                    await events.aclose()
+                except Exception as e:
+                    log.warning("Scheduler: closing the run for thread %s failed: %s", turn.thread_id, e)
+            if held:
+                await self.locks.release(held)
+            if not turn.finished:
+                turn.publish({"type": "done", "answer": "Sorry, the request failed.", "thread_id": turn.thread_id})
+            self._next(turn)
+
+    def _next(self, finished: Turn):
+        """Starts the run that was waiting behind the finished one, or forgets the idle thread."""
+        for thread_id in finished.slots:
+            state = self.threads[thread_id]
+            if state["pending"]:
+                state["active"], state["pending"] = state["pending"], None
+                state["active"].slots.add(thread_id)
+                self._start(state["active"])
+            else:
+                del self.threads[thread_id]
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "active_threads": len(self.threads),
+            "waiting_turns": sum(1 for state in self.threads.values() if state["pending"]),
+            "idempotency_keys": len(self.keys),
+        }
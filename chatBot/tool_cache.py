@@ -0,0 +1,153 @@
+# tool_cache.py
+
+# TTL + LRU cache for upstream tool results (Google Maps responses).
+#  - In memory: an OrderedDict in LRU order, bounded by max_entries.
+#  - Optional persistence: a 'tool_cache' table in the SQLite database, so entries survive restarts.
+#    New entries are written behind, in batches on a worker thread, so a write lock held by
+#    another worker process never stalls the event loop.
+#  - Single-flight: concurrent misses for the same key share one upstream call.
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+def normalize_text(value: str) -> str:
+    """Lower-cases, trims and collapses whitespace so equivalent queries share a key."""
+    value = unicodedata.normalize("NFC", str(value))
+    return " ".join(value.lower().split())
+
+
+def make_cache_key(namespace: str, params: dict) -> str:
+    """Builds a stable key from a namespace and request parameters (None values are ignored)."""
+    normalized = {k: normalize_text(v) if isinstance(v, str) else v for k, v in params.items() if v is not None}
+    return f"{namespace}:{json.dumps(normalized, sort_keys=True, ensure_ascii=False)}"
+
+
+class ToolCache:
+    def __init__(self, max_entries: int = 2048, db_path: str | None = None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (expires_at, value)
+        self.in_flight = {} # key -> asyncio.Task
+        self.stats = {"hits": 0, "misses": 0, "persistent_hits": 0, "coalesced": 0, "evictions": 0, "stores": 0}
+        self.db = None
+        self.pending = {} # key -> (value JSON, expires_at), stored but not yet written
+        self.writer = None # the write-behind task, while it runs
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS tool_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )""")
+            self.db.execute("DELETE FROM tool_cache WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+            # Only ever used by the write-behind task, on a worker thread
+            self.write_db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self.write_db.execute("PRAGMA synchronous=NORMAL")
+
+    # --- Lookup / store ---
+    def get(self, key: str):
+        """Returns the cached value or None. Checks memory first, then the database."""
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+            del self.entries[key]
+
+        if self.db:
+            row = self.db.execute("SELECT value, expires_at FROM tool_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.stats["persistent_hits"] += 1
+                return value
+        return None
+
+    def set(self, key: str, value, ttl: float):
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        self.stats["stores"] += 1
+        if self.db:
+            self.pending[key] = (json.dumps(value, ensure_ascii=False), expires_at)
+            if not self.writer or self.writer.done():
+                self.writer = asyncio.create_task(self._write_behind())
+
+    async def _write_behind(self):
+        while self.pending:
+            rows = [(key, value, expires_at) for key, (value, expires_at) in self.pending.items()]
+            self.pending = {}
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except sqlite3.Error as e:
+                log.warning("Tool cache: could not persist %d entries: %s", len(rows), e)
+
+    def _write_rows(self, rows: list):
+        with self.write_db:
+            self.write_db.executemany(
+                "INSERT OR REPLACE INTO tool_cache (cache_key, value, expires_at) VALUES (?, ?, ?)", rows)
+
+    async def flush(self):
+        """Waits until every stored entry is in the table (on shutdown)."""
+        if self.writer:
+            await self.writer
+
+    def _remember(self, key: str, value, expires_at: float):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # --- Read-through with single-flight ---
+    async def get_or_compute(self, key: str, ttl: float, compute, should_cache=lambda value: True):
+        """
+        Returns the cached value for key, or awaits compute() once and caches its result.
+        Callers that miss while the same key is already being computed wait for that call.
+        Results rejected by should_cache (e.g. upstream errors) are returned but not stored.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        task = self.in_flight.get(key)
+        if task:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task)
+
+        self.stats["misses"] += 1
+
+        async def load():
+            try:
+                result = await compute()
+                if result is not None and should_cache(result):
+                    self.set(key, result, ttl)
+                return result
+            finally:
+                self.in_flight.pop(key, None)
+
+        task = asyncio.create_task(load())
+        # Every waiter may be gone (cancelled) by the time it fails; don't log it as never retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.in_flight[key] = task
+        # Shielded, so one caller being cancelled doesn't cancel the shared upstream call
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "in_flight": len(self.in_flight),
+            "hit_rate": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 3) if lookups else 0.0,
+        }